@@ -0,0 +1,66 @@
+# how much memory the AST of a big generated program holds on to
+#
+#   python benchmarks/ast_memory.py [statements]
+import os
+import sys
+import gc
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from parser import parser, Parser
+import syntax
+
+
+# cycles through a handful of statement shapes so every node kind shows up
+def generate(n: int) -> str:
+    shapes = [
+        "let a{i} = {i} + {i} * 2 - 1;",
+        "let f{i} = fn(x, y) {{ if (x <= y) {{ x % 3; }} else {{ y / 2; }}; }};",
+        "let s{i} = [a{j}, \"s{i}\", true, {{\"k\": a{j}}}][0];",
+        "puts(f{k}(a{j}, {i}), len(\"abc\"));",
+        "let w{i} = while (a{j} == 0) {{ a{j} = a{j} + 1; }};",
+    ]
+    out = []
+    for i in range(n):
+        shape = shapes[i % len(shapes)]
+        # only refer to things defined earlier in the cycle
+        base = i - i % len(shapes)
+        out.append(shape.format(i=i, j=base, k=base + 1))
+    return "\n".join(out)
+
+
+def count_nodes(x) -> int:
+    match x:
+        case list():
+            return sum(count_nodes(s) for s in x)
+        case dict():
+            return sum(count_nodes(k) + count_nodes(v) for k, v in x.items())
+        case syntax.Exp() | syntax.Stmt():
+            n = 1
+            for cls in type(x).__mro__:
+                for attr in getattr(cls, "__slots__", ()):
+                    n += count_nodes(getattr(x, attr, None))
+            return n
+    return 0
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    tree = parser.parse(generate(n))
+
+    gc.collect()
+    tracemalloc.start()
+    ast = Parser().transform(tree)
+    del tree
+    gc.collect()
+    size, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    nodes = count_nodes(ast)
+    print(f"{n} statements, {nodes} nodes")
+    print(f"ast: {size / 2**20:.1f} MiB, {size / nodes:.1f} bytes per node (peak {peak / 2**20:.1f} MiB)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+# how hard the workloads below make python's cyclic garbage collector work:
+# collections per generation, how long they paused the program and how many
+# objects only they could free
+#
+#   python benchmarks/gc_pauses.py                        this checkout
+#   python benchmarks/gc_pauses.py --root ../old          another one, to compare
+#   python benchmarks/gc_pauses.py --engine vm --n 20000
+#
+# anything reference counting frees never shows up here, garbage that's
+# in a cycle waits for a collection (and makes gen2 ones longer)
+import os
+import sys
+import io
+import gc
+import time
+import contextlib
+from argparse import ArgumentParser
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+# a recursive helper made on every call
+def helpers(n: int) -> str:
+    return f"""
+let sum_to = fn(k) {{
+    let go = fn(i, acc) {{ if (i == 0) {{ acc; }} else {{ go(i - 1, acc + i); }}; }};
+    go(k, 0);
+}};
+let i = 0;
+let s = 0;
+while (i <= {n}) {{
+    s = s + sum_to(5);
+    i = i + 1;
+}};
+puts(s);
+"""
+
+
+# functions made in a loop at the top level
+def loop_functions(n: int) -> str:
+    return f"""
+let i = 0;
+let s = 0;
+while (i <= {n}) {{
+    let k = i % 10;
+    let down = fn(j) {{ if (j == 0) {{ k; }} else {{ down(j - 1); }}; }};
+    let add = fn(x) {{ x + k; }};
+    s = s + down(3) + add(1);
+    i = i + 1;
+}};
+puts(s);
+"""
+
+
+# a closure with state of its own, made and thrown away over and over
+def counters(n: int) -> str:
+    return f"""
+let make = fn(step) {{
+    let count = 0;
+    fn() {{ count = count + step; count; }};
+}};
+let i = 0;
+let s = 0;
+while (i <= {n}) {{
+    let c = make(i % 3);
+    c();
+    s = s + c();
+    i = i + 1;
+}};
+puts(s);
+"""
+
+
+WORKLOADS = {"helpers": helpers, "loop_functions": loop_functions, "counters": counters}
+
+
+class Collections:
+    counts: list[int]
+    pauses: list[float]
+    longest: list[float]
+    collected: int
+    started: float
+
+    def __init__(self):
+        self.counts = [0, 0, 0]
+        self.pauses = [0.0, 0.0, 0.0]
+        self.longest = [0.0, 0.0, 0.0]
+        self.collected = 0
+        self.started = 0.0
+
+    def __call__(self, phase: str, info: dict) -> None:
+        if phase == "start":
+            self.started = time.perf_counter()
+            return
+        gen = info["generation"]
+        pause = time.perf_counter() - self.started
+        self.counts[gen] += 1
+        self.pauses[gen] += pause
+        self.longest[gen] = max(self.longest[gen], pause)
+        self.collected += info["collected"]
+
+
+def run(engine: str, src: str) -> tuple[Collections, float]:
+    import main
+    import eval, static, vm
+    from closure_compiler import ClosureCompiler
+
+    ast, size = main.front_end(src, "lark")
+    globals = eval.make_global_slots(static.make_global_env())
+    stats = Collections()
+    gc.collect()
+    gc.callbacks.append(stats)
+    start = time.perf_counter()
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            match engine:
+                case "interp":
+                    eval.Interp(eval.Frame(globals, None)).block(ast, size)
+                case "closure":
+                    ClosureCompiler().block(ast, size)([globals])
+                case "vm":
+                    vm.VM().run(vm.compile_program(ast, size), globals)
+        elapsed = time.perf_counter() - start
+    finally:
+        gc.callbacks.remove(stats)
+    return stats, elapsed
+
+
+def main():
+    args = ArgumentParser()
+    args.add_argument("--root", default=os.path.dirname(HERE), help="the checkout to measure")
+    args.add_argument("--engine", default="interp", choices=["interp", "closure", "vm"])
+    args.add_argument("--n", type=int, default=10000)
+    args.add_argument("--only", help="comma separated workload names")
+    args = args.parse_args()
+
+    sys.path.insert(0, os.path.abspath(args.root))
+    sys.setrecursionlimit(10000)
+    names = args.only.split(",") if args.only else list(WORKLOADS)
+
+    ms = lambda t: f"{t * 1000:9.2f}"
+    print(f"{'workload':<16}{'gen0':>6}{'gen1':>6}{'gen2':>6}{'gen2 ms':>10}{'max ms':>10}{'all ms':>10}{'freed':>10}{'run ms':>10}")
+    for name in names:
+        stats, elapsed = run(args.engine, WORKLOADS[name](args.n))
+        print(
+            f"{name:<16}"
+            + "".join(f"{c:6}" for c in stats.counts)
+            + f" {ms(stats.pauses[2])} {ms(max(stats.longest))} {ms(sum(stats.pauses))}"
+            + f"{stats.collected:10} {ms(elapsed)}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+# parse throughput of the lark front end (parse tree + Parser transformer)
+# against pratt.py, and a check that both give the same AST for every example
+# and for the generated program
+#
+#   python benchmarks/parse_speed.py [statements]
+import os
+import sys
+import glob
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from parser import parser, Parser
+import pratt
+import syntax
+from ast_memory import generate
+
+
+def with_lark(src: str):
+    return Parser().transform(parser.parse(src))
+
+
+def timed(parse, src: str):
+    start = time.perf_counter()
+    ast = parse(src)
+    return ast, time.perf_counter() - start
+
+
+def same(src: str) -> bool:
+    return syntax.same(with_lark(src), pratt.parse(src))
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    src = generate(n)
+    size = len(src) / 2**20
+
+    print(f"{n} statements, {size:.1f} MiB")
+    lark_ast, lark_time = timed(with_lark, src)
+    pratt_ast, pratt_time = timed(pratt.parse, src)
+    for name, t in [("lark", lark_time), ("pratt", pratt_time)]:
+        print(f"  {name:<6} {t:7.3f}s  {n / t:9.0f} statements/s  {size / t:6.2f} MiB/s")
+    print(f"  pratt is {lark_time / pratt_time:.1f}x faster")
+
+    sources = sorted(glob.glob(os.path.join(ROOT, "examples", "**", "*.monkey"), recursive=True))
+    different = [path for path in sources if not same(open(path).read())]
+    if not syntax.same(lark_ast, pratt_ast):
+        different.append("<generated>")
+    print(f"identical ASTs: {len(sources) + 1 - len(different)} of {len(sources) + 1}")
+    for path in different:
+        print(f"  differs: {path}")
+    sys.exit(1 if different else 0)
+
+
+if __name__ == "__main__":
+    main()
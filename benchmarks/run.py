@@ -0,0 +1,185 @@
+# times every phase of the interpreter on the workloads in workloads.py
+#
+#   python benchmarks/run.py                            everything, small and medium
+#   python benchmarks/run.py --sizes large --only fib   just some of it
+#   python benchmarks/run.py --json now.json            save the results
+#   python benchmarks/run.py --baseline then.json       compare against saved ones
+#   python benchmarks/run.py --no-memo                  calls without pure.py's memos
+#
+# each phase is timed on its own, best and median of --repeat runs. exits
+# non-zero when a phase got slower than --threshold or a program's output
+# changed compared to the baseline
+import os
+import sys
+import io
+import json
+import time
+import platform
+import statistics
+import subprocess
+import contextlib
+from argparse import ArgumentParser
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from parser import parser, Parser
+import eval, static
+from eval import Interp, Frame
+from static import Anal
+from fold import Fold
+from infer import Infer
+from hoist import Hoist
+from pure import Purity
+from lower import IR_Transformer, allocate_temps
+from workloads import WORKLOADS
+
+PHASES = ["lex", "parse", "transform", "analyse", "fold", "infer", "hoist", "pure", "lower", "cfg", "interp"]
+
+# differences smaller than this are noise, whatever the ratio
+NOISE = 0.001
+
+
+# one pass through the pipeline, giving back the time of each phase and
+# what the program printed
+def run_once(src: str) -> tuple[dict[str, float], str]:
+    times = {}
+
+    def phase(name, f, *args):
+        start = time.perf_counter()
+        ret = f(*args)
+        times[name] = time.perf_counter() - start
+        return ret
+
+    phase("lex", lambda: list(parser.lex(src)))
+    tree = phase("parse", parser.parse, src)
+    ast = phase("transform", Parser().transform, tree)
+    size = phase("analyse", Anal([static.make_global_env()]).block, ast)
+    phase("fold", Fold().program, ast)
+    phase("infer", Infer().program, ast)
+    size = phase("hoist", Hoist().program, ast, size)
+    phase("pure", Purity(static.make_global_env()).program, ast)
+    ir = IR_Transformer()
+    phase("lower", ir.lower_block, ast)
+    phase("cfg", allocate_temps, ir.stmts)
+
+    interp = Interp(Frame(eval.make_global_slots(static.make_global_env()), None))
+    out = io.StringIO()
+    with contextlib.redirect_stdout(out):
+        phase("interp", interp.block, ast, size)
+    return times, out.getvalue()
+
+
+def measure(src: str, repeat: int) -> dict:
+    runs = []
+    output = None
+    for _ in range(repeat):
+        times, output = run_once(src)
+        runs.append(times)
+    return {
+        "phases": {
+            name: {
+                "min": min(r[name] for r in runs),
+                "median": statistics.median(r[name] for r in runs),
+            }
+            for name in PHASES
+        },
+        "output": output,
+    }
+
+
+def meta() -> dict:
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True
+        ).stdout.strip()
+    except OSError:
+        commit = ""
+    return {
+        "commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+
+
+def ms(t: float) -> str:
+    return f"{t * 1000:9.2f}"
+
+
+def print_header() -> None:
+    print(f"{'workload':<20}" + "".join(f"{p:>10}" for p in PHASES) + "   (best of each, ms)")
+
+
+def print_row(name: str, result: dict) -> None:
+    print(f"{name:<20}" + "".join(f" {ms(result['phases'][p]['min'])}" for p in PHASES))
+
+
+# current vs baseline on best times, gives back whether anything got worse
+def compare(results: dict, baseline: dict, threshold: float) -> bool:
+    worse = False
+    print()
+    print(f"against baseline {baseline['meta'].get('commit') or '?'} ({baseline['meta'].get('time', '?')})")
+    print(f"{'workload':<20}" + "".join(f"{p:>10}" for p in PHASES) + "   (now / baseline)")
+    for name, result in results.items():
+        before = baseline["results"].get(name)
+        if before is None:
+            continue
+        cells = []
+        for p in PHASES:
+            if p not in before["phases"]:
+                # phases the baseline didn't have yet
+                cells.append(f"{'-':>9} ")
+                continue
+            now, then = result["phases"][p]["min"], before["phases"][p]["min"]
+            ratio = now / then if then else float("inf")
+            slower = ratio > 1 + threshold and now - then > NOISE
+            worse |= slower
+            cells.append(f"{ratio:8.2f}{'!' if slower else ' '} ")
+        line = f"{name:<20}" + "".join(cells)
+        if result["output"] != before["output"]:
+            line += "  output changed"
+            worse = True
+        print(line)
+    return worse
+
+
+def main():
+    args = ArgumentParser()
+    args.add_argument("--sizes", default="small,medium", help="comma separated: small, medium, large")
+    args.add_argument("--only", help="comma separated workload names")
+    args.add_argument("--repeat", type=int, default=5)
+    args.add_argument("--json", help="write the results here")
+    args.add_argument("--baseline", help="results from an earlier --json to compare with")
+    args.add_argument("--threshold", type=float, default=0.10, help="how much slower counts as a regression")
+    args.add_argument("--no-memo", action="store_true", help="don't memoize pure functions")
+    args = args.parse_args()
+    eval.AUTO_MEMO = not args.no_memo
+
+    sizes = args.sizes.split(",")
+    names = args.only.split(",") if args.only else list(WORKLOADS)
+
+    results = {}
+    print_header()
+    for name in names:
+        program, ns = WORKLOADS[name]
+        for size in sizes:
+            key = f"{name}/{size}"
+            results[key] = measure(program(ns[size]), args.repeat)
+            results[key]["n"] = ns[size]
+            print_row(key, results[key])
+
+    report = {"meta": meta(), "results": results}
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+# wall clock of `python main.py` on a one line script, which is mostly startup
+#
+#   python benchmarks/startup.py [runs]
+import os
+import sys
+import shutil
+import statistics
+import subprocess
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TABLES = os.path.join(ROOT, "__monkeycache__", "grammar.lark")
+
+
+def run(script: str, *flags: str) -> float:
+    start = time.perf_counter()
+    subprocess.run(
+        [sys.executable, os.path.join(ROOT, "main.py"), script, *flags],
+        check=True,
+        stdout=subprocess.DEVNULL,
+    )
+    return time.perf_counter() - start
+
+
+def report(name: str, times: list[float]) -> None:
+    print(f"  {name:<34} min {min(times):.3f}s  median {statistics.median(times):.3f}s")
+
+
+def time_python() -> float:
+    start = time.perf_counter()
+    subprocess.run([sys.executable, "-c", "pass"], check=True)
+    return time.perf_counter() - start
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    workdir = tempfile.mkdtemp()
+    script = os.path.join(workdir, "hello.monkey")
+    with open(script, "w") as f:
+        f.write('puts("hello");\n')
+
+    try:
+        print(f"python main.py hello.monkey, {runs} runs each")
+        # what every run used to cost: the grammar built from scratch
+        before = []
+        for _ in range(runs):
+            if os.path.exists(TABLES):
+                os.remove(TABLES)
+            before.append(run(script, "--no-cache"))
+        report("building the grammar", before)
+        report("prebuilt parser tables", [run(script, "--no-cache") for _ in range(runs)])
+        # the program itself cached too, the parser is never imported
+        run(script)
+        report("prebuilt tables + __monkeycache__", [run(script) for _ in range(runs)])
+        report("python -c pass", [time_python() for _ in range(runs)])
+    finally:
+        shutil.rmtree(workdir)
+
+
+
+if __name__ == "__main__":
+    main()
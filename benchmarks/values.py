@@ -0,0 +1,121 @@
+# bytes per runtime value and value allocations per loop iteration, for the
+# current eval.py next to the old way (a __dict__ per value, a fresh object
+# for every Num/Bool/Unit)
+#
+#   python benchmarks/values.py [iterations]
+import os
+import sys
+import io
+import contextlib
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from parser import parser, Parser
+import eval, static, syntax
+from eval import Interp, Frame
+from static import Anal
+from fold import Fold
+
+
+LOOP = """
+let i = 0;
+let s = 0;
+while (i <= {n}) {{
+    s = s + i % 7;
+    i = i + 1;
+}};
+puts(s);
+"""
+
+
+# what the values looked like before: no slots, nothing shared
+class DictValue:
+    def __init__(self, v):
+        self.value = v
+
+
+# measured over many instances, since getsizeof can't see how python 3.11
+# stores an object's __dict__
+def size_of(make) -> float:
+    count = 10000
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    keep = [make(i) for i in range(count)]
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    # shared instances cost nothing
+    return max(0.0, (after - before - sys.getsizeof(keep)) / count)
+
+
+def old_closure(i):
+    c = DictValue(None)
+    c.parameters, c.body, c.body_size, c.env = [], [], 0, None
+    return c
+
+
+def sizes() -> None:
+    frame = Frame([], None)
+    values = [
+        ("Num", lambda i: eval.Num(100000 + i), lambda i: DictValue(100000 + i)),
+        ("Bool", lambda i: eval.Bool(i % 2 == 0), lambda i: DictValue(i % 2 == 0)),
+        ("String", lambda i: eval.String("hi"), lambda i: DictValue("hi")),
+        ("Closure", lambda i: eval.Closure([], [], 0, frame), old_closure),
+        ("PrimOp", lambda i: eval.PrimOp(print), lambda i: DictValue(print)),
+    ]
+    print("bytes per value    before  after")
+    for name, new, old in values:
+        print(f"  {name:<14} {size_of(old):>8.1f} {size_of(new):>6.1f}")
+
+
+# the places the old interpreter made a new value: literals, arithmetic,
+# loops and blocks ending in a statement. counts those, and how many of them
+# still come out as a new object
+class CountingInterp(Interp):
+    made: int
+    fresh: int
+
+    def __init__(self, env: Frame):
+        super().__init__(env)
+        self.made = 0
+        self.fresh = 0
+        self.shared = {id(v) for v in eval.SMALL_NUMS + [eval.TRUE, eval.FALSE, eval.UNIT]}
+
+    def count(self, v) -> None:
+        self.made += 1
+        self.fresh += id(v) not in self.shared
+
+    def eval(self, e):
+        v = super().eval(e)
+        if isinstance(e, ALLOCATING):
+            self.count(v)
+        return v
+
+    def block(self, b, size):
+        v = super().block(b, size)
+        if not b or not isinstance(b[-1], syntax.NakedExp):
+            self.count(v)
+        return v
+
+
+ALLOCATING = (syntax.Unit, syntax.Bool, syntax.Num, syntax.String, syntax.BinOp, syntax.While)
+
+
+def allocations(n: int) -> None:
+    ast = Parser().transform(parser.parse(LOOP.format(n=n)))
+    size = Anal([static.make_global_env()]).block(ast)
+    Fold().program(ast)
+    interp = CountingInterp(Frame(eval.make_global_slots(static.make_global_env()), None))
+    with contextlib.redirect_stdout(io.StringIO()):
+        interp.block(ast, size)
+    print(f"values per iteration  before {interp.made / n:.2f}  after {interp.fresh / n:.2f}")
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    sizes()
+    allocations(n)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+# monkey programs for benchmarks/run.py, each one a function of a size n so
+# the same workload can be timed small and large. the output is deterministic,
+# so a run can also be checked against the previous one
+
+
+def fib(n: int) -> str:
+    return f"""
+let fib = fn(k) {{ if (k <= 1) {{ k; }} else {{ fib(k - 1) + fib(k - 2); }}; }};
+puts(fib({n}));
+"""
+
+
+def loop_sum(n: int) -> str:
+    return f"""
+let i = 0;
+let s = 0;
+while (i <= {n}) {{
+    s = s + i % 7;
+    i = i + 1;
+}};
+puts(s);
+"""
+
+
+# every call goes through a closure and updates a captured variable
+def counters(n: int) -> str:
+    return f"""
+let make = fn(step) {{
+    let count = 0;
+    fn() {{ count = count + step; count; }};
+}};
+let a = make(1);
+let b = make(2);
+let c = make(3);
+let i = 0;
+let last = 0;
+while (i <= {n}) {{
+    last = a() + b() + c();
+    i = i + 1;
+}};
+puts(last);
+"""
+
+
+# hashes can't be assigned into, so building one means a literal of n pairs
+def hashmap(n: int) -> str:
+    pairs = ", ".join(f'"k{i}": {i}' for i in range(n))
+    return f"""
+let h = {{{pairs}}};
+let keys = [{", ".join(f'"k{i}"' for i in range(n))}];
+let i = 0;
+let s = 0;
+while (i <= {n - 1}) {{
+    s = s + h[keys[i]];
+    i = i + 1;
+}};
+puts(s, len(h));
+"""
+
+
+# len gives back a python int that arithmetic won't take, so the size is
+# spelled out
+def arrays(n: int) -> str:
+    return f"""
+let a = [{", ".join(str(i % 100) for i in range(n))}];
+let size = {n};
+let i = 0;
+let s = 0;
+while (i <= 4 * size - 1) {{
+    s = s + a[i % size] * 2;
+    i = i + 1;
+}};
+puts(s);
+"""
+
+
+# a pure function called over and over with a handful of different
+# arguments, what pure.py memoizes
+def fizz(n: int) -> str:
+    return f"""
+let fizzbuz = fn(x) {{
+    if (x % 15 == 0) {{ 15; }}
+    else if (x % 5 == 0) {{ 5; }}
+    else if (x % 3 == 0) {{ 3; }}
+    else {{ 0; }};
+}};
+let i = 0;
+let s = 0;
+while (i <= {n}) {{
+    s = s + fizzbuz(i % 30);
+    i = i + 1;
+}};
+puts(s);
+"""
+
+
+# loops inside a function whose bounds and part of every step come from its
+# arguments, what hoist.py takes out of the loop
+def invariant(n: int) -> str:
+    return f"""
+let scale = fn(k, m) {{
+    let i = 0;
+    let s = 0;
+    while (i <= m * 10 - 1) {{
+        s = s + i * (k * k + 1) + k * 2;
+        i = i + 1;
+    }};
+    s;
+}};
+puts(scale(3, {n // 10}));
+"""
+
+
+# name -> (program, {size name: n})
+WORKLOADS = {
+    "fib": (fib, {"small": 12, "medium": 17, "large": 21}),
+    "loop_sum": (loop_sum, {"small": 2000, "medium": 20000, "large": 100000}),
+    "counters": (counters, {"small": 500, "medium": 5000, "large": 25000}),
+    "hashmap": (hashmap, {"small": 500, "medium": 5000, "large": 20000}),
+    "arrays": (arrays, {"small": 500, "medium": 5000, "large": 20000}),
+    "fizz": (fizz, {"small": 2000, "medium": 20000, "large": 100000}),
+    "invariant": (invariant, {"small": 2000, "medium": 20000, "large": 100000}),
+}
@@ -0,0 +1,230 @@
+import hashlib
+import importlib.util
+import marshal
+import os
+import tempfile
+from types import CodeType
+from typing import Optional
+from syntax import Stmt
+import syntax
+
+# __monkeycache__, next to the script like __pycache__: the analysed AST, the
+# lowered IR and the python code of a program, so running an unchanged script
+# skips the front end. entries are keyed by the source and by the interpreter
+# that made them, a stale one is simply never asked for again and ages out
+
+# bump when the output changes without any of the files below changing
+VERSION = 2
+
+# everything that decides what gets cached, editing one of them starts over
+SOURCES = ["syntax.py", "eval.py", "parser.py", "pratt.py", "static.py", "fold.py", "infer.py", "hoist.py", "pure.py", "lower.py", "optimize.py", "pygen.py"]
+
+# least recently used entries go once the directory is bigger than this
+LIMIT = 32 * 2**20
+
+MAGIC = b"MONKEY\0"
+
+
+def fingerprint(files: list[str]) -> bytes:
+    here = os.path.dirname(os.path.abspath(__file__))
+    h = hashlib.sha256(f"{VERSION}\0".encode())
+    # code objects only load on the python that made them
+    h.update(importlib.util.MAGIC_NUMBER)
+    for name in files:
+        with open(os.path.join(here, name), "rb") as f:
+            h.update(f.read())
+    return h.digest()
+
+
+class DiskCache:
+    directory: str
+    limit: int
+    # goes into every key, so another interpreter never sees these entries
+    salt: bytes
+    # bytes in the directory, going by our own writes since it was last
+    # listed. None until the first put lists it
+    size: Optional[int]
+
+    def __init__(self, directory: str, salt: bytes, limit: int = LIMIT):
+        self.directory = directory
+        self.salt = salt
+        self.limit = limit
+        self.size = None
+
+    def path(self, src: str, kind: str) -> str:
+        key = hashlib.sha256(self.salt + f"{kind}\0{src}".encode()).hexdigest()
+        return os.path.join(self.directory, f"{key}.{kind}")
+
+    def get(self, src: str, kind: str) -> Optional[bytes]:
+        path = self.path(src, kind)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            # a hit counts as a use for eviction
+            os.utime(path)
+        except OSError:
+            return None
+        if not data.startswith(MAGIC):
+            self.remove(path)
+            return None
+        return data[len(MAGIC):]
+
+    def put(self, src: str, kind: str, data: bytes) -> None:
+        path = self.path(src, kind)
+        # a cache we can't write to just means a slower next run
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            # a temporary file of our own, so runs writing the same entry at
+            # once each replace it whole
+            fd, tmp = tempfile.mkstemp(suffix=".tmp", dir=self.directory)
+        except OSError:
+            return
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(MAGIC + data)
+            try:
+                replaced = os.stat(path).st_size
+            except OSError:
+                replaced = 0
+            os.replace(tmp, path)
+        except OSError:
+            self.remove(tmp)
+            return
+        if self.size is None:
+            self.evict()
+            return
+        self.size += len(MAGIC) + len(data) - replaced
+        if self.size > self.limit:
+            self.evict()
+
+    # lists the directory and takes the least recently used entries out
+    # until it's within the limit
+    def evict(self) -> None:
+        entries = []
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if entry.is_file() and not entry.name.endswith(".tmp"):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.limit:
+                break
+            self.remove(path)
+            total -= size
+        self.size = total
+
+    def remove(self, path: str) -> None:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+# nodes go to disk as (NODE, tag, field, ...) tuples for marshal, which is a
+# lot smaller and quicker to load than pickling the objects. a Hashmap's
+# elements go as (PAIRS, [(key, value), ...]), its keys are nodes and their
+# tuples can hold lists, which a dict can't take as keys
+NODES = [
+    syntax.Block, syntax.Num, syntax.String, syntax.Bool, syntax.BinOp, syntax.Call,
+    syntax.Variable, syntax.Hashmap, syntax.Field, syntax.Array, syntax.Subscript,
+    syntax.Unit, syntax.Func, syntax.Cond, syntax.While, syntax.NakedExp, syntax.Let,
+    syntax.Return, syntax.Assign, syntax.Plus, syntax.Minus, syntax.Mult, syntax.Div,
+    syntax.Eq, syntax.Leq, syntax.Mod, syntax.Invariant,
+]
+TAGS = {cls: tag for tag, cls in enumerate(NODES)}
+
+# what an encoded tuple is, by its first item
+NODE, PAIRS, TUPLE = 0, 1, 2
+
+
+def fields(cls: type) -> list[str]:
+    return [f for base in reversed(cls.__mro__) for f in base.__dict__.get("__slots__", ())]
+
+
+FIELDS = [fields(cls) for cls in NODES]
+
+
+def encode(x):
+    match x:
+        case list():
+            return [encode(s) for s in x]
+        case dict():
+            return (PAIRS, [(encode(k), encode(v)) for k, v in x.items()])
+        case tuple():
+            return (TUPLE, [encode(v) for v in x])
+        case syntax.Exp() | syntax.Stmt() | syntax.Operator():
+            tag = TAGS[type(x)]
+            return (NODE, tag, *[encode(getattr(x, f)) for f in FIELDS[tag]])
+    return x
+
+
+def decode(x):
+    match x:
+        case list():
+            return [decode(s) for s in x]
+        case (0, tag, *values):  # NODE
+            cls = NODES[tag]
+            if not FIELDS[tag]:
+                # Unit and the operators are shared
+                return cls()
+            node = object.__new__(cls)
+            for f, v in zip(FIELDS[tag], values):
+                setattr(node, f, decode(v))
+            return node
+        case (1, pairs):  # PAIRS
+            return {decode(k): decode(v) for k, v in pairs}
+        case (2, items):  # TUPLE
+            return tuple(decode(v) for v in items)
+    return x
+
+
+class ProgramCache:
+    store: DiskCache
+
+    # the two parsers don't give back quite the same AST, so which one made
+    # an entry is part of its key
+    def __init__(self, directory: str, parser: str, limit: int = LIMIT):
+        self.store = DiskCache(directory, fingerprint(SOURCES) + f"{parser}\0".encode(), limit)
+
+    def load(self, src: str, kind: str):
+        data = self.store.get(src, kind)
+        if data is None:
+            return None
+        try:
+            return marshal.loads(data)
+        except (EOFError, ValueError, TypeError):
+            return None
+
+    def save(self, src: str, kind: str, value) -> None:
+        try:
+            data = marshal.dumps(value)
+        except ValueError:
+            # nested deeper than marshal goes, don't cache it
+            return
+        self.store.put(src, kind, data)
+
+    # the AST after static.Anal and fold.Fold, with the top frame's size
+    def get_ast(self, src: str) -> Optional[tuple[list[Stmt], int]]:
+        match self.load(src, "ast"):
+            case (ast, size):
+                return decode(ast), size
+        return None
+
+    def put_ast(self, src: str, ast: list[Stmt], size: int) -> None:
+        self.save(src, "ast", (encode(ast), size))
+
+    def get_ir(self, src: str, optimized: bool) -> Optional[list[Stmt]]:
+        ir = self.load(src, "ir" if optimized else "ir0")
+        return None if ir is None else decode(ir)
+
+    def put_ir(self, src: str, optimized: bool, stmts: list[Stmt]) -> None:
+        self.save(src, "ir" if optimized else "ir0", encode(stmts))
+
+    # pygen's compiled program
+    def get_code(self, src: str) -> Optional[CodeType]:
+        code = self.load(src, "pyc")
+        return code if isinstance(code, CodeType) else None
+
+    def put_code(self, src: str, code: CodeType) -> None:
+        self.save(src, "pyc", code)
@@ -0,0 +1,673 @@
+from typing import Callable, Generator, Optional
+import operator
+from syntax import Exp, Stmt
+from syntax import Plus, Minus, Mult, Div, Eq, Leq, Mod
+import syntax
+
+from eval import Value, Unit, Num, String, Bool, Hashmap, Array, Closure, PrimOp, Cell
+from eval import TypeError, DivZeroError, IncorrectArity, Return
+from eval import MISS, auto_memo, memo_key, loop_cells
+from eval import TailCall, STACK_CALLS, run_frames, makes_calls
+
+# compiled code takes the env stack and gives back a value, statements give back nothing
+Env = list[list[Value]]
+Code = Callable[[Env], Value]
+StmtCode = Callable[[Env], None]
+# the same as generators for eval.run_frames, see ClosureCompiler.steps
+Steps = Callable[[Env], Generator]
+
+
+def assert_num(v: Value):
+    if isinstance(v, Num):
+        return v.value
+    raise TypeError("Num")
+
+
+def assert_bool(v: Value) -> bool:
+    if isinstance(v, Bool):
+        return v.value
+    raise TypeError("Bool")
+
+
+# how many monkey calls are nested on the python stack, see eval.STACK_CALLS
+depth = 0
+
+# a function body's code -> its steps, for the bodies that make calls
+body_steps: dict[Code, Steps] = {}
+
+
+# a call of a closure whose arguments are checked, and the tail calls it
+# ends in. memo, cells and itself first, see eval.Interp.call
+def call_closure(f: Closure, values: list[Value]) -> Value:
+    global depth
+    if depth >= STACK_CALLS:
+        nested, depth = depth, 0
+        try:
+            return run_frames(call_steps(f, values))
+        finally:
+            depth = nested
+    waiting = None
+    while True:
+        if f.memo is not None:
+            key = memo_key(values)
+            if key is not None:
+                ret = f.memo.get(key)
+                if ret is not MISS:
+                    break
+                waiting = waiting or []
+                waiting.append((f.memo, key))
+            if f.memo.itself is not None:
+                values.append(f.memo.itself)
+        if f.cells:
+            for i in f.cells:
+                values[i] = Cell(values[i])
+        if f.recursive:
+            values.append(f)
+        depth += 1
+        try:
+            ret = f.body(f.env + [values])
+        except Return as unwound:
+            ret = unwound.value
+        finally:
+            depth -= 1
+        if type(ret) is not TailCall:
+            break
+        f, values = ret.closure, ret.args
+    if waiting:
+        for memo, key in waiting:
+            memo.put(key, ret)
+    return ret
+
+
+# call_closure on the heap, see eval.run_frames
+def call_steps(f: Closure, values: list[Value]) -> Generator:
+    waiting = None
+    while True:
+        if f.memo is not None:
+            key = memo_key(values)
+            if key is not None:
+                ret = f.memo.get(key)
+                if ret is not MISS:
+                    break
+                waiting = waiting or []
+                waiting.append((f.memo, key))
+            if f.memo.itself is not None:
+                values.append(f.memo.itself)
+        if f.cells:
+            for i in f.cells:
+                values[i] = Cell(values[i])
+        if f.recursive:
+            values.append(f)
+        steps = body_steps.get(f.body)
+        try:
+            if steps is None:
+                ret = f.body(f.env + [values])
+            else:
+                ret = yield from steps(f.env + [values])
+        except Return as unwound:
+            ret = unwound.value
+        if type(ret) is not TailCall:
+            break
+        f, values = ret.closure, ret.args
+    if waiting:
+        for memo, key in waiting:
+            memo.put(key, ret)
+    return ret
+
+
+# walks a resolved AST once and turns every node into a python closure,
+# so running the program never goes through a match again
+class ClosureCompiler:
+    # by id, a function's closures are made from both of its compiled bodies
+    funcs: dict[int, Code]
+
+    def __init__(self):
+        self.funcs = {}
+
+    def stmt(self, s: Stmt) -> StmtCode:
+        match s:
+            case syntax.NakedExp(exp=exp):
+                return self.compile(exp)
+            case syntax.Let(slot=slot, init=init, boxed=True):
+                init = self.compile(init)
+
+                def let_cell(env: Env) -> None:
+                    cell = env[-1][slot]
+                    if cell is None:
+                        cell = env[-1][slot] = Cell(None)
+                    cell.value = init(env)
+
+                return let_cell
+            case syntax.Let(slot=slot, init=init):
+                init = self.compile(init)
+
+                def let(env: Env) -> None:
+                    env[-1][slot] = init(env)
+
+                return let
+            case syntax.Assign(target=target, value=value):
+                match target:
+                    case syntax.Variable(depth=depth, slot=slot):
+                        value = self.compile(value)
+                        up = -1 - depth
+                        if target.boxed:
+
+                            def assign_cell(env: Env) -> None:
+                                env[up][slot].value = value(env)
+
+                            return assign_cell
+
+                        def assign(env: Env) -> None:
+                            env[up][slot] = value(env)
+
+                        return assign
+                    case _:
+                        raise ValueError("Invalid lvalue")
+            case syntax.Return(tb_returned=tb_returned):
+                tb_returned = self.compile(tb_returned)
+
+                def ret(env: Env) -> None:
+                    raise Return(tb_returned(env))
+
+                return ret
+            case _:
+                raise ValueError("Unknown Statement")
+
+    def block(self, b: list[Stmt], size: int) -> Code:
+        match b:
+            case []:
+                return lambda env: Unit()
+            case [*stuff, last]:
+                stuff = [self.stmt(s) for s in stuff]
+                match last:
+                    case syntax.NakedExp(exp=exp):
+                        last = self.compile(exp)
+                    case _:
+                        last_stmt = self.stmt(last)
+
+                        def last(env: Env) -> Value:
+                            last_stmt(env)
+                            return Unit()
+
+                def block(env: Env) -> Value:
+                    env.append([None] * size)
+                    for s in stuff:
+                        s(env)
+                    ret = last(env)
+                    env.pop()
+                    return ret
+
+                return block
+
+    def compile(self, e: Exp) -> Code:
+        match e:
+            # literals
+            case syntax.Unit():
+                return lambda env: Unit()
+            case syntax.Bool(value=value):
+                return lambda env: Bool(value)
+            case syntax.Num(value=value):
+                return lambda env: Num(value)
+            case syntax.String(value=value):
+                return lambda env: String(value)
+
+            # thicc literals
+            case syntax.Array(elements=elements):
+                elements = [self.compile(e) for e in elements]
+                return lambda env: Array([e(env) for e in elements])
+            case syntax.Hashmap(elements=elements):
+                elements = [(self.compile(k), self.compile(v)) for k, v in elements.items()]
+                return lambda env: Hashmap({k(env): v(env) for k, v in elements})
+
+            case syntax.Variable(depth=depth, slot=slot, boxed=True):
+                up = -1 - depth
+                return lambda env: env[up][slot].value
+            case syntax.Variable(depth=0, slot=slot):
+                return lambda env: env[-1][slot]
+            case syntax.Variable(depth=depth, slot=slot):
+                up = -1 - depth
+                return lambda env: env[up][slot]
+            case syntax.Invariant(lhs=lhs, rhs=rhs, op=op, depth=depth, slot=slot):
+                binop = self.binop(self.compile(lhs), self.compile(rhs), op)
+                up = -1 - depth
+
+                def invariant(env: Env) -> Value:
+                    value = env[up][slot]
+                    if value is None:
+                        value = env[up][slot] = binop(env)
+                    return value
+
+                return invariant
+            case syntax.BinOp(lhs=lhs, rhs=rhs, op=op):
+                return self.binop(self.compile(lhs), self.compile(rhs), op)
+
+            case syntax.Cond(
+                condition=condition, perchance=perchance, perchance_not=perchance_not
+            ):
+                condition = self.compile(condition)
+                perchance = self.block(perchance, e.perchance_size)
+                match perchance_not:
+                    case None:
+                        perchance_not = lambda env: Unit()
+                    case syntax.Cond():
+                        perchance_not = self.compile(perchance_not)
+                    case [*stmts]:
+                        perchance_not = self.block(stmts, e.perchance_not_size)
+
+                def cond(env: Env) -> Value:
+                    if assert_bool(condition(env)):
+                        return perchance(env)
+                    return perchance_not(env)
+
+                return cond
+            case syntax.Block(stmts=stmts, size=size):
+                return self.block(stmts, size)
+
+            case syntax.Field(tb_fielded=tb_fielded, field=field):
+                tb_fielded = self.compile(tb_fielded)
+                key = String(field)
+
+                def field(env: Env) -> Value:
+                    tb = tb_fielded(env)
+                    if isinstance(tb, Hashmap):
+                        return tb.elements[key]
+                    raise TypeError("HashMap")
+
+                return field
+            case syntax.Subscript(tb_indexed=tb_indexed, index=index):
+                tb_indexed = self.compile(tb_indexed)
+                index = self.compile(index)
+
+                def subscript(env: Env) -> Value:
+                    tb = tb_indexed(env)
+                    if isinstance(tb, Hashmap):
+                        return tb.elements[index(env)]
+                    if isinstance(tb, Array):
+                        ix = index(env)
+                        if isinstance(ix, Num) and isinstance(ix.value, int):
+                            return tb.elements[ix.value]
+                        raise TypeError("Int")
+                    raise TypeError("Subscriptable (Array / HashMap)")
+
+                return subscript
+            case syntax.Func(params=params, body=body, body_size=size, free=free, outer=outer):
+                if id(e) in self.funcs:
+                    return self.funcs[id(e)]
+                steps = self.block_steps(body, size) if makes_calls(body) else None
+                body = self.block(body, size)
+                if steps is not None:
+                    body_steps[body] = steps
+                free = [(-1 - v.depth, v.slot) for v in free]
+                cells, recursive, memo, line = e.cells, e.recursive, e.memo, e.line
+
+                # only what it captures, and the scopes outside every function
+                def func(env: Env) -> Value:
+                    captured = [env[up][slot] for up, slot in free]
+                    local = env[: len(env) - outer] + [captured]
+                    return Closure(params, body, size, local, cells, recursive, auto_memo(line) if memo else None)
+
+                self.funcs[id(e)] = func
+                return func
+            case syntax.Call(func=func, arguments=args, tail=tail):
+                func = self.compile(func)
+                args = [self.compile(arg) for arg in args]
+                arity = len(args)
+
+                def call(env: Env) -> Value:
+                    global depth
+                    f = func(env)
+                    if isinstance(f, Closure):
+                        if arity != len(f.parameters):
+                            raise IncorrectArity(len(f.parameters), arity)
+                        values = [arg(env) for arg in args]
+                        # made by the call_closure this function's body runs in
+                        if tail:
+                            return TailCall(f, values)
+                        if f.memo is not None or depth >= STACK_CALLS:
+                            return call_closure(f, values)
+                        # call_closure without the memo, inline
+                        if f.cells:
+                            for i in f.cells:
+                                values[i] = Cell(values[i])
+                        if f.recursive:
+                            values.append(f)
+                        depth += 1
+                        try:
+                            ret = f.body(f.env + [values])
+                        except Return as unwound:
+                            ret = unwound.value
+                        finally:
+                            depth -= 1
+                        if type(ret) is TailCall:
+                            return call_closure(ret.closure, ret.args)
+                        return ret
+                    if isinstance(f, PrimOp):
+                        return f.func([arg(env) for arg in args])
+                    raise TypeError("Closure")
+
+                return call
+
+            case syntax.While(condition=condition, body=body, body_size=size):
+                condition = self.compile(condition)
+                invariants = e.invariants
+                cells = loop_cells(body)
+                body = [self.stmt(s) for s in body]
+
+                # one frame for the body, every time round
+                def loop(env: Env) -> Value:
+                    for slot in invariants:
+                        env[-1][slot] = None
+                    frame = [None] * size
+                    while assert_bool(condition(env)):
+                        env.append(frame)
+                        for s in body:
+                            s(env)
+                        env.pop()
+                        for slot in cells:
+                            frame[slot] = None
+                    return Unit()
+
+                return loop
+            case _:
+                raise ValueError("Skill Issue")
+
+    # the rest compiles what makes calls a second time, as steps: generators
+    # that yield the calls they make to eval.run_frames instead of making
+    # them. a function's closures only run those once call_closure has gone
+    # STACK_CALLS deep
+
+    # e's code in a steps function: (True, its steps) when it makes calls,
+    # (False, its plain code) when it doesn't
+    def part(self, e: Exp) -> tuple[bool, Callable]:
+        if makes_calls(e):
+            return True, self.steps(e)
+        return False, self.compile(e)
+
+    def stmt_part(self, s: Stmt) -> tuple[bool, Callable]:
+        if makes_calls(s):
+            return True, self.stmt_steps(s)
+        return False, self.stmt(s)
+
+    def block_part(self, b: list[Stmt], size: int) -> tuple[bool, Callable]:
+        if makes_calls(b):
+            return True, self.block_steps(b, size)
+        return False, self.block(b, size)
+
+    def stmt_steps(self, s: Stmt) -> Steps:
+        match s:
+            case syntax.NakedExp(exp=exp):
+                return self.steps(exp)
+            case syntax.Let(slot=slot, init=init, boxed=True):
+                init = self.steps(init)
+
+                def let_cell(env: Env) -> Generator:
+                    cell = env[-1][slot]
+                    if cell is None:
+                        cell = env[-1][slot] = Cell(None)
+                    cell.value = yield from init(env)
+
+                return let_cell
+            case syntax.Let(slot=slot, init=init):
+                init = self.steps(init)
+
+                def let(env: Env) -> Generator:
+                    value = yield from init(env)
+                    env[-1][slot] = value
+
+                return let
+            case syntax.Assign(target=syntax.Variable(depth=depth, slot=slot) as target, value=value):
+                value = self.steps(value)
+                up = -1 - depth
+                if target.boxed:
+
+                    def assign_cell(env: Env) -> Generator:
+                        v = yield from value(env)
+                        env[up][slot].value = v
+
+                    return assign_cell
+
+                def assign(env: Env) -> Generator:
+                    v = yield from value(env)
+                    env[up][slot] = v
+
+                return assign
+            case syntax.Assign():
+                raise ValueError("Invalid lvalue")
+            case syntax.Return(tb_returned=tb_returned):
+                tb_returned = self.steps(tb_returned)
+
+                def ret(env: Env) -> Generator:
+                    raise Return((yield from tb_returned(env)))
+
+                return ret
+            case _:
+                raise ValueError("Unknown Statement")
+
+    # b isn't empty, it makes calls
+    def block_steps(self, b: list[Stmt], size: int) -> Steps:
+        *stuff, last = b
+        stuff = [self.stmt_part(s) for s in stuff]
+        match last:
+            case syntax.NakedExp(exp=exp):
+                value = True
+                deep, last = self.part(exp)
+            case _:
+                value = False
+                deep, last = self.stmt_part(last)
+
+        def block(env: Env) -> Generator:
+            env.append([None] * size)
+            for calls, s in stuff:
+                if calls:
+                    yield from s(env)
+                else:
+                    s(env)
+            ret = (yield from last(env)) if deep else last(env)
+            env.pop()
+            return ret if value else Unit()
+
+        return block
+
+    def steps(self, e: Exp) -> Steps:
+        match e:
+            case syntax.Array(elements=elements):
+                elements = [self.part(e) for e in elements]
+
+                def array(env: Env) -> Generator:
+                    values = []
+                    for deep, e in elements:
+                        values.append((yield from e(env)) if deep else e(env))
+                    return Array(values)
+
+                return array
+            case syntax.Hashmap(elements=elements):
+                elements = [(self.part(k), self.part(v)) for k, v in elements.items()]
+
+                def hashmap(env: Env) -> Generator:
+                    pairs = {}
+                    for (deep_k, k), (deep_v, v) in elements:
+                        k = (yield from k(env)) if deep_k else k(env)
+                        pairs[k] = (yield from v(env)) if deep_v else v(env)
+                    return Hashmap(pairs)
+
+                return hashmap
+            case syntax.BinOp(lhs=lhs, rhs=rhs, op=op):
+                deep_lhs, lhs = self.part(lhs)
+                deep_rhs, rhs = self.part(rhs)
+
+                checks_lhs = isinstance(op, Div)
+
+                def binop(env: Env) -> Generator:
+                    x = (yield from lhs(env)) if deep_lhs else lhs(env)
+                    # div checks its lhs before it runs the rhs
+                    if checks_lhs:
+                        assert_num(x)
+                    y = (yield from rhs(env)) if deep_rhs else rhs(env)
+                    return operate(op, x, y)
+
+                return binop
+            case syntax.Cond(
+                condition=condition, perchance=perchance, perchance_not=perchance_not
+            ):
+                deep_condition, condition = self.part(condition)
+                deep_perchance, perchance = self.block_part(perchance, e.perchance_size)
+                match perchance_not:
+                    case None:
+                        deep_not, perchance_not = False, lambda env: Unit()
+                    case syntax.Cond():
+                        deep_not, perchance_not = self.part(perchance_not)
+                    case [*stmts]:
+                        deep_not, perchance_not = self.block_part(stmts, e.perchance_not_size)
+
+                def cond(env: Env) -> Generator:
+                    test = (yield from condition(env)) if deep_condition else condition(env)
+                    if assert_bool(test):
+                        return (yield from perchance(env)) if deep_perchance else perchance(env)
+                    return (yield from perchance_not(env)) if deep_not else perchance_not(env)
+
+                return cond
+            case syntax.Block(stmts=stmts, size=size):
+                return self.block_steps(stmts, size)
+
+            case syntax.Field(tb_fielded=tb_fielded, field=field):
+                tb_fielded = self.steps(tb_fielded)
+                key = String(field)
+
+                def field(env: Env) -> Generator:
+                    tb = yield from tb_fielded(env)
+                    if isinstance(tb, Hashmap):
+                        return tb.elements[key]
+                    raise TypeError("HashMap")
+
+                return field
+            case syntax.Subscript(tb_indexed=tb_indexed, index=index):
+                deep_tb, tb_indexed = self.part(tb_indexed)
+                deep_index, index = self.part(index)
+
+                def subscript(env: Env) -> Generator:
+                    tb = (yield from tb_indexed(env)) if deep_tb else tb_indexed(env)
+                    if isinstance(tb, Hashmap):
+                        return tb.elements[(yield from index(env)) if deep_index else index(env)]
+                    if isinstance(tb, Array):
+                        ix = (yield from index(env)) if deep_index else index(env)
+                        if isinstance(ix, Num) and isinstance(ix.value, int):
+                            return tb.elements[ix.value]
+                        raise TypeError("Int")
+                    raise TypeError("Subscriptable (Array / HashMap)")
+
+                return subscript
+            case syntax.Call(func=func, arguments=args, tail=tail):
+                deep_func, func = self.part(func)
+                args = [self.part(arg) for arg in args]
+                arity = len(args)
+
+                def call(env: Env) -> Generator:
+                    f = (yield from func(env)) if deep_func else func(env)
+                    if isinstance(f, Closure):
+                        if arity != len(f.parameters):
+                            raise IncorrectArity(len(f.parameters), arity)
+                        values = []
+                        for deep, arg in args:
+                            values.append((yield from arg(env)) if deep else arg(env))
+                        if tail:
+                            return TailCall(f, values)
+                        # one whose body makes no calls can't go any deeper
+                        if f.body in body_steps:
+                            return (yield call_steps(f, values))
+                        return call_closure(f, values)
+                    if isinstance(f, PrimOp):
+                        values = []
+                        for deep, arg in args:
+                            values.append((yield from arg(env)) if deep else arg(env))
+                        return f.func(values)
+                    raise TypeError("Closure")
+
+                return call
+
+            case syntax.While(condition=condition, body=body, body_size=size):
+                deep_condition, condition = self.part(condition)
+                invariants = e.invariants
+                cells = loop_cells(body)
+                body = [self.stmt_part(s) for s in body]
+
+                def loop(env: Env) -> Generator:
+                    for slot in invariants:
+                        env[-1][slot] = None
+                    frame = [None] * size
+                    while assert_bool((yield from condition(env)) if deep_condition else condition(env)):
+                        env.append(frame)
+                        for deep, s in body:
+                            if deep:
+                                yield from s(env)
+                            else:
+                                s(env)
+                        env.pop()
+                        for slot in cells:
+                            frame[slot] = None
+                    return Unit()
+
+                return loop
+            case _:
+                raise ValueError("Skill Issue")
+
+    def binop(self, lhs: Code, rhs: Code, op: syntax.Operator) -> Code:
+        match op:
+            case Plus():
+                return arith(lhs, rhs, operator.add, Num)
+            case Minus():
+                return arith(lhs, rhs, operator.sub, Num)
+            case Mult():
+                return arith(lhs, rhs, operator.mul, Num)
+            case Div():
+
+                def div(env: Env) -> Value:
+                    x = assert_num(lhs(env))
+                    y = assert_num(rhs(env))
+                    if y == 0:
+                        raise DivZeroError()
+                    return Num(x / y)
+
+                return div
+            case Eq():
+                return arith(lhs, rhs, operator.eq, Bool)
+            case Leq():
+                return arith(lhs, rhs, operator.le, Bool)
+            case Mod():
+                return arith(lhs, rhs, operator.mod, Num)
+            case _:
+                raise ValueError("Unknown Operator")
+
+
+# both sides are evaluated before either is checked, like Interp.arith_op
+def arith(lhs: Code, rhs: Code, f: Callable, wrap: Callable) -> Code:
+    def run(env: Env) -> Value:
+        x = lhs(env)
+        y = rhs(env)
+        return wrap(f(assert_num(x), assert_num(y)))
+
+    return run
+
+
+# a binop of two values, for steps, see arith
+def operate(op: syntax.Operator, x: Value, y: Value) -> Value:
+    x = assert_num(x)
+    y = assert_num(y)
+    match op:
+        case Plus():
+            return Num(x + y)
+        case Minus():
+            return Num(x - y)
+        case Mult():
+            return Num(x * y)
+        case Div():
+            if y == 0:
+                raise DivZeroError()
+            return Num(x / y)
+        case Eq():
+            return Bool(x == y)
+        case Leq():
+            return Bool(x <= y)
+        case Mod():
+            return Num(x % y)
+        case _:
+            raise ValueError("Unknown Operator")
@@ -1,14 +1,22 @@
-from typing import Callable, Union
+from typing import Callable, Generator, Optional, Union, TextIO
+from collections import OrderedDict
 from syntax import Exp, Stmt
 from syntax import Plus, Minus, Mult, Div, Eq, Leq, Mod
 import syntax
 
 
 class Value:
-    pass
+    __slots__ = ()
 
 
+# Unit(), Bool(b) and small Num(n) hand back shared instances instead of
+# allocating, values are never mutated so nobody can tell
 class Unit(Value):
+    __slots__ = ()
+
+    def __new__(cls):
+        return UNIT
+
     def __str__(self):
         return "()"
 
@@ -19,11 +27,23 @@ class Unit(Value):
         return isinstance(other, Unit)
 
 
+UNIT = object.__new__(Unit)
+
+# Num(n) for ints in here comes from SMALL_NUMS
+SMALL_MIN = -128
+SMALL_MAX = 1024
+
+
 class Num(Value):
+    __slots__ = ("value",)
     value: Union[int, float]
 
-    def __init__(self, v: Union[int, float]):
-        self.value = v
+    def __new__(cls, v: Union[int, float]):
+        if type(v) is int and SMALL_MIN <= v < SMALL_MAX:
+            return SMALL_NUMS[v - SMALL_MIN]
+        num = object.__new__(cls)
+        num.value = v
+        return num
 
     def __str__(self):
         return str(self.value)
@@ -35,7 +55,17 @@ class Num(Value):
         return isinstance(other, Num) and self.value == other.value
 
 
+def make_small_num(v: int) -> Num:
+    num = object.__new__(Num)
+    num.value = v
+    return num
+
+
+SMALL_NUMS = [make_small_num(v) for v in range(SMALL_MIN, SMALL_MAX)]
+
+
 class String(Value):
+    __slots__ = ("value",)
     value: str
 
     def __init__(self, s: str):
@@ -52,10 +82,11 @@ class String(Value):
 
 
 class Bool(Value):
+    __slots__ = ("value",)
     value: bool
 
-    def __init__(self, b: bool):
-        self.value = b
+    def __new__(cls, b: bool):
+        return TRUE if b else FALSE
 
     def __str__(self):
         return str(self.value)
@@ -67,7 +98,14 @@ class Bool(Value):
         return isinstance(other, Bool) and self.value == other.value
 
 
+TRUE = object.__new__(Bool)
+TRUE.value = True
+FALSE = object.__new__(Bool)
+FALSE.value = False
+
+
 class Hashmap(Value):
+    __slots__ = ("elements",)
     elements: dict[Value, Value]
 
     def __init__(self, e: dict[Value, Value]):
@@ -78,6 +116,7 @@ class Hashmap(Value):
 
 
 class Array(Value):
+    __slots__ = ("elements",)
     elements: list[Value]
 
     def __init__(self, e: list[Value]):
@@ -89,20 +128,43 @@ class Array(Value):
 
 # THE CROWN JEWEL
 class Closure(Value):
+    __slots__ = ("parameters", "body", "body_size", "env", "cells", "recursive", "memo")
     parameters: list[str]
     body: list[Stmt]
-    env: list[dict[str, Value]]
-
-    def __init__(self, p: list[str], b: list[Stmt], env: list[dict[str, Value]]):
+    body_size: int
+    # what it captured, see static.Anal
+    env: "Frame"
+    # parameters that go into cells when it's called
+    cells: list[int]
+    # gets itself as one more argument, see static.Anal
+    recursive: bool
+    # what it gave back for arguments it was called with before, see pure.py
+    memo: Optional["Memo"]
+
+    def __init__(
+        self,
+        p: list[str],
+        b: list[Stmt],
+        size: int,
+        env: "Frame",
+        cells: list[int] = (),
+        recursive: bool = False,
+        memo: Optional["Memo"] = None,
+    ):
         self.parameters = p
         self.body = b
+        self.body_size = size
         self.env = env
+        self.cells = cells
+        self.recursive = recursive
+        self.memo = memo
 
     def __str__(self):
         return "<<Closure>>"
 
 
 class PrimOp(Value):
+    __slots__ = ("func",)
     func: Callable[[list[Value]], Value]
 
     def __init__(self, func):
@@ -112,11 +174,378 @@ class PrimOp(Value):
         return "<<PrimOp>>"
 
 
-class Interp:
-    env_stack: list[dict[str, Value]]
+# where a variable lives when closures share it and it can change, see
+# static.Anal. never a value itself, only ever in a frame slot
+class Cell:
+    __slots__ = ("value",)
+    value: Value
+
+    def __init__(self, v: Value):
+        self.value = v
+
+
+# how many results a memo keeps and whether pure functions get one without
+# asking for it, main sets these from --memo-size and --no-memo
+MEMO_SIZE = 256
+AUTO_MEMO = True
+# every memo made, when --memo-stats wants to report them
+MEMOS: Optional[list["Memo"]] = None
+
+# what Memo.get gives back when it doesn't know
+MISS = object()
+
+
+# a closure's results by arguments, least recently used first so it can
+# drop those once it's full
+class Memo:
+    __slots__ = ("results", "size", "hits", "misses", "line", "itself")
+    results: OrderedDict
+    size: int
+    hits: int
+    misses: int
+    # of the function, 0 for memo(f)
+    line: int
+    # memo(f) of a recursive f: f, which f's body still gets as itself
+    itself: Optional[Closure]
+
+    def __init__(self, line: int = 0, itself: Optional[Closure] = None):
+        self.results = OrderedDict()
+        self.size = MEMO_SIZE
+        self.hits = 0
+        self.misses = 0
+        self.line = line
+        self.itself = itself
+        if MEMOS is not None:
+            MEMOS.append(self)
+
+    def get(self, key: tuple) -> Value:
+        ret = self.results.get(key, MISS)
+        if ret is MISS:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.results.move_to_end(key)
+        return ret
+
+    def put(self, key: tuple, ret: Value) -> None:
+        self.results[key] = ret
+        if len(self.results) > self.size:
+            self.results.popitem(last=False)
+
+
+# a Memo for a closure of a function pure.Purity marked
+def auto_memo(line: int) -> Optional[Memo]:
+    return Memo(line) if AUTO_MEMO else None
+
+
+# what a call's arguments look like to a Memo. None when one isn't a number,
+# string, bool or (), those calls just run. 1 and 1.0 are equal but don't
+# print the same, so the key has the python type too
+def memo_key(args: list[Value]) -> Optional[tuple]:
+    key = []
+    for v in args:
+        t = type(v)
+        if t is Num or t is String or t is Bool:
+            key.append((type(v.value), v.value))
+        elif t is Unit:
+            key.append(None)
+        else:
+            return None
+    return tuple(key)
+
+
+# --memo-stats: hits and misses per function
+def report_memos(memos: list[Memo], out: TextIO) -> None:
+    totals = {}
+    for memo in memos:
+        t = totals.setdefault(memo.line, [0, 0, 0, 0])
+        t[0] += 1
+        t[1] += memo.hits
+        t[2] += memo.misses
+        t[3] += len(memo.results)
+    print(f"{'closures':>10} {'hits':>10} {'misses':>10} {'kept':>10}  where", file=out)
+    for line, (count, hits, misses, kept) in sorted(totals.items()):
+        where = f"fn (line {line})" if line else "memo(f)"
+        print(f"{count:10} {hits:10} {misses:10} {kept:10}  {where}", file=out)
+
+
+# one scope at runtime. a closure just keeps the frame it was made in, and a
+# call hangs one new frame off it, so neither copies the scope chain
+class Frame:
+    __slots__ = ("slots", "parent")
+    slots: list[Value]
+    parent: Optional["Frame"]
+
+    def __init__(self, slots: list[Value], parent: Optional["Frame"]):
+        self.slots = slots
+        self.parent = parent
+
+
+# the slots of a while body's lets that hold cells. the body's frame lasts
+# the whole loop, those have to be emptied every time round so the next one
+# makes cells of its own
+def loop_cells(body: list[Stmt]) -> list[int]:
+    return [s.slot for s in body if isinstance(s, syntax.Let) and s.boxed]
+
+
+# stands in for "not returning", since a primop can hand back None
+NO_RETURN = object()
+
+# deep recursion. Interp, closure_compiler and pygen run a monkey call as
+# nested python calls, which is quick but stops at sys.getrecursionlimit().
+# so once STACK_CALLS of them are nested, the next call runs as generators
+# instead: when one gets to a call it yields the callee's generator to
+# run_frames, which keeps the callers waiting in a list until it's done.
+# from there on down the monkey call stack is on the heap and how deep it
+# goes is up to memory. a callee whose body makes no calls can't go any
+# deeper, so that one still just runs. vm and regvm keep their frames in a
+# list to begin with
+STACK_CALLS = 64
+
+
+def run_frames(frame: Generator) -> Value:
+    frames = []
+    value = error = None
+    while True:
+        try:
+            if error is None:
+                callee = frame.send(value)
+            else:
+                callee = frame.throw(error)
+        except StopIteration as done:
+            if not frames:
+                return done.value
+            frame, value, error = frames.pop(), done.value, None
+            continue
+        except BaseException as err:
+            # on to the caller, which might catch it
+            if not frames:
+                raise
+            frame, value, error = frames.pop(), None, err
+            continue
+        frames.append(frame)
+        frame, value, error = callee, None, None
+
+
+# whether running e (an expression, statement or list of them) makes a
+# call, not counting in the bodies of functions it makes. only that can take
+# it past STACK_CALLS
+def makes_calls(e) -> bool:
+    match e:
+        case syntax.Call():
+            return True
+        case list():
+            return any(makes_calls(x) for x in e)
+        case syntax.NakedExp(exp=x) | syntax.Let(init=x) | syntax.Assign(value=x) | syntax.Return(tb_returned=x):
+            return makes_calls(x)
+        case syntax.BinOp(lhs=lhs, rhs=rhs):
+            return makes_calls(lhs) or makes_calls(rhs)
+        case syntax.Cond(condition=condition, perchance=perchance, perchance_not=perchance_not):
+            return makes_calls(condition) or makes_calls(perchance) or makes_calls(perchance_not)
+        case syntax.While(condition=condition, body=body):
+            return makes_calls(condition) or makes_calls(body)
+        case syntax.Block(stmts=stmts):
+            return makes_calls(stmts)
+        case syntax.Array(elements=elements):
+            return makes_calls(elements)
+        case syntax.Hashmap(elements=elements):
+            return any(makes_calls(k) or makes_calls(v) for k, v in elements.items())
+        case syntax.Field(tb_fielded=tb):
+            return makes_calls(tb)
+        case syntax.Subscript(tb_indexed=tb, index=index):
+            return makes_calls(tb) or makes_calls(index)
+    return False
+
+
+# what a call in tail position evaluates to: the call still to be made, which
+# the caller's call loop makes after this function's frames are gone
+class TailCall:
+    __slots__ = ("closure", "args")
+    closure: Closure
+    args: list[Value]
+
+    def __init__(self, closure: Closure, args: list[Value]):
+        self.closure = closure
+        self.args = args
+
+
+# quickening: Interp.eval rewrites a node's class in place the first time it
+# runs, to one that only does what that node turned out to need. they're
+# subclasses with no slots of their own, so every pass that matches on the
+# syntax classes still sees the same node. the guarded ones go back to the
+# generic path for good as soon as a guard fails. each has a run, which
+# Interp.eval calls for the types in QUICKENED
+class LocalRead(syntax.Variable):
+    __slots__ = ()
+
+    def run(self, interp: "Interp") -> Value:
+        return interp.env.slots[self.slot]
+
+
+class ParentRead(syntax.Variable):
+    __slots__ = ()
+
+    def run(self, interp: "Interp") -> Value:
+        return interp.env.parent.slots[self.slot]
+
+
+# a variable closures share, see static.Anal
+class CellRead(syntax.Variable):
+    __slots__ = ()
+
+    def run(self, interp: "Interp") -> Value:
+        env = interp.env
+        depth = self.depth
+        while depth:
+            env = env.parent
+            depth -= 1
+        return env.slots[self.slot].value
+
+
+# a BinOp that has only ever seen numbers. nodes only ever get one of the
+# subclasses in NUM_OPS, which have the apply
+class NumOp(syntax.BinOp):
+    __slots__ = ()
+
+    def run(self, interp: "Interp") -> Value:
+        lhs = interp.eval(self.lhs)
+        rhs = interp.eval(self.rhs)
+        if type(lhs) is Num and type(rhs) is Num:
+            return self.apply(lhs.value, rhs.value)
+        self.__class__ = SlowBinOp
+        return interp.binop(lhs, rhs, self.op)
+
+
+class NumPlus(NumOp):
+    __slots__ = ()
+
+    def apply(self, x, y) -> Value:
+        return Num(x + y)
+
+
+class NumMinus(NumOp):
+    __slots__ = ()
+
+    def apply(self, x, y) -> Value:
+        return Num(x - y)
+
+
+class NumMult(NumOp):
+    __slots__ = ()
+
+    def apply(self, x, y) -> Value:
+        return Num(x * y)
+
+
+class NumDiv(NumOp):
+    __slots__ = ()
+
+    def apply(self, x, y) -> Value:
+        if y == 0:
+            raise DivZeroError()
+        return Num(x / y)
+
+
+class NumMod(NumOp):
+    __slots__ = ()
+
+    def apply(self, x, y) -> Value:
+        return Num(x % y)
+
+
+class NumEq(NumOp):
+    __slots__ = ()
+
+    def apply(self, x, y) -> Value:
+        return TRUE if x == y else FALSE
+
+
+class NumLeq(NumOp):
+    __slots__ = ()
+
+    def apply(self, x, y) -> Value:
+        return TRUE if x <= y else FALSE
+
+
+NUM_OPS = {
+    Plus: NumPlus, Minus: NumMinus, Mult: NumMult, Div: NumDiv,
+    Mod: NumMod, Eq: NumEq, Leq: NumLeq,
+}
+
+
+class SlowBinOp(syntax.BinOp):
+    __slots__ = ()
+
+
+# see hoist.Hoist
+class InvariantRead(syntax.Invariant):
+    __slots__ = ()
+
+    def run(self, interp: "Interp") -> Value:
+        env = interp.env
+        depth = self.depth
+        while depth:
+            env = env.parent
+            depth -= 1
+        value = env.slots[self.slot]
+        if value is None:
+            value = env.slots[self.slot] = interp.binop(interp.eval(self.lhs), interp.eval(self.rhs), self.op)
+        return value
+
+
+# a call that has only ever called e.cached, whose arity was checked then
+class ClosureCall(syntax.Call):
+    __slots__ = ()
+
+    def run(self, interp: "Interp") -> Value:
+        func = interp.eval(self.func)
+        if func is not self.cached:
+            self.__class__ = SlowCall
+            self.cached = None
+            return interp.apply(self, func)
+        args = [interp.eval(arg) for arg in self.arguments]
+        if self.tail:
+            return TailCall(func, args)
+        if interp.segment_depth >= STACK_CALLS:
+            return interp.call_on_heap(func, args)
+        return interp.call(func, args)
+
+
+class PrimCall(syntax.Call):
+    __slots__ = ()
+
+    def run(self, interp: "Interp") -> Value:
+        func = interp.eval(self.func)
+        if func is not self.cached:
+            self.__class__ = SlowCall
+            self.cached = None
+            return interp.apply(self, func)
+        return func.func([interp.eval(arg) for arg in self.arguments])
+
+
+class SlowCall(syntax.Call):
+    __slots__ = ()
+
+
+QUICKENED = {LocalRead, ParentRead, CellRead, *NUM_OPS.values(), InvariantRead, ClosureCall, PrimCall}
 
-    def __init__(self, env_stack: list[dict[str, Value]]):
-        self.env_stack = env_stack
+
+# variables are resolved by static.Anal, so every scope is a flat frame
+# and a variable is just (frames up, slot)
+class Interp:
+    env: Frame
+    # the value of a `return` on its way out to the call, or NO_RETURN
+    returned: object
+    # how many monkey calls are nested on the python stack, see STACK_CALLS
+    segment_depth: int
+    # id -> (node, whether it makes calls), the node so the id stays its
+    calling: dict[int, tuple[object, bool]]
+
+    def __init__(self, env: Frame):
+        self.env = env
+        self.returned = NO_RETURN
+        self.segment_depth = 0
+        self.calling = {}
 
     def assert_num(self, v: Value) -> Union[int, float]:
         match v:
@@ -138,65 +567,103 @@ class Interp:
         rhs = self.assert_num(rhs)
         return f(lhs, rhs)
 
+    def binop(self, lhs: Value, rhs: Value, op: syntax.Operator) -> Value:
+        match op:
+            case Plus():
+                return self.arith_op(lhs, rhs, lambda x, y: Num(x + y))
+            case Minus():
+                return self.arith_op(lhs, rhs, lambda x, y: Num(x - y))
+            case Mult():
+                return self.arith_op(lhs, rhs, lambda x, y: Num(x * y))
+            case Div():
+                lhs = self.assert_num(lhs)
+                rhs = self.assert_num(rhs)
+                if rhs == 0:
+                    raise DivZeroError()
+                return Num(lhs / rhs)
+            case Eq():
+                return self.arith_op(lhs, rhs, lambda x, y: TRUE if x == y else FALSE)
+            case Leq():
+                return self.arith_op(lhs, rhs, lambda x, y: TRUE if x <= y else FALSE)
+            case Mod():
+                return self.arith_op(lhs, rhs, lambda x, y: Num(x % y))
+            # ..
+
     def exec(self, s: Stmt) -> None:
         match s:
             case syntax.NakedExp(exp=exp):
                 self.eval(exp)
-            case syntax.Let(name=name, init=init):
-                match init:
-                    case syntax.Func():
-                        init = self.eval(init)
-                        self.env_stack[-1][name] = init
-                        init.env[-1][name] = init
-                    case _:
-                        init = self.eval(init)
-                        self.env_stack[-1][name] = init
+            case syntax.Let(slot=slot, init=init):
+                if s.boxed:
+                    # the cell is there before the init runs, a closure in it
+                    # might capture it
+                    cell = self.env.slots[slot]
+                    if cell is None:
+                        cell = self.env.slots[slot] = Cell(None)
+                    cell.value = self.eval(init)
+                else:
+                    self.env.slots[slot] = self.eval(init)
 
             case syntax.Assign(target=target, value=value):
                 match target:
                     # TODO: more expr???
-                    case syntax.Variable(name=name):
-                        idx = self.lookup(name)
+                    case syntax.Variable(depth=depth, slot=slot):
                         value = self.eval(value)
-                        self.env_stack[idx][name] = value
+                        env = self.env
+                        while depth:
+                            env = env.parent
+                            depth -= 1
+                        if target.boxed:
+                            env.slots[slot].value = value
+                        else:
+                            env.slots[slot] = value
                     case _:
                         raise ValueError("Invalid lvalue")
             # big brain moment
-            case syntax.Return(tb_returned=tb_returned):
+            case syntax.Return(tb_returned=tb_returned, unwinds=True):
                 tb_returned = self.eval(tb_returned)
                 raise Return(tb_returned)
+            # everything between here and the call is statements, which stop
+            # as soon as they see self.returned
+            case syntax.Return(tb_returned=tb_returned):
+                self.returned = self.eval(tb_returned)
             case _:
                 raise ValueError("Unknown Statement")
 
-    def block(self, b: list[Stmt]) -> Value:
+    def block(self, b: list[Stmt], size: int) -> Value:
         match b:
             case []:
-                return Unit()
+                return UNIT
             case [*stuff, last]:
                 ret = None
-                self.env_stack.append({})
+                self.env = Frame([None] * size, self.env)
 
                 for s in stuff:
                     self.exec(s)
+                    if self.returned is not NO_RETURN:
+                        self.env = self.env.parent
+                        return UNIT
 
                 match last:
                     case syntax.NakedExp(exp=exp):
                         ret = self.eval(exp)
                     case _:
                         self.exec(last)
-                        ret = Unit()
+                        ret = UNIT
 
-                self.env_stack.pop()
+                self.env = self.env.parent
                 return ret
 
     def eval(self, e: Exp) -> Value:
         # print(e, type(e))
+        if type(e) in QUICKENED:
+            return e.run(self)
         match e:
             # literals
             case syntax.Unit():
-                return Unit()
+                return UNIT
             case syntax.Bool(value=value):
-                return Bool(value)
+                return TRUE if value else FALSE
             case syntax.Num(value=value):
                 return Num(value)
             case syntax.String(value=value):
@@ -210,52 +677,68 @@ class Interp:
                     {self.eval(k): self.eval(v) for k, v in elements.items()}
                 )
 
-            case syntax.Variable(name=name):
-                idx = self.lookup(name)
-                return self.env_stack[idx][name]
-            case syntax.BinOp(lhs=lhs, rhs=rhs, op=op):
-
-                lhs = self.eval(lhs)
-                rhs = self.eval(rhs)
+            case syntax.Variable(depth=depth, slot=slot):
+                if type(e) is syntax.Variable:
+                    if e.boxed:
+                        e.__class__ = CellRead
+                    elif depth < 2:
+                        e.__class__ = ParentRead if depth else LocalRead
+                env = self.env
+                while depth:
+                    env = env.parent
+                    depth -= 1
+                return env.slots[slot].value if e.boxed else env.slots[slot]
+            case syntax.Invariant():
+                e.__class__ = InvariantRead
+                return e.run(self)
+            case syntax.BinOp(lhs=lhs, rhs=rhs, op=op, typed=True):
+                # infer.Infer proved both are numbers
+                lhs = self.eval(lhs).value
+                rhs = self.eval(rhs).value
+                if type(e) is syntax.BinOp:
+                    e.__class__ = NUM_OPS[type(op)]
                 match op:
-
                     case Plus():
-                        return self.arith_op(lhs, rhs, lambda x, y: Num(x + y))
+                        return Num(lhs + rhs)
                     case Minus():
-                        return self.arith_op(lhs, rhs, lambda x, y: Num(x - y))
+                        return Num(lhs - rhs)
                     case Mult():
-                        return self.arith_op(lhs, rhs, lambda x, y: Num(x * y))
+                        return Num(lhs * rhs)
                     case Div():
-                        lhs = self.assert_num(lhs)
-                        rhs = self.assert_num(rhs)
                         if rhs == 0:
                             raise DivZeroError()
                         return Num(lhs / rhs)
                     case Eq():
-                        return self.arith_op(lhs, rhs, lambda x, y: Bool(x == y))
+                        return TRUE if lhs == rhs else FALSE
                     case Leq():
-                        return self.arith_op(lhs, rhs, lambda x, y: Bool(x <= y))
+                        return TRUE if lhs <= rhs else FALSE
                     case Mod():
-                        return self.arith_op(lhs, rhs, lambda x, y: Num(x % y))
-                    # ..
+                        return Num(lhs % rhs)
+            case syntax.BinOp(lhs=lhs, rhs=rhs, op=op):
+                lhs = self.eval(lhs)
+                rhs = self.eval(rhs)
+                if type(e) is syntax.BinOp and type(lhs) is Num and type(rhs) is Num:
+                    e.__class__ = NUM_OPS[type(op)]
+                return self.binop(lhs, rhs, op)
             case syntax.Cond(
                 condition=condition, perchance=perchance, perchance_not=perchance_not
             ):
                 condition = self.eval(condition)
-                condition = self.assert_bool(condition)
+                # a proven bool is one of the two singletons
+                condition = condition is TRUE if e.typed else self.assert_bool(condition)
 
                 if condition:
-                    return self.block(perchance)
+                    return self.block(perchance, e.perchance_size)
                 else:
                     match perchance_not:
                         case None:
-                            return Unit()
+                            return UNIT
                         case syntax.Cond():
                             return self.eval(perchance_not)
                         case [*stmts]:
-                            return self.block(stmts)
-            case syntax.Block(stmts=stmts):
-                return self.block(stmts)
+                            return self.block(stmts, e.perchance_not_size)
+            case syntax.Block(stmts=stmts, size=size):
+                return self.block(stmts, size)
 
             case syntax.Field(tb_fielded=tb_fielded, field=field):
                 tb_fielded = self.eval(tb_fielded)
@@ -279,44 +762,329 @@ class Interp:
                                 raise TypeError("Int")
                     case _:
                         raise TypeError("Subscriptable (Array / HashMap)")
-            case syntax.Func(params=params, body=body):
-                return Closure(params, body, list(self.env_stack))
+            case syntax.Func(params=params, body=body, body_size=size, free=free, outer=outer):
+                # plain reads, so cells get captured as cells
+                captured = [self.eval(v) for v in free]
+                memo = auto_memo(e.line) if e.memo else None
+                return Closure(params, body, size, Frame(captured, self.frame(outer)), e.cells, e.recursive, memo)
+            case syntax.Call(func=func):
+                return self.apply(e, self.eval(func))
+
+            case syntax.While():
+                return self.loop(e)
+            case _:
+                raise ValueError("Skill Issue")
+
+    def loop(self, e: syntax.While) -> Value:
+        condition, body = e.condition, e.body
+        # condition = self.eval(condition)
+        # condition = self.assert_bool(condition)
+
+        for slot in e.invariants:
+            self.env.slots[slot] = None
+        # one frame for the body, every time round
+        frame = Frame([None] * e.body_size, self.env)
+        cells = loop_cells(body)
+        if e.typed:
+            while self.eval(condition) is TRUE:
+                self.loop_body(body, frame, cells)
+                if self.returned is not NO_RETURN:
+                    break
+            return UNIT
+        while self.assert_bool(self.eval(condition)):
+            self.loop_body(body, frame, cells)
+            if self.returned is not NO_RETURN:
+                break
+        return UNIT
+
+    # one time round a while, in the frame it keeps
+    def loop_body(self, b: list[Stmt], frame: Frame, cells: list[int]) -> None:
+        self.env = frame
+        for s in b:
+            self.exec(s)
+            if self.returned is not NO_RETURN:
+                break
+        self.env = frame.parent
+        for slot in cells:
+            frame.slots[slot] = None
+
+    def frame(self, depth: int) -> Frame:
+        env = self.env
+        while depth:
+            env = env.parent
+            depth -= 1
+        return env
+
+    # the rest of call e, now that its function is known
+    def apply(self, e: syntax.Call, func: Value) -> Value:
+        args = e.arguments
+        match func:
+            case Closure(parameters=params):
+                if len(args) != len(params):
+                    raise IncorrectArity(len(params), len(args))
+                if type(e) is syntax.Call:
+                    e.__class__, e.cached = ClosureCall, func
+                args = [self.eval(arg) for arg in args]
+                if e.tail:
+                    return TailCall(func, args)
+                if self.segment_depth >= STACK_CALLS:
+                    return self.call_on_heap(func, args)
+                return self.call(func, args)
+            case PrimOp(func=f):
+                if type(e) is syntax.Call:
+                    e.__class__, e.cached = PrimCall, func
+                return f([self.eval(arg) for arg in args])
+
+            case _:
+                raise TypeError("Closure")
+
+    def call(self, closure: Closure, args: list[Value]) -> Value:
+        caller = self.env
+        self.segment_depth += 1
+        # memos waiting for what the call gives back, a tail call's too
+        waiting = None
+        # tail calls come back here instead of nesting, so they run in constant space
+        while True:
+            if closure.memo is not None:
+                key = memo_key(args)
+                if key is not None:
+                    ret = closure.memo.get(key)
+                    if ret is not MISS:
+                        break
+                    waiting = waiting or []
+                    waiting.append((closure.memo, key))
+                if closure.memo.itself is not None:
+                    args.append(closure.memo.itself)
+            if closure.cells:
+                for i in closure.cells:
+                    args[i] = Cell(args[i])
+            if closure.recursive:
+                args.append(closure)
+            self.env = Frame(args, closure.env)
+            try:
+                ret = self.block(closure.body, closure.body_size)
+            except Return as unwound:
+                ret = unwound.value
+            if self.returned is not NO_RETURN:
+                ret, self.returned = self.returned, NO_RETURN
+            if type(ret) is not TailCall:
+                break
+            closure, args = ret.closure, ret.args
+        if waiting:
+            for memo, key in waiting:
+                memo.put(key, ret)
+        self.env = caller
+        self.segment_depth -= 1
+        return ret
+
+    def call_on_heap(self, closure: Closure, args: list[Value]) -> Value:
+        depth, self.segment_depth = self.segment_depth, 0
+        try:
+            return run_frames(self.call_steps(closure, args))
+        finally:
+            self.segment_depth = depth
+
+    def calls(self, e) -> bool:
+        known = self.calling.get(id(e))
+        if known is None:
+            known = self.calling[id(e)] = (e, makes_calls(e))
+        return known[1]
+
+    # the rest is the heap's side, see run_frames: eval, exec, block, the
+    # while loop and call again, as generators that yield the calls they make
+    # instead of making them. anything that makes no calls goes to the plain
+    # ones, and so does a call of a function whose body makes none
+    def steps(self, e: Exp) -> Generator:
+        if not self.calls(e):
+            return self.eval(e)
+        match e:
+            case syntax.Array(elements=elements):
+                values = []
+                for el in elements:
+                    values.append((yield from self.steps(el)))
+                return Array(values)
+            case syntax.Hashmap(elements=elements):
+                pairs = {}
+                for k, v in elements.items():
+                    k = yield from self.steps(k)
+                    pairs[k] = yield from self.steps(v)
+                return Hashmap(pairs)
+            case syntax.BinOp(lhs=lhs, rhs=rhs, op=op):
+                lhs = yield from self.steps(lhs)
+                rhs = yield from self.steps(rhs)
+                return self.binop(lhs, rhs, op)
+            case syntax.Cond(
+                condition=condition, perchance=perchance, perchance_not=perchance_not
+            ):
+                condition = yield from self.steps(condition)
+                condition = condition is TRUE if e.typed else self.assert_bool(condition)
+                if condition:
+                    return (yield from self.block_steps(perchance, e.perchance_size))
+                match perchance_not:
+                    case None:
+                        return UNIT
+                    case syntax.Cond():
+                        return (yield from self.steps(perchance_not))
+                    case [*stmts]:
+                        return (yield from self.block_steps(stmts, e.perchance_not_size))
+            case syntax.Block(stmts=stmts, size=size):
+                return (yield from self.block_steps(stmts, size))
+            case syntax.Field(tb_fielded=tb_fielded, field=field):
+                tb_fielded = yield from self.steps(tb_fielded)
+                match tb_fielded:
+                    case Hashmap(elements=elements):
+                        return elements[String(field)]
+                    case _:
+                        raise TypeError("HashMap")
+            case syntax.Subscript(tb_indexed=tb_indexed, index=index):
+                tb_indexed = yield from self.steps(tb_indexed)
+                match tb_indexed:
+                    case Hashmap(elements=elements):
+                        index = yield from self.steps(index)
+                        return elements[index]
+                    case Array(elements=elements):
+                        index = yield from self.steps(index)
+                        match index:
+                            case Num(value=int(ix)):
+                                return elements[ix]
+                            case _:
+                                raise TypeError("Int")
+                    case _:
+                        raise TypeError("Subscriptable (Array / HashMap)")
             case syntax.Call(func=func, arguments=args):
-                func = self.eval(func)
+                func = yield from self.steps(func)
                 match func:
-                    case Closure(parameters=params, body=body, env=e):
+                    case Closure(parameters=params):
                         if len(args) != len(params):
                             raise IncorrectArity(len(params), len(args))
-                        local = e + [
-                            {name: self.eval(arg) for name, arg in zip(params, args)}
-                        ]
-                        try:
-                            return Interp(local).block(body)
-                        except Return as ret:
-                            return ret.value
-                    case PrimOp(func=func):
-                        args = [self.eval(arg) for arg in args]
-                        return func(args)
-
+                        values = []
+                        for arg in args:
+                            values.append((yield from self.steps(arg)))
+                        if e.tail:
+                            return TailCall(func, values)
+                        if not self.calls(func.body):
+                            return self.call(func, values)
+                        return (yield self.call_steps(func, values))
+                    case PrimOp(func=f):
+                        values = []
+                        for arg in args:
+                            values.append((yield from self.steps(arg)))
+                        return f(values)
                     case _:
                         raise TypeError("Closure")
-
-            case syntax.While(condition=condition, body=body):
-                # condition = self.eval(condition)
-                # condition = self.assert_bool(condition)
-
-                while self.assert_bool(self.eval(condition)):
-                    self.block(body)
-                return Unit()
+            case syntax.While():
+                return (yield from self.loop_steps(e))
             case _:
                 raise ValueError("Skill Issue")
 
-    def lookup(self, name: str):
-        for idx, env in list(enumerate(self.env_stack))[::-1]:
-            if name in env:
-                return idx
+    def exec_steps(self, s: Stmt) -> Generator:
+        if not self.calls(s):
+            return self.exec(s)
+        match s:
+            case syntax.NakedExp(exp=exp):
+                yield from self.steps(exp)
+            case syntax.Let(slot=slot, init=init):
+                if s.boxed:
+                    cell = self.env.slots[slot]
+                    if cell is None:
+                        cell = self.env.slots[slot] = Cell(None)
+                    cell.value = yield from self.steps(init)
+                else:
+                    value = yield from self.steps(init)
+                    self.env.slots[slot] = value
+            case syntax.Assign(target=syntax.Variable(depth=depth, slot=slot) as target, value=value):
+                value = yield from self.steps(value)
+                env = self.frame(depth)
+                if target.boxed:
+                    env.slots[slot].value = value
+                else:
+                    env.slots[slot] = value
+            case syntax.Assign():
+                raise ValueError("Invalid lvalue")
+            case syntax.Return(tb_returned=tb_returned, unwinds=True):
+                tb_returned = yield from self.steps(tb_returned)
+                raise Return(tb_returned)
+            case syntax.Return(tb_returned=tb_returned):
+                self.returned = yield from self.steps(tb_returned)
+            case _:
+                raise ValueError("Unknown Statement")
 
-        raise UnboundVariable(name)
+    def block_steps(self, b: list[Stmt], size: int) -> Generator:
+        if not b:
+            return UNIT
+        *stuff, last = b
+        self.env = Frame([None] * size, self.env)
+        for s in stuff:
+            yield from self.exec_steps(s)
+            if self.returned is not NO_RETURN:
+                self.env = self.env.parent
+                return UNIT
+        match last:
+            case syntax.NakedExp(exp=exp):
+                ret = yield from self.steps(exp)
+            case _:
+                yield from self.exec_steps(last)
+                ret = UNIT
+        self.env = self.env.parent
+        return ret
+
+    def loop_steps(self, e: syntax.While) -> Generator:
+        for slot in e.invariants:
+            self.env.slots[slot] = None
+        frame = Frame([None] * e.body_size, self.env)
+        cells = loop_cells(e.body)
+        while True:
+            condition = yield from self.steps(e.condition)
+            if not (condition is TRUE if e.typed else self.assert_bool(condition)):
+                return UNIT
+            yield from self.loop_body_steps(e.body, frame, cells)
+            if self.returned is not NO_RETURN:
+                return UNIT
+
+    def loop_body_steps(self, b: list[Stmt], frame: Frame, cells: list[int]) -> Generator:
+        self.env = frame
+        for s in b:
+            yield from self.exec_steps(s)
+            if self.returned is not NO_RETURN:
+                break
+        self.env = frame.parent
+        for slot in cells:
+            frame.slots[slot] = None
+
+    def call_steps(self, closure: Closure, args: list[Value]) -> Generator:
+        caller = self.env
+        waiting = None
+        while True:
+            if closure.memo is not None:
+                key = memo_key(args)
+                if key is not None:
+                    ret = closure.memo.get(key)
+                    if ret is not MISS:
+                        break
+                    waiting = waiting or []
+                    waiting.append((closure.memo, key))
+                if closure.memo.itself is not None:
+                    args.append(closure.memo.itself)
+            if closure.cells:
+                for i in closure.cells:
+                    args[i] = Cell(args[i])
+            if closure.recursive:
+                args.append(closure)
+            self.env = Frame(args, closure.env)
+            try:
+                ret = yield from self.block_steps(closure.body, closure.body_size)
+            except Return as unwound:
+                ret = unwound.value
+            if self.returned is not NO_RETURN:
+                ret, self.returned = self.returned, NO_RETURN
+            if type(ret) is not TailCall:
+                break
+            closure, args = ret.closure, ret.args
+        if waiting:
+            for memo, key in waiting:
+                memo.put(key, ret)
+        self.env = caller
+        return ret
 
 
 class RuntimeError(Exception):
@@ -372,4 +1140,22 @@ def make_global_env() -> dict[str, Value]:
             case _:
                 raise IncorrectArity(1, len(params))
 
-    return {"puts": PrimOp(puts), "len": PrimOp(length)}
+    # a copy of f that remembers what it gave back, for functions pure.py
+    # can't prove pure. calls f makes to itself still go to f
+    def memo(params: list[Value]) -> Value:
+        match params:
+            case [Closure() as f]:
+                memo = Memo(itself=f if f.recursive else None)
+                return Closure(f.parameters, f.body, f.body_size, f.env, f.cells, False, memo)
+            case [_]:
+                raise TypeError("Closure")
+            case _:
+                raise IncorrectArity(1, len(params))
+
+    return {"puts": PrimOp(puts), "len": PrimOp(length), "memo": PrimOp(memo)}
+
+
+# lays the globals out in the same order static.Anal gave them slots
+def make_global_slots(names: list[str]) -> list[Value]:
+    env = make_global_env()
+    return [env[name] for name in names]
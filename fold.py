@@ -0,0 +1,239 @@
+from typing import Optional
+from syntax import Exp, Stmt
+from syntax import Plus, Minus, Mult, Div, Eq, Leq, Mod
+import syntax
+
+# constant folding and propagation over an AST static.Anal has resolved.
+# nothing that could fail at runtime is folded (1/0, 1 + true, if (3) ...),
+# so errors still happen when and where they used to. frames keep their
+# layout: lets stay, only reads of constant ones are replaced
+
+
+class Binding:
+    # the literal it's bound to, filled in on the second pass
+    value: Optional[Exp]
+    mutable: bool
+
+    def __init__(self):
+        self.value = None
+        self.mutable = False
+
+
+def literal(e: Exp) -> bool:
+    return isinstance(e, (syntax.Num, syntax.Bool, syntax.String))
+
+
+def copy(e: Exp) -> Exp:
+    return type(e)(e.value)
+
+
+def fold_binop(lhs: Exp, rhs: Exp, op: syntax.Operator) -> Optional[Exp]:
+    if not (isinstance(lhs, syntax.Num) and isinstance(rhs, syntax.Num)):
+        return None
+    x, y = lhs.value, rhs.value
+    match op:
+        case Plus():
+            return syntax.Num(x + y)
+        case Minus():
+            return syntax.Num(x - y)
+        case Mult():
+            return syntax.Num(x * y)
+        case Div() if y != 0:
+            return syntax.Num(x / y)
+        case Mod() if y != 0:
+            return syntax.Num(x % y)
+        case Eq():
+            return syntax.Bool(x == y)
+        case Leq():
+            return syntax.Bool(x <= y)
+    return None
+
+
+# walks the scopes exactly like static.Anal did, so (depth, slot) finds the
+# binding a variable refers to
+class Scopes:
+    stack: list[dict[int, Binding]]
+
+    def __init__(self):
+        self.stack = [{}]
+
+    def push(self) -> None:
+        self.stack.append({})
+
+    def pop(self) -> None:
+        self.stack.pop()
+
+    def find(self, depth: int, slot: int) -> Optional[Binding]:
+        return self.stack[-1 - depth].get(slot)
+
+    # a function's body sees the scopes outside every function, then what it
+    # captured, then its parameters. gives back the stack to go back to
+    def enter(self, f: syntax.Func) -> list[dict[int, Binding]]:
+        stack = self.stack
+        captured = {i: self.find(v.depth, v.slot) for i, v in enumerate(f.free)}
+        self.stack = stack[: len(stack) - f.outer] + [captured, {}]
+        return stack
+
+
+class Fold:
+    scopes: Scopes
+    # first pass: which lets and assignments hit each binding
+    bindings: dict[int, Binding]
+    collecting: bool
+
+    def __init__(self):
+        self.scopes = Scopes()
+        self.bindings = {}
+        self.collecting = True
+
+    def program(self, ast: list[Stmt]) -> list[Stmt]:
+        self.block(ast)
+        self.collecting = False
+        self.scopes = Scopes()
+        return self.block(ast)
+
+    def block(self, b: list[Stmt]) -> list[Stmt]:
+        match b:
+            case []:
+                return b
+            case [*stuff]:
+                self.scopes.push()
+                b[:] = [self.stmt(s) for s in stuff]
+                self.scopes.pop()
+                return b
+
+    def let(self, s: syntax.Let) -> None:
+        scope = self.scopes.stack[-1]
+        if self.collecting:
+            if s.slot in scope:
+                # let again in the same scope, it's the same slot
+                scope[s.slot].mutable = True
+            else:
+                scope[s.slot] = Binding()
+            self.bindings[id(s)] = scope[s.slot]
+        else:
+            # init is folded by now, so let k = 3 + 1 * 2 counts too
+            binding = self.bindings[id(s)]
+            if literal(s.init):
+                binding.value = s.init
+            scope[s.slot] = binding
+
+    def stmt(self, s: Stmt) -> Stmt:
+        match s:
+            case syntax.NakedExp(exp=exp):
+                s.exp = self.fold(exp)
+            case syntax.Let(init=syntax.Func()):
+                self.let(s)
+                s.init = self.fold(s.init)
+            case syntax.Let(init=init):
+                s.init = self.fold(init)
+                self.let(s)
+            case syntax.Assign(target=syntax.Variable(depth=depth, slot=slot), value=value):
+                s.value = self.fold(value)
+                binding = self.scopes.find(depth, slot)
+                if binding is not None:
+                    binding.mutable = True
+            case syntax.Assign(target=target, value=value):
+                s.target = self.fold_lvalue(target)
+                s.value = self.fold(value)
+            case syntax.Return(tb_returned=tb_returned):
+                s.tb_returned = self.fold(tb_returned)
+        return s
+
+    def fold_lvalue(self, e: Exp) -> Exp:
+        match e:
+            case syntax.Field(tb_fielded=tb):
+                e.tb_fielded = self.fold(tb)
+            case syntax.Subscript(tb_indexed=tb, index=index):
+                e.tb_indexed = self.fold(tb)
+                e.index = self.fold(index)
+        return e
+
+    def fold(self, e: Exp) -> Exp:
+        match e:
+            case syntax.Variable(depth=depth, slot=slot):
+                binding = self.scopes.find(depth, slot)
+                if self.collecting or binding is None:
+                    return e
+                if binding.value is not None and not binding.mutable:
+                    return copy(binding.value)
+                return e
+            case syntax.BinOp(lhs=lhs, rhs=rhs, op=op):
+                e.lhs = self.fold(lhs)
+                e.rhs = self.fold(rhs)
+                if self.collecting:
+                    return e
+                return fold_binop(e.lhs, e.rhs, op) or e
+
+            case syntax.Cond(
+                condition=condition, perchance=perchance, perchance_not=perchance_not
+            ):
+                e.condition = self.fold(condition)
+                self.block(perchance)
+                match perchance_not:
+                    case syntax.Cond():
+                        # an elif that folded away goes back in as a plain else
+                        match self.fold(perchance_not):
+                            case syntax.Block(stmts=stmts, size=size):
+                                e.perchance_not, e.perchance_not_size = stmts, size
+                            case syntax.Unit():
+                                e.perchance_not = None
+                            case elif_:
+                                e.perchance_not = elif_
+                    case [*stmts]:
+                        self.block(stmts)
+                if self.collecting or not isinstance(e.condition, syntax.Bool):
+                    return e
+                # the taken branch still gets its own frame, as a block
+                if e.condition.value:
+                    return self.as_block(e.perchance, e.perchance_size)
+                match e.perchance_not:
+                    case None:
+                        return syntax.Unit()
+                    case [*stmts]:
+                        return self.as_block(stmts, e.perchance_not_size)
+                    case elif_:
+                        # already folded, might not be a Cond anymore
+                        return elif_
+            case syntax.While(condition=condition, body=body):
+                e.condition = self.fold(condition)
+                self.block(body)
+                if not self.collecting and isinstance(e.condition, syntax.Bool) and not e.condition.value:
+                    return syntax.Unit()
+                return e
+            case syntax.Block(stmts=stmts):
+                self.block(stmts)
+                return e
+
+            case syntax.Func(params=params, body=body):
+                # parameters are never constant, but they take up the scope
+                stack = self.scopes.enter(e)
+                self.block(body)
+                self.scopes.stack = stack
+                return e
+            case syntax.Call(func=func, arguments=args):
+                e.func = self.fold(func)
+                e.arguments = [self.fold(arg) for arg in args]
+                return e
+            case syntax.Array(elements=elements):
+                e.elements = [self.fold(el) for el in elements]
+                return e
+            case syntax.Hashmap(elements=elements):
+                e.elements = {self.fold(k): self.fold(v) for k, v in elements.items()}
+                return e
+            case syntax.Field(tb_fielded=tb):
+                e.tb_fielded = self.fold(tb)
+                return e
+            case syntax.Subscript(tb_indexed=tb, index=index):
+                e.tb_indexed = self.fold(tb)
+                e.index = self.fold(index)
+                return e
+            case _:
+                return e
+
+    def as_block(self, b: list[Stmt], size: int) -> Exp:
+        if not b:
+            return syntax.Unit()
+        block = syntax.Block(b)
+        block.size = size
+        return block
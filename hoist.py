@@ -0,0 +1,280 @@
+from typing import Optional
+from syntax import Exp, Stmt
+import syntax
+from fold import Scopes
+
+# loop-invariant code motion over an AST static.Anal has resolved and
+# infer.Infer has typed. an arithmetic expression in a while whose variables
+# can't change while the loop runs becomes a syntax.Invariant, which works
+# itself out the first time round and keeps that in a new slot at the end of
+# the block the loop is in. so it still runs where it used to, and fails
+# there too, just not again every time round. the loop gets .invariants, the
+# slots to empty when it starts
+
+
+class Binding:
+    # the function it's declared in, None for the program's
+    owner: Optional[syntax.Func]
+    # assigned from a function other than its own, which a call in the loop
+    # might be running. only the program's variables can be, a function's
+    # own would be in a cell
+    foreign: bool
+
+    def __init__(self, owner: Optional[syntax.Func]):
+        self.owner = owner
+        self.foreign = False
+
+
+# a while statement being walked
+class Loop:
+    # bindings assigned and declared anywhere in it
+    assigned: set[int]
+    declared: set[int]
+
+    def __init__(self):
+        self.assigned = set()
+        self.declared = set()
+
+
+# a while statement's invariants on their way out to its block
+class Lift:
+    loop: Loop
+    # where the block the loop is in sits in the scope stack, and its size
+    block: int
+    size: int
+    slots: list[int]
+    # structure of an expression -> the slot it got
+    seen: dict[tuple, int]
+
+    def __init__(self, loop: Loop, block: int, size: int):
+        self.loop = loop
+        self.block = block
+        self.size = size
+        self.slots = []
+        self.seen = {}
+
+
+class Hoist:
+    scopes: Scopes
+    # by the let that declares them, and by function for parameters
+    bindings: dict[int, Binding]
+    params: dict[int, list[Binding]]
+    # first pass: which bindings get assigned from other functions
+    collecting: bool
+    # the function we're in, None at the top
+    func: Optional[syntax.Func]
+    # the while statements we're in, innermost last
+    loops: list[Loop]
+    # what every variable read refers to, by id
+    resolved: dict[int, Optional[Binding]]
+
+    def __init__(self):
+        self.scopes = Scopes()
+        self.bindings = {}
+        self.params = {}
+        self.collecting = True
+        self.func = None
+        self.loops = []
+        self.resolved = {}
+
+    # gives back the program's new frame size
+    def program(self, ast: list[Stmt], size: int) -> int:
+        self.block(ast, size)
+        self.collecting = False
+        self.scopes = Scopes()
+        return self.block(ast, size)
+
+    def let(self, s: syntax.Let) -> None:
+        if self.collecting:
+            self.bindings[id(s)] = self.scopes.stack[-1].get(s.slot) or Binding(self.func)
+        binding = self.scopes.stack[-1][s.slot] = self.bindings[id(s)]
+        for loop in self.loops:
+            loop.declared.add(id(binding))
+
+    # the block's new size, after what loops in it hoisted
+    def block(self, b: list[Stmt], size: int) -> int:
+        match b:
+            case []:
+                return size
+            case [*stuff]:
+                self.scopes.push()
+                for s in stuff:
+                    match s:
+                        case syntax.NakedExp(exp=syntax.While() as loop) if not self.collecting:
+                            lift = self.loop(loop, size)
+                            loop.invariants = lift.slots
+                            size += len(lift.slots)
+                        case _:
+                            self.stmt(s)
+                self.scopes.pop()
+                return size
+
+    def stmt(self, s: Stmt) -> None:
+        match s:
+            case syntax.NakedExp(exp=exp):
+                self.visit(exp)
+            case syntax.Let(init=syntax.Func()):
+                # recursion sees itself
+                self.let(s)
+                self.visit(s.init)
+            case syntax.Let(init=init):
+                self.visit(init)
+                self.let(s)
+            case syntax.Assign(target=syntax.Variable(depth=depth, slot=slot), value=value):
+                self.visit(value)
+                binding = self.scopes.find(depth, slot)
+                if binding is not None:
+                    if self.collecting and binding.owner is not self.func:
+                        binding.foreign = True
+                    for loop in self.loops:
+                        loop.assigned.add(id(binding))
+            case syntax.Assign(target=target, value=value):
+                self.visit(target)
+                self.visit(value)
+            case syntax.Return(tb_returned=tb_returned):
+                self.visit(tb_returned)
+
+    def visit(self, e: Exp) -> None:
+        match e:
+            case syntax.Variable(depth=depth, slot=slot):
+                self.resolved[id(e)] = self.scopes.find(depth, slot)
+            case syntax.BinOp(lhs=lhs, rhs=rhs):
+                self.visit(lhs)
+                self.visit(rhs)
+            case syntax.Cond(condition=condition, perchance=perchance, perchance_not=perchance_not):
+                self.visit(condition)
+                e.perchance_size = self.block(perchance, e.perchance_size)
+                match perchance_not:
+                    case syntax.Cond():
+                        self.visit(perchance_not)
+                    case [*stmts]:
+                        e.perchance_not_size = self.block(stmts, e.perchance_not_size)
+            case syntax.While(condition=condition, body=body):
+                self.visit(condition)
+                e.body_size = self.block(body, e.body_size)
+            case syntax.Block(stmts=stmts):
+                e.size = self.block(stmts, e.size)
+
+            case syntax.Func(params=params, body=body):
+                stack = self.scopes.enter(e)
+                bindings = self.params.setdefault(id(e), [Binding(e) for _ in params])
+                self.scopes.stack[-1] = dict(enumerate(bindings))
+                outer, self.func = self.func, e
+                # a loop around the function doesn't run its body
+                loops, self.loops = self.loops, []
+                e.body_size = self.block(body, e.body_size)
+                self.func, self.loops = outer, loops
+                self.scopes.stack = stack
+            case syntax.Call(func=func, arguments=args):
+                self.visit(func)
+                for arg in args:
+                    self.visit(arg)
+
+            case syntax.Array(elements=elements):
+                for el in elements:
+                    self.visit(el)
+            case syntax.Hashmap(elements=elements):
+                for k, v in elements.items():
+                    self.visit(k)
+                    self.visit(v)
+            case syntax.Field(tb_fielded=tb):
+                self.visit(tb)
+            case syntax.Subscript(tb_indexed=tb, index=index):
+                self.visit(tb)
+                self.visit(index)
+
+    # a while statement in the block on top of the scope stack: walks it
+    # (its inner loops hoist into its body first), then takes its invariants
+    def loop(self, e: syntax.While, size: int) -> Lift:
+        loop = Loop()
+        self.loops.append(loop)
+        self.visit(e)
+        self.loops.pop()
+        lift = Lift(loop, len(self.scopes.stack) - 1, size)
+        height = len(self.scopes.stack)
+        e.condition = self.hoist(e.condition, lift, height)
+        self.hoist_block(e.body, lift, height + 1)
+        return lift
+
+    def hoist_block(self, b: list[Stmt], lift: Lift, height: int) -> None:
+        for s in b:
+            match s:
+                case syntax.NakedExp(exp=exp):
+                    s.exp = self.hoist(exp, lift, height)
+                case syntax.Let(init=init):
+                    s.init = self.hoist(init, lift, height)
+                case syntax.Assign(target=target, value=value):
+                    match target:
+                        case syntax.Field(tb_fielded=tb):
+                            target.tb_fielded = self.hoist(tb, lift, height)
+                        case syntax.Subscript(tb_indexed=tb, index=index):
+                            target.tb_indexed = self.hoist(tb, lift, height)
+                            target.index = self.hoist(index, lift, height)
+                    s.value = self.hoist(value, lift, height)
+                case syntax.Return(tb_returned=tb_returned):
+                    s.tb_returned = self.hoist(tb_returned, lift, height)
+
+    # e with its biggest invariant parts made Invariants. height is how many
+    # scopes are around e
+    def hoist(self, e: Exp, lift: Lift, height: int) -> Exp:
+        key = self.invariant(e, lift.loop)
+        if key is not None and isinstance(e, syntax.BinOp):
+            # the same expression twice keeps its value once
+            slot = lift.seen.get(key)
+            if slot is None:
+                slot = lift.seen[key] = lift.size + len(lift.slots)
+                lift.slots.append(slot)
+            return syntax.Invariant(e, height - 1 - lift.block, slot)
+        match e:
+            case syntax.BinOp(lhs=lhs, rhs=rhs):
+                e.lhs = self.hoist(lhs, lift, height)
+                e.rhs = self.hoist(rhs, lift, height)
+            case syntax.Cond(condition=condition, perchance=perchance, perchance_not=perchance_not):
+                e.condition = self.hoist(condition, lift, height)
+                self.hoist_block(perchance, lift, height + 1)
+                match perchance_not:
+                    case syntax.Cond():
+                        e.perchance_not = self.hoist(perchance_not, lift, height)
+                    case [*stmts]:
+                        self.hoist_block(stmts, lift, height + 1)
+            case syntax.While(condition=condition, body=body):
+                e.condition = self.hoist(condition, lift, height)
+                self.hoist_block(body, lift, height + 1)
+            case syntax.Block(stmts=stmts):
+                self.hoist_block(stmts, lift, height + 1)
+            case syntax.Call(func=func, arguments=args):
+                e.func = self.hoist(func, lift, height)
+                e.arguments = [self.hoist(arg, lift, height) for arg in args]
+            case syntax.Array(elements=elements):
+                e.elements = [self.hoist(el, lift, height) for el in elements]
+            case syntax.Hashmap(elements=elements):
+                e.elements = {self.hoist(k, lift, height): self.hoist(v, lift, height) for k, v in elements.items()}
+            case syntax.Field(tb_fielded=tb):
+                e.tb_fielded = self.hoist(tb, lift, height)
+            case syntax.Subscript(tb_indexed=tb, index=index):
+                e.tb_indexed = self.hoist(tb, lift, height)
+                e.index = self.hoist(index, lift, height)
+        return e
+
+    # the structure of e if it can't change while the loop runs, else None.
+    # a lone number has nothing to hoist, a lone variable is as cheap to read
+    # where it is
+    def invariant(self, e: Exp, loop: Loop) -> Optional[tuple]:
+        match e:
+            case syntax.Num(value=value):
+                return ("num", type(value), value)
+            case syntax.Variable(boxed=False):
+                binding = self.resolved.get(id(e))
+                if binding is None or binding.foreign:
+                    return None
+                if id(binding) in loop.assigned or id(binding) in loop.declared:
+                    return None
+                return ("var", id(binding))
+            case syntax.BinOp(lhs=lhs, rhs=rhs, op=op):
+                lhs = self.invariant(lhs, loop)
+                rhs = self.invariant(rhs, loop)
+                # two numbers are folded already, unless it's a division by 0
+                if lhs is None or rhs is None or lhs[0] == rhs[0] == "num":
+                    return None
+                return (type(op).__name__, lhs, rhs)
+        return None
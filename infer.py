@@ -0,0 +1,175 @@
+from typing import Optional
+from syntax import Exp, Stmt
+from syntax import Eq, Leq
+import syntax
+from fold import Scopes
+
+# flow-insensitive type inference over an AST static.Anal has resolved and
+# fold.Fold has folded. a variable has one type for the whole program, the one
+# everything ever assigned to it agrees on. BinOps whose operands are proven
+# numbers and Conds/Whiles whose condition is a proven bool get .typed, and
+# eval.Interp runs those without checking. anything unsure stays checked
+
+NUM = "Num"
+BOOL = "Bool"
+STRING = "String"
+ARRAY = "Array"
+HASHMAP = "Hashmap"
+CLOSURE = "Closure"
+UNIT = "Unit"
+ANY = "Any"
+
+# None is "nothing assigned yet"
+Type = Optional[str]
+
+
+def join(a: Type, b: Type) -> Type:
+    if a is None or a == b:
+        return b
+    if b is None:
+        return a
+    return ANY
+
+
+class Binding:
+    type: Type
+
+    def __init__(self):
+        self.type = None
+
+
+class Infer:
+    scopes: Scopes
+    # by the let that declares them, shared by lets of the same slot
+    bindings: dict[int, Binding]
+    # first time round, when the bindings get made
+    collecting: bool
+    # whether some binding's type grew this time round
+    changed: bool
+
+    def __init__(self):
+        self.scopes = Scopes()
+        self.bindings = {}
+        self.collecting = True
+        self.changed = False
+
+    # goes over the program until no type changes. the last pass saw the
+    # final types everywhere, so the marks it left are the ones that hold
+    def program(self, ast: list[Stmt]) -> None:
+        self.changed = True
+        while self.changed:
+            self.changed = False
+            self.scopes = Scopes()
+            self.block(ast)
+            self.collecting = False
+
+    def assign(self, binding: Optional[Binding], t: Type) -> None:
+        # parameters and globals have no binding, they're ANY anyway
+        if binding is None:
+            return
+        t = join(binding.type, t)
+        if t != binding.type:
+            binding.type = t
+            self.changed = True
+
+    def let(self, s: syntax.Let) -> Binding:
+        scope = self.scopes.stack[-1]
+        if self.collecting:
+            self.bindings[id(s)] = scope.setdefault(s.slot, Binding())
+        binding = scope[s.slot] = self.bindings[id(s)]
+        return binding
+
+    # the type of the block's value
+    def block(self, b: list[Stmt]) -> Type:
+        match b:
+            case []:
+                return UNIT
+            case [*stuff]:
+                self.scopes.push()
+                for s in stuff:
+                    t = self.stmt(s)
+                self.scopes.pop()
+                return t
+
+    def stmt(self, s: Stmt) -> Type:
+        match s:
+            case syntax.NakedExp(exp=exp):
+                return self.infer(exp)
+            case syntax.Let(init=syntax.Func()):
+                # recursion sees itself
+                binding = self.let(s)
+                self.assign(binding, self.infer(s.init))
+            case syntax.Let(init=init):
+                t = self.infer(init)
+                self.assign(self.let(s), t)
+            case syntax.Assign(target=syntax.Variable(depth=depth, slot=slot), value=value):
+                self.assign(self.scopes.find(depth, slot), self.infer(value))
+            case syntax.Assign(target=target, value=value):
+                self.infer(target)
+                self.infer(value)
+            case syntax.Return(tb_returned=tb_returned):
+                self.infer(tb_returned)
+        return UNIT
+
+    def infer(self, e: Exp) -> Type:
+        match e:
+            case syntax.Unit():
+                return UNIT
+            case syntax.Bool():
+                return BOOL
+            case syntax.Num():
+                return NUM
+            case syntax.String():
+                return STRING
+
+            case syntax.Array(elements=elements):
+                for el in elements:
+                    self.infer(el)
+                return ARRAY
+            case syntax.Hashmap(elements=elements):
+                for k, v in elements.items():
+                    self.infer(k)
+                    self.infer(v)
+                return HASHMAP
+
+            case syntax.Variable(depth=depth, slot=slot):
+                binding = self.scopes.find(depth, slot)
+                return ANY if binding is None else binding.type
+            case syntax.BinOp(lhs=lhs, rhs=rhs, op=op):
+                lhs = self.infer(lhs)
+                rhs = self.infer(rhs)
+                e.typed = lhs == NUM and rhs == NUM
+                # a checked one that got this far gave back the same
+                return BOOL if isinstance(op, (Eq, Leq)) else NUM
+            case syntax.Cond(condition=condition, perchance=perchance, perchance_not=perchance_not):
+                e.typed = self.infer(condition) == BOOL
+                t = self.block(perchance)
+                match perchance_not:
+                    case None:
+                        return join(t, UNIT)
+                    case syntax.Cond():
+                        return join(t, self.infer(perchance_not))
+                    case [*stmts]:
+                        return join(t, self.block(stmts))
+            case syntax.While(condition=condition, body=body):
+                e.typed = self.infer(condition) == BOOL
+                self.block(body)
+                return UNIT
+            case syntax.Block(stmts=stmts):
+                return self.block(stmts)
+
+            case syntax.Func(body=body):
+                stack = self.scopes.enter(e)
+                self.block(body)
+                self.scopes.stack = stack
+                return CLOSURE
+            case syntax.Call(func=func, arguments=args):
+                self.infer(func)
+                for arg in args:
+                    self.infer(arg)
+            case syntax.Field(tb_fielded=tb):
+                self.infer(tb)
+            case syntax.Subscript(tb_indexed=tb, index=index):
+                self.infer(tb)
+                self.infer(index)
+        return ANY
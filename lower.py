@@ -1,4 +1,6 @@
+import heapq
 from syntax import *
+from optimize import is_temp
 
 class Counter:
     timestamp : int
@@ -13,6 +15,22 @@ class Counter:
         return tmp 
         
 
+# whether evaluating e can run monkey code, a function literal just makes one
+def runs_code(e: Exp) -> bool:
+    match e:
+        case Call() | Cond() | Block() | While():
+            return True
+        case BinOp(lhs=lhs, rhs=rhs) | Subscript(tb_indexed=lhs, index=rhs):
+            return runs_code(lhs) or runs_code(rhs)
+        case Field(tb_fielded=tb):
+            return runs_code(tb)
+        case Array(elements=elements):
+            return any(runs_code(el) for el in elements)
+        case Hashmap(elements=elements):
+            return any(runs_code(k) or runs_code(v) for k, v in elements.items())
+    return False
+
+
 class IR_Transformer:
     stmts: list[Stmt]
     timestamp: int
@@ -29,6 +47,11 @@ class IR_Transformer:
         match s:
             case NakedExp(exp=exp):
                 exp = self.lower(exp)
+            # a function literal is already a value, and binding it directly
+            # keeps `let f = fn` recursive for whoever consumes the IR
+            case Let(name=name, init=Func() as f):
+                stmt = Let(name, self.lower_func(f))
+                self.stmts.append(stmt)
             case Let(name=name, init=init):
                 stmt = Let(name, self.lower(init))
                 self.stmts.append(stmt)
@@ -74,36 +97,36 @@ class IR_Transformer:
 
     def lower(self, x: Exp) -> Exp:
         match x:
-            case Variable() | Num() | String() | Bool() | Unit():
+            # fresh nodes, so backends can annotate IR variables without
+            # touching the ones static.Anal resolved in the source AST
+            case Variable(name=name):
+                return Variable(name)
+            case Num() | String() | Bool() | Unit():
                 return x
             case BinOp(lhs=lhs, rhs=rhs, op=op):
-                lhs = self.lower(lhs)
-                rhs = self.lower(rhs)
+                lhs, rhs = self.lower_operands([lhs, rhs])
                 name = self.make_variable()
                 self.stmts.append(Let(name, BinOp(lhs, rhs, op)))
                 return Variable(name)
             case Block(stmts=stmts):
-                return self.lower_block(stmts)
-            case Func(params=params, body=body):
-                ir = IR_Transformer()
-                atom = ir.lower_block(body)
-                match atom:
-                    case Unit():
-                        pass
-                    case _:
-                        ir.stmts.append(Return(atom))
+                # keep it a block of its own so its lets stay scoped
+                block_ir = IR_Transformer(self.counter)
+                atom = block_ir.lower_block(stmts)
+                exp = Block(block_ir.stmts + [NakedExp(atom)])
+                name = self.make_variable()
+                self.stmts.append(Let(name, exp))
+                return Variable(name)
+            case Func():
                 name = self.make_variable()
-                self.stmts.append(Let(name, Func(params, ir.stmts)))
+                self.stmts.append(Let(name, self.lower_func(x)))
                 return Variable(name)
             case Call(func=func, arguments=args):
-                func = self.lower(func)
-                args = [self.lower(arg) for arg in args]
+                func, *args = self.lower_operands([func, *args])
                 name = self.make_variable()
                 self.stmts.append(Let(name, Call(func, args)))
                 return Variable(name) 
             case Subscript(tb_indexed=tb_indexed, index=index):
-                tb_indexed = self.lower(tb_indexed)
-                index = self.lower(index)
+                tb_indexed, index = self.lower_operands([tb_indexed, index])
                 exp = Subscript(tb_indexed, index)
                 name = self.make_variable()
                 self.stmts.append(Let(name, exp))
@@ -116,13 +139,14 @@ class IR_Transformer:
                 self.stmts.append(Let(name, exp))
                 return Variable(name)
             case Array(elements=elements):
-                elements = [self.lower(e) for e in elements]
+                elements = self.lower_operands(elements)
                 exp = Array(elements)
                 name = self.make_variable()
                 self.stmts.append(Let(name, exp))
                 return Variable(name)
             case Hashmap(elements=elements):
-                elements = {self.lower(k) : self.lower(v) for k,v in elements.items()}
+                atoms = self.lower_operands([x for pair in elements.items() for x in pair])
+                elements = dict(zip(atoms[::2], atoms[1::2]))
                 name = self.make_variable()
                 exp = Hashmap(elements)
                 self.stmts.append(Let(name, exp))
@@ -141,7 +165,10 @@ class IR_Transformer:
                     case None:
                         pass 
                     case Cond():
-                        perchance_not = self.lower(perchance_not)
+                        # lowered on its own, it must only run when the condition fails
+                        not_ir = IR_Transformer(self.counter)
+                        atom = not_ir.lower(perchance_not)
+                        perchance_not = not_ir.stmts + [NakedExp(atom)]
                     case [*stmts]:
                         not_ir = IR_Transformer(self.counter)
                         atom = not_ir.lower_block(stmts)  
@@ -153,8 +180,14 @@ class IR_Transformer:
                 return Variable(name)
 
             case While(condition=condition, body=body):
-                condition = self.lower(condition)
-                body = self.lower_block(body)
+                # the condition runs on every iteration, so it gets its own block like Cond's
+                cond_ir = IR_Transformer(self.counter)
+                atom = cond_ir.lower(condition)
+                condition = Block(cond_ir.stmts + [NakedExp(atom)])
+
+                body_ir = IR_Transformer(self.counter)
+                atom = body_ir.lower_block(body)
+                body = body_ir.stmts + [NakedExp(atom)]
                 exp = While(condition, body)
                 name = self.make_variable()
                 self.stmts.append(Let(name, exp))
@@ -163,6 +196,406 @@ class IR_Transformer:
                 print(x, type(x))
                 raise ValueError("Get Ratioed")
 
+    # operands left to right. a variable read with something after it that
+    # can run code (and so reassign it) is copied into a temporary first, so
+    # it's read where monkey reads it and not when the whole thing runs
+    def lower_operands(self, xs: list[Exp]) -> list[Exp]:
+        atoms = []
+        for i, x in enumerate(xs):
+            atom = self.lower(x)
+            if isinstance(atom, Variable) and not is_temp(atom.name) and any(runs_code(y) for y in xs[i + 1:]):
+                name = self.make_variable()
+                self.stmts.append(Let(name, atom))
+                atom = Variable(name)
+            atoms.append(atom)
+        return atoms
+
+    def lower_func(self, f: Func) -> Func:
+        ir = IR_Transformer(self.counter)
+        atom = ir.lower_block(f.body)
+        match atom:
+            case Unit():
+                pass
+            case _:
+                ir.stmts.append(Return(atom))
+        lowered = Func(f.params, ir.stmts, f.line)
+        lowered.memo = f.memo
+        return lowered
+
     def make_variable(self) -> str:
         name = f"${self.counter.inc()}"
         return name
+
+
+# the control flow of one function's ANF statements, for what needs to see
+# it: a list of basic blocks, straight runs of statements that are only
+# entered at the top and only left through their terminator. Cond, While
+# and Block become branches and jumps, their value a move into the name
+# they were bound to at the end of each way through. nested functions stay
+# as they are, they get CFGs of their own
+
+
+class Jump:
+    target: "BasicBlock"
+
+    def __init__(self, target: "BasicBlock"):
+        self.target = target
+
+    def __str__(self):
+        return f"jump b{self.target.label}"
+
+
+class Branch:
+    condition: Exp
+    then: "BasicBlock"
+    otherwise: "BasicBlock"
+
+    def __init__(self, condition: Exp, then: "BasicBlock", otherwise: "BasicBlock"):
+        self.condition = condition
+        self.then = then
+        self.otherwise = otherwise
+
+    def __str__(self):
+        return f"branch {self.condition} b{self.then.label} b{self.otherwise.label}"
+
+
+class Exit:
+    value: Exp
+
+    def __init__(self, value: Exp):
+        self.value = value
+
+    def __str__(self):
+        return f"exit {self.value}"
+
+
+Terminator = Union[Jump, Branch, Exit]
+
+
+class BasicBlock:
+    label: int
+    stmts: list[Stmt]
+    end: Optional[Terminator]
+    # temporaries live on the way in and out, see CFG.liveness
+    live_in: set[str]
+    live_out: set[str]
+
+    def __init__(self, label: int):
+        self.label = label
+        self.stmts = []
+        self.end = None
+        self.live_in = set()
+        self.live_out = set()
+
+    def successors(self) -> list["BasicBlock"]:
+        match self.end:
+            case Jump(target=target):
+                return [target]
+            case Branch(then=then, otherwise=otherwise):
+                return [then, otherwise]
+        return []
+
+
+# the names an ANF statement reads and the one it writes. a function reads
+# whatever it captures, which is anything its body reads from outside
+def uses(e: Exp) -> set[str]:
+    match e:
+        case Variable(name=name):
+            return {name}
+        case BinOp(lhs=lhs, rhs=rhs) | Subscript(tb_indexed=lhs, index=rhs):
+            return uses(lhs) | uses(rhs)
+        case Call(func=func, arguments=args):
+            return uses(func).union(*(uses(arg) for arg in args))
+        case Array(elements=elements):
+            return set().union(*(uses(el) for el in elements))
+        case Hashmap(elements=elements):
+            return set().union(*(uses(k) | uses(v) for k, v in elements.items()))
+        case Func(body=body):
+            return stmts_uses(body)
+        case Block(stmts=stmts):
+            return stmts_uses(stmts)
+        case Cond(condition=condition, perchance=perchance, perchance_not=perchance_not):
+            found = uses(condition) | stmts_uses(perchance)
+            match perchance_not:
+                case Cond():
+                    found |= uses(perchance_not)
+                case [*stmts]:
+                    found |= stmts_uses(stmts)
+            return found
+        case While(condition=condition, body=body):
+            return uses(condition) | stmts_uses(body)
+    return set()
+
+
+def stmts_uses(b: list[Stmt]) -> set[str]:
+    found = set()
+    for s in b:
+        match s:
+            case NakedExp(exp=e) | Let(init=e) | Return(tb_returned=e):
+                found |= uses(e)
+            case Assign(target=target, value=value):
+                found |= uses(value)
+                if not isinstance(target, Variable):
+                    found |= uses(target)
+    return found
+
+
+def defines(s: Stmt) -> Optional[str]:
+    match s:
+        case Let(name=name) | Assign(target=Variable(name=name)):
+            return name
+    return None
+
+
+class CFG:
+    blocks: list[BasicBlock]
+    # the functions made in here, and the temporaries they read, which
+    # live in a slot of their own
+    functions: list[Func]
+    captured: set[str]
+    # the temporaries made in here. one a function reads but doesn't make
+    # is another function's business
+    temps: set[str]
+
+    def __init__(self, blocks: list[BasicBlock], functions: list[Func]):
+        self.blocks = blocks
+        self.functions = functions
+        self.captured = set().union(*(uses(f) for f in functions))
+        self.temps = {name for b in blocks for s in b.stmts if is_temp(name := defines(s) or "")}
+
+    # the temporaries live at the start and end of every block, backwards
+    # from the uses until nothing changes
+    def liveness(self) -> None:
+        gen = {}
+        kill = {}
+        for b in self.blocks:
+            read, written = set(), set()
+            for s in b.stmts:
+                read |= stmt_reads(s) - written
+                name = defines(s)
+                if name is not None:
+                    written.add(name)
+            read |= terminator_reads(b.end) - written
+            gen[b.label] = read & self.temps
+            kill[b.label] = written
+        changed = True
+        while changed:
+            changed = False
+            for b in reversed(self.blocks):
+                out = set().union(*(succ.live_in for succ in b.successors()))
+                live = gen[b.label] | (out - kill[b.label])
+                if out != b.live_out or live != b.live_in:
+                    b.live_out, b.live_in = out, live
+                    changed = True
+
+    # every temporary's live interval over the blocks laid out in order.
+    # a statement reads at 2n and writes at 2n + 1, so one that dies where
+    # another is made can hand it its slot
+    def intervals(self) -> dict[str, list[int]]:
+        spans = {}
+
+        def see(name: str, at: int) -> None:
+            if name in self.temps:
+                span = spans.setdefault(name, [at, at])
+                span[0] = min(span[0], at)
+                span[1] = max(span[1], at)
+
+        n = 0
+        for b in self.blocks:
+            for name in b.live_in:
+                see(name, 2 * n)
+            for s in b.stmts:
+                for name in stmt_reads(s):
+                    see(name, 2 * n)
+                name = defines(s)
+                if name is not None:
+                    see(name, 2 * n + 1)
+                n += 1
+            for name in terminator_reads(b.end):
+                see(name, 2 * n)
+            for name in b.live_out:
+                see(name, 2 * n + 1)
+            n += 1
+        return spans
+
+    # linear scan: temporaries in the order they start, each taking the
+    # lowest slot nobody live is using. there's always another slot, so
+    # nothing spills. the captured ones are left out, they need cells
+    def allocate(self) -> dict[str, int]:
+        spans = self.intervals()
+        order = sorted((lo, hi, name) for name, (lo, hi) in spans.items() if name not in self.captured)
+        slots = {}
+        active = []
+        free = []
+        count = 0
+        for lo, hi, name in order:
+            while active and active[0][0] < lo:
+                heapq.heappush(free, heapq.heappop(active)[1])
+            if free:
+                slot = heapq.heappop(free)
+            else:
+                slot, count = count, count + 1
+            slots[name] = slot
+            heapq.heappush(active, (hi, slot))
+        return slots
+
+    def __str__(self):
+        slots = self.allocate()
+        lines = []
+        for b in self.blocks:
+            live = " ".join(f"{name}@{slots.get(name, '-')}" for name in sorted(b.live_in))
+            lines.append(f"b{b.label}:" + (f"  # live {live}" if live else ""))
+            lines.extend(f"    {s}" for s in b.stmts)
+            lines.append(f"    {b.end}")
+        return "\n".join(lines)
+
+
+def stmt_reads(s: Stmt) -> set[str]:
+    match s:
+        case NakedExp(exp=e) | Let(init=e) | Return(tb_returned=e):
+            return uses(e)
+        case Assign(target=Variable(), value=value):
+            return uses(value)
+        case Assign(target=target, value=value):
+            return uses(target) | uses(value)
+    return set()
+
+
+def terminator_reads(end: Optional[Terminator]) -> set[str]:
+    match end:
+        case Branch(condition=e) | Exit(value=e):
+            return uses(e)
+    return set()
+
+
+class CFG_Builder:
+    blocks: list[BasicBlock]
+    current: BasicBlock
+
+    def __init__(self):
+        self.blocks = []
+        self.current = self.new_block()
+
+    def build(self, body: list[Stmt]) -> CFG:
+        self.stmts(body, None)
+        self.current.end = Exit(Unit())
+        functions = []
+        for b in self.blocks:
+            for s in b.stmts:
+                match s:
+                    case Let(init=Func() as f) | NakedExp(exp=Func() as f) | Assign(value=Func() as f):
+                        functions.append(f)
+        return CFG(self.blocks, functions)
+
+    def new_block(self) -> BasicBlock:
+        b = BasicBlock(len(self.blocks))
+        self.blocks.append(b)
+        return b
+
+    # ends the current block, the ones after it go into next
+    def finish(self, end: Terminator, next: Optional[BasicBlock] = None) -> None:
+        self.current.end = end
+        self.current = next if next is not None else self.new_block()
+
+    # the trailing expression is the list's value and goes into dst
+    def stmts(self, b: list[Stmt], dst: Optional[str]) -> None:
+        for s in b[:-1]:
+            self.stmt(s)
+        match b:
+            case [*_, NakedExp(exp=exp)]:
+                self.exp(exp, dst)
+            case [*_, s]:
+                self.stmt(s)
+                self.move(dst, Unit())
+            case []:
+                self.move(dst, Unit())
+
+    def move(self, dst: Optional[str], e: Exp) -> None:
+        if dst is not None:
+            self.current.stmts.append(Let(dst, e))
+
+    def stmt(self, s: Stmt) -> None:
+        match s:
+            case NakedExp(exp=exp):
+                self.exp(exp, None)
+            case Let(name=name, init=Block() | Cond() | While() as init):
+                self.exp(init, name)
+            case Assign(target=Variable(name=name), value=Block() | Cond() | While() as value):
+                self.exp(value, name)
+            case Return(tb_returned=tb_returned):
+                # anything after it is dead, but still gets a block
+                self.finish(Exit(tb_returned))
+            case _:
+                self.current.stmts.append(s)
+
+    # e, with its value going into dst
+    def exp(self, e: Exp, dst: Optional[str]) -> None:
+        match e:
+            case Block(stmts=stmts):
+                self.stmts(stmts, dst)
+            case Cond(condition=condition, perchance=perchance, perchance_not=perchance_not):
+                then, otherwise, join = BasicBlock(0), BasicBlock(0), BasicBlock(0)
+                self.finish(Branch(self.condition(condition), then, otherwise), self.place(then))
+                self.stmts(perchance, dst)
+                self.finish(Jump(join), self.place(otherwise))
+                match perchance_not:
+                    case None:
+                        self.move(dst, Unit())
+                    case Cond():
+                        self.exp(perchance_not, dst)
+                    case [*stmts]:
+                        self.stmts(stmts, dst)
+                self.finish(Jump(join), self.place(join))
+            case While(condition=condition, body=body):
+                head = self.new_block()
+                self.finish(Jump(head), head)
+                body_block, done = BasicBlock(0), BasicBlock(0)
+                self.finish(Branch(self.condition(condition), body_block, done), self.place(body_block))
+                self.stmts(body, None)
+                self.finish(Jump(head), self.place(done))
+                self.move(dst, Unit())
+            case _ if dst is not None:
+                self.move(dst, e)
+            case _:
+                self.current.stmts.append(NakedExp(e))
+
+    # a block made before its place in the layout was known
+    def place(self, b: BasicBlock) -> BasicBlock:
+        b.label = len(self.blocks)
+        self.blocks.append(b)
+        return b
+
+    # what a branch tests, with whatever it takes to get there in the
+    # current block
+    def condition(self, e: Exp) -> Exp:
+        match e:
+            case Block(stmts=[*stuff, NakedExp(exp=last)]) if not isinstance(last, (Block, Cond, While)):
+                for s in stuff:
+                    self.stmt(s)
+                return last
+            case Block() | Cond() | While():
+                # not a temporary, nothing in the IR has this one
+                name = f"%{len(self.blocks)}"
+                self.exp(e, name)
+                return Variable(name)
+        return e
+
+
+# the slots a function's temporaries can share
+def allocate_temps(body: list[Stmt]) -> dict[str, int]:
+    cfg = CFG_Builder().build(body)
+    cfg.liveness()
+    return cfg.allocate()
+
+
+# --cfg: every function's blocks, with the temporaries live into each one
+# and the slots they got
+def dump(body: list[Stmt], name: str = "<main>") -> str:
+    cfg = CFG_Builder().build(body)
+    cfg.liveness()
+    slots = cfg.allocate()
+    lines = [f"== {name} ({len(slots)} temporaries in {len(set(slots.values()))} slots) ==", str(cfg)]
+    for f in cfg.functions:
+        lines.append("")
+        lines.append(dump(f.body, f"fn({','.join(f.params)})"))
+    return "\n".join(lines)
@@ -1,29 +1,186 @@
-from sys import argv
-from parser import parser, Parser
+import os
+import sys
+from argparse import ArgumentParser
 
 import eval, static
-from eval import Interp
+from eval import Interp, Frame
 from static import Anal
+from fold import Fold
+from infer import Infer
+from hoist import Hoist
+from pure import Purity
 
 from lower import IR_Transformer
+from lower import dump as cfg_dump
+import optimize
+from closure_compiler import ClosureCompiler
+import vm
+import regvm
+import pygen
+import pratt
+import stream
+import repl
+import profiler
+from cache import ProgramCache
 
-def main():
-    filename = argv[1]
-    src = open(filename, "r").read()
+def front_end(src: str, which: str):
+    if which == "pratt":
+        ast = pratt.parse(src)
+    else:
+        # lark builds its tables on import, so only a cache miss pays for that
+        from parser import parser, Parser
 
-    ast = parser.parse(src)
-    #print(ast.pretty())
-    ast = Parser().transform(ast)
-    #print(*ast, sep="\n")
+        ast = parser.parse(src)
+        #print(ast.pretty())
+        ast = Parser().transform(ast)
+        #print(*ast, sep="\n")
     analyser = Anal([static.make_global_env()])
-    analyser.block(ast)
-    
+    size = analyser.block(ast)
+    Fold().program(ast)
+    Infer().program(ast)
+    size = Hoist().program(ast, size)
+    Purity(static.make_global_env()).program(ast)
+    return ast, size
+
+def lark_parse(src: str, line: int = 1):
+    from parser import parser, Parser
+    from lark.exceptions import UnexpectedInput
+
+    try:
+        tree = parser.parse(src)
+    except UnexpectedInput as err:
+        # where it is in the whole stream, like pratt's errors. an unexpected
+        # end of input has no line
+        if err.line > 0:
+            err.line += line - 1
+        raise
+    return Parser(line).transform(tree)
+
+def lower_program(ast, opt: bool, report: bool = False):
     ir = IR_Transformer()
     ir.lower_block(ast)
-    print(*[str(s) for s in ir.stmts], sep='\n')
+    if opt:
+        before = optimize.size(ir.stmts)
+        optimize.optimize(ir.stmts)
+        if report:
+            print(f"# ir: {before} -> {optimize.size(ir.stmts)} statements", file=sys.stderr)
+    return ir.stmts
+
+def main():
+    args = ArgumentParser()
+    args.add_argument("filename", nargs="?", help="leave out for a REPL")
+    args.add_argument("--ir", action="store_true", help="print the lowered IR instead of running")
+    args.add_argument("--cfg", action="store_true", help="print the lowered IR as basic blocks, with live temporaries and their slots")
+    args.add_argument("--dis", action="store_true", help="print the bytecode instead of running")
+    args.add_argument("--engine", choices=["interp", "closure", "vm", "regvm", "py"], default="interp")
+    args.add_argument("--parser", choices=["lark", "pratt"], help="lark (default for files) or the hand-written one in pratt.py (default for the REPL)")
+    args.add_argument("--no-opt", action="store_true", help="skip the IR optimizations")
+    args.add_argument("--no-cache", action="store_true", help="don't read or write __monkeycache__")
+    args.add_argument("--stream", action="store_true", help="run each top-level statement as soon as it's read (interp only)")
+    args.add_argument("--profile", action="store_true", help="time monkey functions and loops, report on stderr (interp only)")
+    args.add_argument("--profile-stacks", metavar="FILE", help="write the profile as collapsed stacks, for flamegraphs (interp only)")
+    args.add_argument("--memo-size", type=int, default=eval.MEMO_SIZE, help="results each memoized closure keeps")
+    args.add_argument("--no-memo", action="store_true", help="don't memoize pure functions unless memo(f) asks")
+    args.add_argument("--memo-stats", action="store_true", help="report memo hits and misses on stderr")
+    args = args.parse_args()
+
+    eval.MEMO_SIZE = max(args.memo_size, 1)
+    eval.AUTO_MEMO = not args.no_memo and args.memo_size > 0
+    if args.memo_stats:
+        eval.MEMOS = []
+
+    if args.filename is None:
+        repl.run(lark_parse if args.parser == "lark" else pratt.parse)
+        return
+
+    profiling = args.profile or args.profile_stacks
+    if profiling and (args.engine != "interp" or args.stream):
+        raise SystemExit("--profile only runs on the interp engine")
+
+    if args.stream:
+        if args.engine != "interp" or args.ir or args.cfg or args.dis:
+            raise SystemExit("--stream only runs on the interp engine")
+        with open(args.filename, "r") as f:
+            stream.run(f, pratt.parse if args.parser == "pratt" else lark_parse)
+        if args.memo_stats:
+            eval.report_memos(eval.MEMOS, sys.stderr)
+        return
+
+    src = open(args.filename, "r").read()
+
+    cache = ProgramCache(os.path.join(os.path.dirname(args.filename), "__monkeycache__"), args.parser or "lark")
+    use_cache = not args.no_cache
+    if args.engine == "py" and use_cache and not (args.ir or args.cfg or args.dis):
+        code = cache.get_code(src)
+        if code is not None:
+            pygen.run(code, eval.make_global_slots(static.make_global_env()))
+            if args.memo_stats:
+                eval.report_memos(eval.MEMOS, sys.stderr)
+            return
+
+    front = cache.get_ast(src) if use_cache else None
+    if front is None:
+        front = front_end(src, args.parser)
+        if use_cache:
+            cache.put_ast(src, *front)
+    ast, size = front
+
+    def lower(report: bool = False):
+        stmts = cache.get_ir(src, not args.no_opt) if use_cache and not report else None
+        if stmts is None:
+            stmts = lower_program(ast, not args.no_opt, report)
+            if use_cache:
+                cache.put_ir(src, not args.no_opt, stmts)
+        return stmts
+
+    if args.ir:
+        print(*[str(s) for s in lower(True)], sep='\n')
+        return
+
+    if args.cfg:
+        print(cfg_dump(lower(True)))
+        return
+
+    if args.dis:
+        match args.engine:
+            case "regvm":
+                stmts = lower(True)
+                print(regvm.dump(regvm.compile_program(stmts, static.make_global_env())))
+            case "py":
+                print(pygen.source(ast, static.make_global_env()), end="")
+            case _:
+                print(vm.disassemble(vm.compile_program(ast, size)))
+        return
 
-    #interp = Interp([eval.make_global_env()])
-    #interp.block(parsed)
+    globals = eval.make_global_slots(static.make_global_env())
+    match args.engine:
+        case "interp" if profiling:
+            profile = profiler.run(ast, size, globals)
+            if args.profile:
+                profile.report(sys.stderr)
+            if args.profile_stacks:
+                with open(args.profile_stacks, "w") as f:
+                    profile.collapsed(f)
+        case "interp":
+            interp = Interp(Frame(globals, None))
+            interp.block(ast, size)
+        case "closure":
+            code = ClosureCompiler().block(ast, size)
+            code([globals])
+        case "vm":
+            code = vm.compile_program(ast, size)
+            vm.VM().run(code, globals)
+        case "regvm":
+            stmts = lower()
+            code = regvm.compile_program(stmts, static.make_global_env())
+            regvm.RegVM().run(code, globals)
+        case "py":
+            code = pygen.compile_program(ast, static.make_global_env(), args.filename)
+            if use_cache:
+                cache.put_code(src, code)
+            pygen.run(code, globals)
+    if args.memo_stats:
+        eval.report_memos(eval.MEMOS, sys.stderr)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,304 @@
+from typing import Optional
+from syntax import *
+
+# cleanup passes over what IR_Transformer spits out. temporaries ($n) are
+# let exactly once and their names are unique across the whole program,
+# so they can be tracked by name without caring about scopes. user variables
+# can be reassigned and shadowed, so they're left mostly alone
+
+
+def is_temp(name: str) -> bool:
+    return name.startswith("$")
+
+
+def is_atom(e: Exp) -> bool:
+    return isinstance(e, (Variable, Num, String, Bool, Unit))
+
+
+def atom_key(e: Exp) -> tuple:
+    match e:
+        case Variable(name=name):
+            return ("var", name)
+        case Unit():
+            return ("unit",)
+        case _:
+            # 1 and 1.0 are different constants
+            return (type(e).__name__, type(e.value), e.value)
+
+
+# key for the expressions it's fine to compute once and reuse
+def pure_key(e: Exp) -> Optional[tuple]:
+    match e:
+        case BinOp(lhs=lhs, rhs=rhs, op=op):
+            return ("binop", type(op), atom_key(lhs), atom_key(rhs))
+        case Subscript(tb_indexed=tb_indexed, index=index):
+            return ("index", atom_key(tb_indexed), atom_key(index))
+    return None
+
+
+# can run arbitrary code, so can reassign variables or mutate arrays/hashes
+def has_effects(e: Exp) -> bool:
+    return isinstance(e, (Call, Cond, While, Block))
+
+
+# safe to drop entirely when nobody reads the result
+def droppable(e: Exp) -> bool:
+    return is_atom(e) or isinstance(e, (Func, Array))
+
+
+def copy_atom(e: Exp) -> Exp:
+    match e:
+        case Variable(name=name):
+            # fresh node, the register allocator keys on id()
+            return Variable(name)
+    return e
+
+
+def size(b: list[Stmt]) -> int:
+    n = 0
+    for s in b:
+        n += 1
+        match s:
+            case NakedExp(exp=e) | Let(init=e) | Return(tb_returned=e):
+                n += exp_size(e)
+            case Assign(value=e):
+                n += exp_size(e)
+    return n
+
+
+def exp_size(e: Exp) -> int:
+    match e:
+        case Func(body=body):
+            return size(body)
+        case Block(stmts=stmts):
+            return size(stmts)
+        case Cond(condition=condition, perchance=perchance, perchance_not=perchance_not):
+            return exp_size(condition) + size(perchance) + size(perchance_not or [])
+        case While(condition=condition, body=body):
+            return exp_size(condition) + size(body)
+    return 0
+
+
+class Uses:
+    count: dict[str, int]
+
+    def __init__(self, b: list[Stmt]):
+        self.count = {}
+        self.stmts(b)
+
+    def __getitem__(self, name: str) -> int:
+        return self.count.get(name, 0)
+
+    def stmts(self, b: list[Stmt]) -> None:
+        for s in b:
+            match s:
+                case NakedExp(exp=e) | Let(init=e) | Return(tb_returned=e):
+                    self.exp(e)
+                case Assign(target=target, value=value):
+                    match target:
+                        case Subscript():
+                            self.exp(target)
+                    self.exp(value)
+
+    def exp(self, e: Exp) -> None:
+        match e:
+            case Variable(name=name):
+                self.count[name] = self.count.get(name, 0) + 1
+            case BinOp(lhs=lhs, rhs=rhs):
+                self.exp(lhs)
+                self.exp(rhs)
+            case Call(func=func, arguments=args):
+                self.exp(func)
+                for arg in args:
+                    self.exp(arg)
+            case Subscript(tb_indexed=tb_indexed, index=index):
+                self.exp(tb_indexed)
+                self.exp(index)
+            case Array(elements=elements):
+                for el in elements:
+                    self.exp(el)
+            case Hashmap(elements=elements):
+                for k, v in elements.items():
+                    self.exp(k)
+                    self.exp(v)
+            case Func(body=body):
+                self.stmts(body)
+            case Block(stmts=stmts):
+                self.stmts(stmts)
+            case Cond(condition=condition, perchance=perchance, perchance_not=perchance_not):
+                self.exp(condition)
+                self.stmts(perchance)
+                self.stmts(perchance_not or [])
+            case While(condition=condition, body=body):
+                self.exp(condition)
+                self.stmts(body)
+
+
+# copy propagation, common subexpressions and dead temporaries, in one walk
+class Simplify:
+    uses: Uses
+    # temporaries replaced by an atom holding the same value
+    copies: dict[str, Exp]
+    changed: bool
+
+    def __init__(self, uses: Uses):
+        self.uses = uses
+        self.copies = {}
+        self.changed = False
+
+    def stmts(self, b: list[Stmt]) -> None:
+        # only what's computed earlier in this very list is reused, nested
+        # lists (loop bodies especially) start over
+        available: dict[tuple, str] = {}
+        out = []
+        for s in b:
+            match s:
+                case Let(name=name, init=init) if is_temp(name):
+                    init = self.exp(init)
+                    key = pure_key(init)
+                    # a copy of a user variable is there to read it before
+                    # something reassigns it, see IR_Transformer.lower_operands
+                    if is_atom(init) and not (isinstance(init, Variable) and not is_temp(init.name)):
+                        self.copies[name] = init
+                        self.changed = True
+                        continue
+                    if key in available:
+                        self.copies[name] = Variable(available[key])
+                        self.changed = True
+                        continue
+                    if self.uses[name] == 0:
+                        self.changed = True
+                        if droppable(init):
+                            continue
+                        # still has to run, the result just goes nowhere
+                        s = NakedExp(init)
+                    else:
+                        s.init = init
+                        if key is not None:
+                            available[key] = name
+                case Let(name=name, init=init):
+                    s.init = self.exp(init)
+                    # shadowed from here on
+                    forget(available, name)
+                case Assign(target=Variable(name=name), value=value):
+                    s.value = self.exp(value)
+                    forget(available, name)
+                case Assign(target=target, value=value):
+                    s.target = self.exp(target)
+                    s.value = self.exp(value)
+                    forget_indexing(available)
+                case NakedExp(exp=e):
+                    s.exp = self.exp(e)
+                case Return(tb_returned=e):
+                    s.tb_returned = self.exp(e)
+
+            match s:
+                case NakedExp(exp=e) | Let(init=e) | Assign(value=e) if has_effects(e):
+                    forget_user(available)
+            out.append(s)
+        b[:] = out
+
+    def exp(self, e: Exp) -> Exp:
+        match e:
+            case Variable(name=name) if name in self.copies:
+                return copy_atom(self.copies[name])
+            case BinOp(lhs=lhs, rhs=rhs):
+                e.lhs = self.exp(lhs)
+                e.rhs = self.exp(rhs)
+            case Call(func=func, arguments=args):
+                e.func = self.exp(func)
+                e.arguments = [self.exp(arg) for arg in args]
+            case Subscript(tb_indexed=tb_indexed, index=index):
+                e.tb_indexed = self.exp(tb_indexed)
+                e.index = self.exp(index)
+            case Array(elements=elements):
+                e.elements = [self.exp(el) for el in elements]
+            case Hashmap(elements=elements):
+                e.elements = {self.exp(k): self.exp(v) for k, v in elements.items()}
+            case Func(body=body):
+                self.stmts(body)
+            case Block(stmts=stmts):
+                self.stmts(stmts)
+            case Cond(condition=condition, perchance=perchance, perchance_not=perchance_not):
+                e.condition = self.exp(condition)
+                self.stmts(perchance)
+                if perchance_not is not None:
+                    self.stmts(perchance_not)
+            case While(condition=condition, body=body):
+                e.condition = self.exp(condition)
+                self.stmts(body)
+        return e
+
+
+def forget(available: dict[tuple, str], name: str) -> None:
+    var = ("var", name)
+    for key in [k for k in available if var in k]:
+        del available[key]
+
+
+def forget_indexing(available: dict[tuple, str]) -> None:
+    for key in [k for k in available if k[0] == "index"]:
+        del available[key]
+
+
+# a call can reassign any captured variable and mutate any array, only
+# things computed purely from temporaries survive it
+def forget_user(available: dict[tuple, str]) -> None:
+    forget_indexing(available)
+    for key in list(available):
+        if any(part[0] == "var" and not is_temp(part[1]) for part in key[2:]):
+            del available[key]
+
+
+# `let $3 = a + b; let x = $3;` -> `let x = a + b;` when $3 isn't read anywhere
+# else. nothing runs in between, so the order of effects doesn't change
+def forward(b: list[Stmt], uses: Uses) -> bool:
+    changed = False
+    out = []
+    for s in b:
+        match s, out:
+            case (Let(init=Variable(name=name)) | Assign(target=Variable(), value=Variable(name=name))
+                  | NakedExp(exp=Variable(name=name))), [*_, Let(name=prev, init=init)] \
+                    if prev == name and is_temp(name) and uses[name] == 1:
+                out.pop()
+                match s:
+                    case Let():
+                        s.init = init
+                    case Assign():
+                        s.value = init
+                    case NakedExp():
+                        s.exp = init
+                changed = True
+        match s:
+            case NakedExp(exp=e) | Let(init=e) | Return(tb_returned=e) | Assign(value=e):
+                changed |= forward_exp(e, uses)
+        out.append(s)
+    b[:] = out
+    return changed
+
+
+def forward_exp(e: Exp, uses: Uses) -> bool:
+    match e:
+        case Func(body=body):
+            return forward(body, uses)
+        case Block(stmts=stmts):
+            return forward(stmts, uses)
+        case Cond(condition=condition, perchance=perchance, perchance_not=perchance_not):
+            changed = forward_exp(condition, uses)
+            changed |= forward(perchance, uses)
+            if perchance_not is not None:
+                changed |= forward(perchance_not, uses)
+            return changed
+        case While(condition=condition, body=body):
+            changed = forward_exp(condition, uses)
+            return forward(body, uses) or changed
+    return False
+
+
+def optimize(b: list[Stmt]) -> list[Stmt]:
+    while True:
+        simplify = Simplify(Uses(b))
+        simplify.stmts(b)
+        moved = forward(b, Uses(b))
+        if not (simplify.changed or moved):
+            return b
@@ -1,6 +1,21 @@
+import os
 from lark import Lark, Transformer
 from syntax import *
 
+# building the LALR tables (and strict mode's regex collision checks) is most
+# of the startup of a short script, so lark saves them here the first time
+# and loads them after that. the file remembers the grammar, options and lark
+# version it was built from and gets rebuilt when any of those change
+TABLES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "__monkeycache__", "grammar.lark")
+# lark won't make the directory, so that happens once, before the first save.
+# an import with the tables in place doesn't touch the disk
+if not os.path.exists(TABLES):
+    try:
+        os.makedirs(os.path.dirname(TABLES), exist_ok=True)
+    except OSError:
+        # lark just builds them every time if it can't save them
+        pass
+
 parser = Lark(
     r"""
     block : stmt*          
@@ -36,11 +51,11 @@ parser = Lark(
           | "false"                                     -> false 
           | ID                                          -> var
           | ESCAPED_STRING                              -> string
-          | "fn" "(" [ID ("," ID)*]  ")" "{" block "}"  -> func
+          | FN "(" [ID ("," ID)*]  ")" "{" block "}"    -> func
           | "[" expr_list "]"                           -> array
           | "{" [pair ("," pair)*] "}"                  -> hash
           | perchance                                   -> perhaps
-          | "while" "(" expr ")" "{" block "}"          -> solongas
+          | WHILE "(" expr ")" "{" block "}"            -> solongas
           | "(" expr ")"                                
 
     ?perchance: "if" "(" expr ")" "{" block "}" ["else" perchance_not]
@@ -49,6 +64,9 @@ parser = Lark(
     ?pair: (expr ":" expr)
     expr_list: [expr ("," expr)*]
     ID : /[a-zA-Z][a-zA-Z0-9_]*/
+    // named so they stay in the tree, their line goes on the node
+    FN : "fn"
+    WHILE : "while"
     COMMENT: "//" /[^\n]/*
               
     %import common.ESCAPED_STRING
@@ -62,6 +80,7 @@ parser = Lark(
     debug=True,
     strict=True,
     parser="lalr",
+    cache=TABLES,
 )
 
 
@@ -70,6 +89,12 @@ def binOP(op):
 
 
 class Parser(Transformer):
+    # the one src starts on, like pratt.parse's
+    line: int
+
+    def __init__(self, line: int = 1):
+        super().__init__()
+        self.line = line
 
     unit = lambda self, _: Unit()
     true = lambda self, _: Bool(True)
@@ -78,7 +103,8 @@ class Parser(Transformer):
     block = list
     pair = tuple
 
-    hash = lambda self, items: Hashmap(dict(items))
+    # {} comes in as [None]
+    hash = lambda self, items: Hashmap(dict(item for item in items if item is not None))
 
     def array(self, items):
         (items,) = items
@@ -122,10 +148,10 @@ class Parser(Transformer):
         return Variable(id)
 
     def func(self, items):
-        *args, block = items
+        fn, *args, block = items
         if args == [None]:
             args = []
-        return Func(args, block)
+        return Func(args, block, fn.line + self.line - 1)
 
     def field(self, items):
         struct, field = items
@@ -140,8 +166,8 @@ class Parser(Transformer):
         return items
 
     def solongas(self, items):
-        cond, body = items
-        return While(cond, body)
+        kw, cond, body = items
+        return While(cond, body, kw.line + self.line - 1)
 
     # call
     def like(self, items):
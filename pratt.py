@@ -0,0 +1,299 @@
+import re
+from syntax import *
+
+# the grammar in parser.py, parsed by hand: one pass over the source that
+# builds syntax nodes directly, without lark's parse tree in between.
+# gives the same AST as Parser().transform(parser.parse(src))
+
+
+class ParseError(Exception):
+    line: int
+    column: int
+
+    def __init__(self, message: str, line: int, column: int):
+        super().__init__(f"{message} at line {line}, column {column}")
+        self.line = line
+        self.column = column
+
+
+KEYWORDS = {"let", "return", "fn", "if", "else", "while", "true", "false"}
+
+# same terminals as the lark grammar. "()" is its own token there too, it's
+# unit where an atom goes and an empty argument list after a function
+TOKEN = re.compile(
+    r"""
+    (?P<skip>\s+|//[^\n]*)
+    | (?P<number>(?:\d+\.\d*|\.\d+)(?:[eE][+-]?\d+)?|\d+(?:[eE][+-]?\d+)?)
+    | (?P<id>[a-zA-Z][a-zA-Z0-9_]*)
+    | (?P<string>"(?:[^"\\\n]|\\[^\n])*")
+    | (?P<op>\(\)|<=|==|[-+*/%=;,.:()\[\]{}])
+    """,
+    re.VERBOSE,
+)
+
+# binding power of the infix operators, all left associative
+INFIX = {
+    "<=": (1, Leq()),
+    "==": (1, Eq()),
+    "+": (2, Plus()),
+    "-": (2, Minus()),
+    "*": (3, Mult()),
+    "/": (3, Div()),
+    "%": (3, Mod()),
+}
+
+
+# (kind, text, start, end), kind is the group name or the keyword/operator itself
+def tokenize(src: str, line: int = 1) -> list[tuple[str, str, int, int]]:
+    tokens = []
+    append = tokens.append
+    pos = 0
+    for m in TOKEN.finditer(src):
+        start = m.start()
+        # finditer skips what it can't match, that's an error here
+        if start != pos:
+            break
+        pos = m.end()
+        kind = m.lastgroup
+        if kind == "skip":
+            continue
+        text = m.group()
+        if kind == "op" or kind == "id" and text in KEYWORDS:
+            kind = text
+        append((kind, text, start, pos))
+    if pos != len(src):
+        line, column = position(src, pos, line)
+        raise ParseError(f"Unexpected character {src[pos]!r}", line, column)
+    append(("eof", "", pos, pos))
+    return tokens
+
+
+# line is the one src starts on
+def position(src: str, pos: int, line: int) -> tuple[int, int]:
+    line += src.count("\n", 0, pos)
+    return line, pos - (src.rfind("\n", 0, pos) + 1) + 1
+
+
+def number(text: str) -> Num:
+    # same rule as Parser.number, so 1e5 still isn't an int
+    if "." in text:
+        return Num(float(text))
+    return Num(int(text))
+
+
+class PrattParser:
+    src: str
+    line: int
+    tokens: list[tuple[str, str, int, int]]
+    pos: int
+    # the offset line_at last counted to, and its line
+    mark: int
+    mark_line: int
+
+    def __init__(self, src: str, line: int = 1):
+        self.src = src
+        self.line = line
+        self.tokens = tokenize(src, line)
+        self.pos = 0
+        self.mark = 0
+        self.mark_line = line
+
+    def peek(self) -> str:
+        return self.tokens[self.pos][0]
+
+    def advance(self) -> tuple[str, str, int, int]:
+        token = self.tokens[self.pos]
+        self.pos += 1
+        return token
+
+    def expect(self, kind: str) -> str:
+        token = self.tokens[self.pos]
+        if token[0] != kind:
+            self.error(f"Expected {kind!r}")
+        self.pos += 1
+        return token[1]
+
+    # counts on from the last offset it was asked about, the next one is
+    # never far off
+    def line_at(self, pos: int) -> int:
+        if pos >= self.mark:
+            self.mark_line += self.src.count("\n", self.mark, pos)
+        else:
+            self.mark_line -= self.src.count("\n", pos, self.mark)
+        self.mark = pos
+        return self.mark_line
+
+    def error(self, message: str):
+        kind, text, start, _ = self.tokens[self.pos]
+        line, column = position(self.src, start, self.line)
+        raise ParseError(f"{message}, got {text or kind!r}", line, column)
+
+    def program(self) -> list[Stmt]:
+        stmts = self.block()
+        if self.peek() != "eof":
+            self.error("Expected a statement")
+        return stmts
+
+    def block(self) -> list[Stmt]:
+        stmts = []
+        while self.peek() not in ("}", "eof"):
+            stmts.append(self.stmt())
+        return stmts
+
+    def braced(self) -> list[Stmt]:
+        self.expect("{")
+        stmts = self.block()
+        self.expect("}")
+        return stmts
+
+    def stmt(self) -> Stmt:
+        match self.peek():
+            case "let":
+                self.advance()
+                name = self.expect("id")
+                self.expect("=")
+                s = Let(name, self.expr())
+            case "return":
+                self.advance()
+                s = Return(self.expr())
+            case _:
+                e = self.expr()
+                if self.peek() == "=":
+                    self.advance()
+                    s = Assign(e, self.expr())
+                else:
+                    s = NakedExp(e)
+        self.expect(";")
+        return s
+
+    def expr(self, power: int = 0) -> Exp:
+        lhs = self.postfix(self.atom())
+        while True:
+            infix = INFIX.get(self.peek())
+            if infix is None or infix[0] <= power:
+                return lhs
+            self.advance()
+            rhs = self.expr(infix[0])
+            lhs = BinOp(lhs, rhs, infix[1])
+
+    # calls, fields and subscripts bind tighter than any operator
+    def postfix(self, e: Exp) -> Exp:
+        while True:
+            match self.peek():
+                case "()":
+                    self.advance()
+                    e = Call(e, [])
+                case "(":
+                    self.advance()
+                    e = Call(e, self.expr_list(")"))
+                case ".":
+                    self.advance()
+                    e = Field(e, self.expect("id"))
+                case "[":
+                    self.advance()
+                    index = self.expr()
+                    self.expect("]")
+                    e = Subscript(e, index)
+                case _:
+                    return e
+
+    def expr_list(self, close: str) -> list[Exp]:
+        items = []
+        if self.peek() != close:
+            items.append(self.expr())
+            while self.peek() == ",":
+                self.advance()
+                items.append(self.expr())
+        self.expect(close)
+        return items
+
+    def atom(self) -> Exp:
+        kind, text, start, end = self.advance()
+        match kind:
+            case "()":
+                return Unit()
+            case "number":
+                return number(text)
+            case "-" | "+":
+                # a signed number is one token in the grammar, no space allowed
+                next_kind, next_text, next_start, _ = self.tokens[self.pos]
+                if next_kind == "number" and next_start == end:
+                    self.advance()
+                    return number(text + next_text)
+            case "true":
+                return Bool(True)
+            case "false":
+                return Bool(False)
+            case "id":
+                return Variable(text)
+            case "string":
+                return String(text[1:-1])
+            case "fn":
+                return self.func(start)
+            case "[":
+                return Array(self.expr_list("]"))
+            case "{":
+                return self.hash()
+            case "if":
+                return self.cond()
+            case "while":
+                line = self.line_at(start)
+                self.expect("(")
+                condition = self.expr()
+                self.expect(")")
+                return While(condition, self.braced(), line)
+            case "(":
+                e = self.expr()
+                self.expect(")")
+                return e
+        self.pos -= 1
+        self.error("Expected an expression")
+
+    # start is where the "fn" was
+    def func(self, start: int) -> Func:
+        line = self.line_at(start)
+        params = []
+        if self.peek() == "()":
+            self.advance()
+        else:
+            self.expect("(")
+            if self.peek() != ")":
+                params.append(self.expect("id"))
+                while self.peek() == ",":
+                    self.advance()
+                    params.append(self.expect("id"))
+            self.expect(")")
+        return Func(params, self.braced(), line)
+
+    def hash(self) -> Hashmap:
+        elements = {}
+        if self.peek() != "}":
+            while True:
+                k = self.expr()
+                self.expect(":")
+                elements[k] = self.expr()
+                if self.peek() != ",":
+                    break
+                self.advance()
+        self.expect("}")
+        return Hashmap(elements)
+
+    # "if" already taken
+    def cond(self) -> Cond:
+        self.expect("(")
+        condition = self.expr()
+        self.expect(")")
+        perchance = self.braced()
+        perchance_not: Union[None, Cond, list[Stmt]] = None
+        if self.peek() == "else":
+            self.advance()
+            if self.peek() == "if":
+                self.advance()
+                perchance_not = self.cond()
+            else:
+                perchance_not = self.braced()
+        return Cond(condition, perchance, perchance_not)
+
+
+def parse(src: str, line: int = 1) -> list[Stmt]:
+    return PrattParser(src, line).program()
@@ -0,0 +1,219 @@
+import time
+from typing import Generator, TextIO
+from syntax import Stmt
+import syntax
+
+from eval import Interp, Frame, Closure, Value
+
+# --profile: an Interp that times every monkey function call and while loop.
+# it wraps Interp's own methods, so a run without --profile pays nothing.
+# the times go into a call tree (one node per place a function or loop ran
+# from), the report adds those up per function and per loop
+
+clock = time.perf_counter_ns
+
+# (name, line) for a function or loop
+Label = tuple[str, int]
+
+PROGRAM: Label = ("<program>", 0)
+
+
+class Node:
+    __slots__ = ("label", "parent", "children", "count", "iterations", "time", "inner")
+    label: Label
+    parent: "Node"
+    children: dict[Label, "Node"]
+    # calls, or times a loop was started
+    count: int
+    iterations: int
+    # ns in here, and how many of those were in the nodes below
+    time: int
+    inner: int
+
+    def __init__(self, label: Label, parent: "Node"):
+        self.label = label
+        self.parent = parent
+        self.children = {}
+        self.count = 0
+        self.iterations = 0
+        self.time = 0
+        self.inner = 0
+
+
+# names functions after the let (or assignment) they're bound in, by their
+# body, which is what their closures get too
+def function_labels(ast: list[Stmt]) -> dict[int, Label]:
+    labels = {}
+    todo: list = [ast]
+    while todo:
+        x = todo.pop()
+        match x:
+            case list():
+                todo.extend(x)
+            case dict():
+                todo.extend(x.keys())
+                todo.extend(x.values())
+            case syntax.Let(name=name, init=syntax.Func() as f) | syntax.Assign(
+                target=syntax.Variable(name=name), value=syntax.Func() as f
+            ):
+                labels.setdefault(id(f.body), (name, f.line))
+                todo.append(f.body)
+            case syntax.Func(body=body, line=line):
+                labels.setdefault(id(body), ("fn", line))
+                todo.append(body)
+            case syntax.Exp() | syntax.Stmt():
+                todo.extend(getattr(x, f) for f in x.__slots__)
+    return labels
+
+
+# a tail call goes back to the call it ends (see eval.TailCall), out of
+# ProfilingInterp's sight, so the profiler makes them all plain calls
+def untail(ast: list[Stmt]) -> None:
+    todo: list = [ast]
+    while todo:
+        x = todo.pop()
+        match x:
+            case list():
+                todo.extend(x)
+            case dict():
+                todo.extend(x.keys())
+                todo.extend(x.values())
+            case syntax.Exp() | syntax.Stmt():
+                if isinstance(x, syntax.Call):
+                    x.tail = False
+                todo.extend(getattr(x, f) for f in x.__slots__)
+
+
+class Profile:
+    root: Node
+    current: Node
+    labels: dict[int, Label]
+
+    def __init__(self, ast: list[Stmt]):
+        self.root = self.current = Node(PROGRAM, None)
+        self.root.count = 1
+        self.labels = function_labels(ast)
+
+    def enter(self, label: Label) -> Node:
+        parent = self.current
+        node = parent.children.get(label)
+        if node is None:
+            node = parent.children[label] = Node(label, parent)
+        node.count += 1
+        self.current = node
+        return node
+
+    def leave(self, node: Node, start: int) -> None:
+        elapsed = clock() - start
+        node.time += elapsed
+        node.parent.inner += elapsed
+        self.current = node.parent
+
+    # every node with the labels of the ones above it, parents first
+    def walk(self):
+        todo = [(self.root, ())]
+        while todo:
+            node, above = todo.pop()
+            yield node, above
+            todo.extend((child, above + (node.label,)) for child in node.children.values())
+
+    # per function and loop: [calls, iterations, inclusive ns, exclusive ns].
+    # a recursive call's time is already in the outermost one, so only that
+    # one counts towards inclusive
+    def totals(self) -> dict[Label, list[int]]:
+        totals = {}
+        for node, above in self.walk():
+            t = totals.setdefault(node.label, [0, 0, 0, 0])
+            t[0] += node.count
+            t[1] += node.iterations
+            if node.label not in above:
+                t[2] += node.time
+            t[3] += node.time - node.inner
+        return totals
+
+    def report(self, out: TextIO) -> None:
+        rows = sorted(self.totals().items(), key=lambda row: row[1][3], reverse=True)
+        ms = lambda ns: f"{ns / 1e6:12.3f}"
+        print(f"{'calls':>10} {'iterations':>10} {'inclusive ms':>12} {'exclusive ms':>12}  where", file=out)
+        for label, (count, iterations, inclusive, exclusive) in rows:
+            loops = f"{iterations:10}" if label[0] == "while" else f"{'':10}"
+            print(f"{count:10} {loops} {ms(inclusive)} {ms(exclusive)}  {describe(label)}", file=out)
+
+    # one line per call path, exclusive microseconds at the end, which is
+    # what flamegraph.pl and speedscope read
+    def collapsed(self, out: TextIO) -> None:
+        for node, above in self.walk():
+            us = (node.time - node.inner) // 1000
+            if us > 0:
+                print(";".join(frame(label) for label in above + (node.label,)), us, file=out)
+
+
+def describe(label: Label) -> str:
+    name, line = label
+    return f"{name} (line {line})" if line else name
+
+
+def frame(label: Label) -> str:
+    name, line = label
+    return f"{name}:{line}" if line else name
+
+
+# each closure that runs, memo hits included, and each while loop
+class ProfilingInterp(Interp):
+    profile: Profile
+
+    def __init__(self, env: Frame, profile: Profile):
+        super().__init__(env)
+        self.profile = profile
+
+    def enter_call(self, closure: Closure) -> Node:
+        return self.profile.enter(self.profile.labels.get(id(closure.body), ("fn", 0)))
+
+    def call(self, closure: Closure, args: list[Value]) -> Value:
+        node, start = self.enter_call(closure), clock()
+        try:
+            return super().call(closure, args)
+        finally:
+            self.profile.leave(node, start)
+
+    def call_steps(self, closure: Closure, args: list[Value]) -> Generator:
+        node, start = self.enter_call(closure), clock()
+        try:
+            return (yield from super().call_steps(closure, args))
+        finally:
+            self.profile.leave(node, start)
+
+    def loop(self, e: syntax.While) -> Value:
+        node, start = self.profile.enter(("while", e.line)), clock()
+        try:
+            return super().loop(e)
+        finally:
+            self.profile.leave(node, start)
+
+    def loop_steps(self, e: syntax.While) -> Generator:
+        node, start = self.profile.enter(("while", e.line)), clock()
+        try:
+            return (yield from super().loop_steps(e))
+        finally:
+            self.profile.leave(node, start)
+
+    # the loop's is the current node whenever the next time round starts
+    def loop_body(self, b: list[Stmt], frame: Frame, cells: list[int]) -> None:
+        self.profile.current.iterations += 1
+        super().loop_body(b, frame, cells)
+
+    def loop_body_steps(self, b: list[Stmt], frame: Frame, cells: list[int]) -> Generator:
+        self.profile.current.iterations += 1
+        yield from super().loop_body_steps(b, frame, cells)
+
+
+def run(ast: list[Stmt], size: int, globals: list[Value]) -> Profile:
+    untail(ast)
+    profile = Profile(ast)
+    interp = ProfilingInterp(Frame(globals, None), profile)
+    start = clock()
+    try:
+        interp.block(ast, size)
+    finally:
+        profile.root.time = clock() - start
+    return profile
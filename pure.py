@@ -0,0 +1,213 @@
+from typing import Optional
+from syntax import Exp, Stmt
+import syntax
+from fold import Scopes
+
+# finds the pure functions over an AST static.Anal has resolved: what one
+# gives back depends on nothing but its arguments, and calling it does
+# nothing else. those get .memo, so their closures hand back what they gave
+# last time for the same arguments instead of running again (see eval.Memo).
+# it's conservative: anything it can't see through (assigning a variable
+# from outside, reading one something assigns to, calling a parameter or
+# puts) makes the function impure, and every function around it too
+
+# the globals that are pure
+PURE_PRIMOPS = {"len"}
+
+
+class Binding:
+    # what its let binds, if that's a function
+    func: Optional[syntax.Func]
+    # a global's name
+    prim: Optional[str]
+    mutable: bool
+
+    def __init__(self, func: Optional[syntax.Func] = None, prim: Optional[str] = None):
+        self.func = func
+        self.prim = prim
+        self.mutable = False
+
+
+class Function:
+    node: syntax.Func
+    # where its parameters' scope is in the scope stack
+    base: int
+    pure: bool
+    # whether it calls, loops or branches. straight-line code is cheaper
+    # than looking its result up
+    costly: bool
+
+    def __init__(self, node: syntax.Func, base: int):
+        self.node = node
+        self.base = base
+        self.pure = True
+        self.costly = False
+
+
+class Purity:
+    scopes: Scopes
+    globals: dict[int, Binding]
+    # by the let that declares them, and by function for parameters
+    bindings: dict[int, Binding]
+    params: dict[int, list[Binding]]
+    # first pass: which bindings get assigned
+    collecting: bool
+    # the functions we're in, innermost last
+    functions: list[Function]
+    # ids of the functions found pure
+    pure: set[int]
+
+    def __init__(self, globals: list[str]):
+        self.scopes = Scopes()
+        self.globals = {slot: Binding(prim=name) for slot, name in enumerate(globals)}
+        self.bindings = {}
+        self.params = {}
+        self.collecting = True
+        self.functions = []
+        self.pure = set()
+
+    def program(self, ast: list[Stmt]) -> None:
+        self.run(ast)
+        self.collecting = False
+        self.run(ast)
+
+    def run(self, ast: list[Stmt]) -> None:
+        self.scopes = Scopes()
+        self.scopes.stack[0] = dict(self.globals)
+        self.block(ast)
+
+    def impure(self) -> None:
+        if not self.collecting:
+            for f in self.functions:
+                f.pure = False
+
+    def costly(self) -> None:
+        if self.functions:
+            self.functions[-1].costly = True
+
+    # whether (depth, slot) is in the innermost function's own scopes
+    def local(self, depth: int) -> bool:
+        return bool(self.functions) and len(self.scopes.stack) - 1 - depth >= self.functions[-1].base
+
+    def let(self, s: syntax.Let) -> None:
+        scope = self.scopes.stack[-1]
+        if self.collecting:
+            if s.slot in scope:
+                # let again in the same scope, it's the same slot
+                scope[s.slot].mutable = True
+            else:
+                scope[s.slot] = Binding(s.init if isinstance(s.init, syntax.Func) else None)
+            self.bindings[id(s)] = scope[s.slot]
+        else:
+            scope[s.slot] = self.bindings[id(s)]
+
+    def block(self, b: list[Stmt]) -> None:
+        match b:
+            case []:
+                return
+            case [*stuff]:
+                self.scopes.push()
+                for s in stuff:
+                    self.stmt(s)
+                self.scopes.pop()
+
+    def stmt(self, s: Stmt) -> None:
+        match s:
+            case syntax.NakedExp(exp=exp):
+                self.visit(exp)
+            case syntax.Let(init=syntax.Func()):
+                # recursion sees itself
+                self.let(s)
+                self.visit(s.init)
+            case syntax.Let(init=init):
+                self.visit(init)
+                self.let(s)
+            case syntax.Assign(target=syntax.Variable(depth=depth, slot=slot), value=value):
+                self.visit(value)
+                binding = self.scopes.find(depth, slot)
+                if self.collecting and binding is not None:
+                    binding.mutable = True
+                if not self.local(depth):
+                    self.impure()
+            case syntax.Assign(target=target, value=value):
+                self.visit(target)
+                self.visit(value)
+                self.impure()
+            case syntax.Return(tb_returned=tb_returned):
+                self.visit(tb_returned)
+
+    def visit(self, e: Exp) -> None:
+        match e:
+            case syntax.Variable(depth=depth, slot=slot):
+                binding = self.scopes.find(depth, slot)
+                if not self.local(depth) and (binding is None or binding.mutable):
+                    self.impure()
+            case syntax.BinOp(lhs=lhs, rhs=rhs):
+                self.visit(lhs)
+                self.visit(rhs)
+            case syntax.Cond(condition=condition, perchance=perchance, perchance_not=perchance_not):
+                self.costly()
+                self.visit(condition)
+                self.block(perchance)
+                match perchance_not:
+                    case syntax.Cond():
+                        self.visit(perchance_not)
+                    case [*stmts]:
+                        self.block(stmts)
+            case syntax.While(condition=condition, body=body):
+                self.costly()
+                self.visit(condition)
+                self.block(body)
+            case syntax.Block(stmts=stmts):
+                self.block(stmts)
+
+            case syntax.Func(params=params, body=body):
+                stack = self.scopes.enter(e)
+                bindings = self.params.setdefault(id(e), [Binding() for _ in params])
+                self.scopes.stack[-1] = dict(enumerate(bindings))
+                if e.recursive:
+                    self.scopes.stack[-1][len(params)] = Binding(e)
+                func = Function(e, len(self.scopes.stack) - 1)
+                self.functions.append(func)
+                self.block(body)
+                self.functions.pop()
+                self.scopes.stack = stack
+                if not self.collecting:
+                    if func.pure:
+                        self.pure.add(id(e))
+                    e.memo = func.pure and func.costly
+            case syntax.Call(func=func, arguments=args):
+                self.costly()
+                self.visit(func)
+                for arg in args:
+                    self.visit(arg)
+                if not self.pure_callee(func):
+                    self.impure()
+
+            case syntax.Array(elements=elements):
+                for el in elements:
+                    self.visit(el)
+            case syntax.Hashmap(elements=elements):
+                for k, v in elements.items():
+                    self.visit(k)
+                    self.visit(v)
+            case syntax.Field(tb_fielded=tb):
+                self.visit(tb)
+            case syntax.Subscript(tb_indexed=tb, index=index):
+                self.visit(tb)
+                self.visit(index)
+
+    # a function that's never rebound and already found pure (or is being
+    # looked at right now, recursion), or a pure global
+    def pure_callee(self, func: Exp) -> bool:
+        match func:
+            case syntax.Variable(depth=depth, slot=slot):
+                binding = self.scopes.find(depth, slot)
+                if binding is None or binding.mutable:
+                    return False
+                if binding.prim is not None:
+                    return binding.prim in PURE_PRIMOPS
+                return binding.func is not None and (
+                    id(binding.func) in self.pure or any(f.node is binding.func for f in self.functions)
+                )
+        return False
@@ -0,0 +1,577 @@
+from types import CodeType, FunctionType
+from typing import Optional
+from syntax import Exp, Stmt
+from syntax import Plus, Minus, Mult, Div, Eq, Leq, Mod
+import syntax
+
+from eval import Value, Unit, Num, String, Bool, Hashmap, Array, Closure, PrimOp
+from eval import MISS, auto_memo, memo_key, STACK_CALLS, run_frames, makes_calls
+from eval import TypeError, DivZeroError, IncorrectArity
+
+# translates a program into python source and lets CPython run it: monkey
+# functions become nested defs, whiles become whiles and return is return.
+# values are still the ones from eval.py, so printing and errors don't change
+
+BINOPS = {Plus: "_add", Minus: "_sub", Mult: "_mul", Div: "_div", Eq: "_eq", Leq: "_leq", Mod: "_mod"}
+
+
+# the generated code calls into these
+def _num(v: Value):
+    if isinstance(v, Num):
+        return v.value
+    raise TypeError("Num")
+
+
+def _truth(v: Value) -> bool:
+    if isinstance(v, Bool):
+        return v.value
+    raise TypeError("Bool")
+
+
+def _add(x: Value, y: Value) -> Value:
+    return Num(_num(x) + _num(y))
+
+
+def _sub(x: Value, y: Value) -> Value:
+    return Num(_num(x) - _num(y))
+
+
+def _mul(x: Value, y: Value) -> Value:
+    return Num(_num(x) * _num(y))
+
+
+def _div(x: Value, y: Value) -> Value:
+    x = _num(x)
+    y = _num(y)
+    if y == 0:
+        raise DivZeroError()
+    return Num(x / y)
+
+
+def _mod(x: Value, y: Value) -> Value:
+    return Num(_num(x) % _num(y))
+
+
+def _eq(x: Value, y: Value) -> Value:
+    return Bool(_num(x) == _num(y))
+
+
+def _leq(x: Value, y: Value) -> Value:
+    return Bool(_num(x) <= _num(y))
+
+
+# how many monkey calls are nested on the current python stack, see
+# eval.STACK_CALLS
+_depth = 0
+
+
+def _call(f: Value, *args: Value) -> Value:
+    global _depth
+    if isinstance(f, Closure):
+        if len(args) != len(f.parameters):
+            raise IncorrectArity(len(f.parameters), len(args))
+        if _depth >= STACK_CALLS:
+            nested, _depth = _depth, 0
+            try:
+                return run_frames(_call_steps(f, *args))
+            finally:
+                _depth = nested
+        _depth += 1
+        try:
+            if f.memo is not None:
+                return _call_memo(f, args)
+            return f.body(*args)
+        finally:
+            _depth -= 1
+    if isinstance(f, PrimOp):
+        return f.func(list(args))
+    raise TypeError("Closure")
+
+
+def _call_memo(f: Closure, args: tuple) -> Value:
+    key = memo_key(args)
+    if key is None:
+        return f.body(*args)
+    ret = f.memo.get(key)
+    if ret is MISS:
+        ret = f.body(*args)
+        f.memo.put(key, ret)
+    return ret
+
+
+# a def that makes calls also gets compiled as a generator, which yields
+# _call_steps where the def calls _call. the program keeps their code in
+# _steps by name, and since it has the same free variables as the def it
+# can take over the def's cells
+def _steps_of(body: FunctionType) -> Optional[FunctionType]:
+    code = body.__globals__["_steps"].get(body.__code__.co_name)
+    if code is None:
+        return None
+    return FunctionType(code, body.__globals__, None, None, body.__closure__)
+
+
+def _call_steps(f: Value, *args: Value):
+    if isinstance(f, Closure):
+        if len(args) != len(f.parameters):
+            raise IncorrectArity(len(f.parameters), len(args))
+        key = None
+        if f.memo is not None:
+            key = memo_key(args)
+            if key is not None:
+                ret = f.memo.get(key)
+                if ret is not MISS:
+                    return ret
+        steps = _steps_of(f.body)
+        if steps is None:
+            ret = f.body(*args)
+        else:
+            ret = yield steps(*args)
+        if key is not None:
+            f.memo.put(key, ret)
+        return ret
+    if isinstance(f, PrimOp):
+        return f.func(list(args))
+    raise TypeError("Closure")
+
+
+def _field(tb: Value, key: Value) -> Value:
+    if isinstance(tb, Hashmap):
+        return tb.elements[key]
+    raise TypeError("HashMap")
+
+
+def _index(tb: Value, index: Value) -> Value:
+    match tb:
+        case Hashmap(elements=elements):
+            return elements[index]
+        case Array(elements=elements):
+            match index:
+                case Num(value=int(ix)):
+                    return elements[ix]
+                case _:
+                    raise TypeError("Int")
+        case _:
+            raise TypeError("Subscriptable (Array / HashMap)")
+
+
+def runtime() -> dict:
+    return {
+        "_unit": Unit(),
+        "Num": Num,
+        "String": String,
+        "Bool": Bool,
+        "Array": Array,
+        "Hashmap": Hashmap,
+        "Closure": Closure,
+        "_truth": _truth,
+        "_add": _add,
+        "_sub": _sub,
+        "_mul": _mul,
+        "_div": _div,
+        "_mod": _mod,
+        "_eq": _eq,
+        "_leq": _leq,
+        "_call": _call,
+        "_call_steps": _call_steps,
+        "_steps_of": _steps_of,
+        "_steps": {},
+        "_memo": auto_memo,
+        "_field": _field,
+        "_index": _index,
+    }
+
+
+# True when compiling e has to emit statements (python expressions can't hold them)
+def needs_stmts(e: Exp) -> bool:
+    match e:
+        case syntax.Cond() | syntax.While() | syntax.Block() | syntax.Func():
+            return True
+        case syntax.BinOp(lhs=lhs, rhs=rhs):
+            return needs_stmts(lhs) or needs_stmts(rhs)
+        case syntax.Call(func=func, arguments=args):
+            return needs_stmts(func) or any(needs_stmts(a) for a in args)
+        case syntax.Array(elements=elements):
+            return any(needs_stmts(el) for el in elements)
+        case syntax.Hashmap(elements=elements):
+            return any(needs_stmts(k) or needs_stmts(v) for k, v in elements.items())
+        case syntax.Field(tb_fielded=tb):
+            return needs_stmts(tb)
+        case syntax.Subscript(tb_indexed=tb, index=index):
+            return needs_stmts(tb) or needs_stmts(index)
+        case _:
+            return False
+
+
+# whether a loop body binds something a closure in it could capture; python
+# would share that binding between iterations, monkey gives each its own
+def loop_captures(b: list[Stmt]) -> bool:
+    lets = funcs = False
+
+    def walk(node) -> None:
+        nonlocal lets, funcs
+        match node:
+            case syntax.Func():
+                funcs = True
+            case syntax.Let(init=init):
+                lets = True
+                walk(init)
+            case list():
+                for n in node:
+                    walk(n)
+            case syntax.NakedExp(exp=exp) | syntax.Return(tb_returned=exp):
+                walk(exp)
+            case syntax.Assign(target=target, value=value):
+                walk(target)
+                walk(value)
+            case syntax.Cond(condition=c, perchance=p, perchance_not=pn):
+                walk(c)
+                walk(p)
+                walk(pn)
+            case syntax.While(condition=c, body=body):
+                walk(c)
+                walk(body)
+            case syntax.Block(stmts=stmts):
+                walk(stmts)
+            case syntax.BinOp(lhs=lhs, rhs=rhs):
+                walk(lhs)
+                walk(rhs)
+            case syntax.Call(func=func, arguments=args):
+                walk(func)
+                walk(args)
+            case syntax.Array(elements=elements):
+                walk(elements)
+            case syntax.Hashmap(elements=elements):
+                walk(list(elements.keys()))
+                walk(list(elements.values()))
+            case syntax.Field(tb_fielded=tb):
+                walk(tb)
+            case syntax.Subscript(tb_indexed=tb, index=index):
+                walk(tb)
+                walk(index)
+
+    walk(b)
+    return lets and funcs
+
+
+# one python def being generated
+class PyFunc:
+    lines: list[str]
+    indent: int
+    bound: set[str]
+    nonlocals: set[str]
+    # names from enclosing defs this one uses, its own defs' included
+    free: set[str]
+    # wrapped loop bodies return (value,) so the loop can pass a return on
+    loop_body: bool
+
+    def __init__(self, bound: set[str], loop_body: bool):
+        self.lines = []
+        self.indent = 1
+        self.bound = bound
+        self.nonlocals = set()
+        self.free = set()
+        self.loop_body = loop_body
+
+
+class PyGen:
+    func: Optional[PyFunc]
+    scopes: list[dict[str, str]]
+    constants: dict[tuple, str]
+    counter: int
+    # whether calls yield, i.e. this is the generator version of a def
+    steps: bool
+    # module level source making the code of each generator version, by def name
+    steps_defs: dict[str, list[str]]
+
+    def __init__(self):
+        self.func = None
+        self.scopes = []
+        self.constants = {}
+        self.counter = 0
+        self.steps = False
+        self.steps_defs = {}
+
+    def fresh(self, prefix: str) -> str:
+        self.counter += 1
+        return f"{prefix}{self.counter}"
+
+    def emit(self, line: str) -> None:
+        self.func.lines.append("    " * self.func.indent + line)
+
+    def spill(self, x: str) -> str:
+        tmp = self.fresh("_t")
+        self.emit(f"{tmp} = {x}")
+        self.func.bound.add(tmp)
+        return tmp
+
+    def constant(self, v: Value) -> str:
+        key = (type(v), type(v.value), v.value)
+        if key not in self.constants:
+            self.constants[key] = f"_k{len(self.constants)}"
+        return self.constants[key]
+
+    # same scoping rules as static.Anal, but every binding gets its own python name
+    def declare(self, name: str) -> str:
+        scope = self.scopes[-1]
+        if name not in scope:
+            scope[name] = self.fresh(f"{name}_")
+        self.func.bound.add(scope[name])
+        return scope[name]
+
+    def lookup(self, name: str) -> str:
+        for scope in reversed(self.scopes):
+            if name in scope:
+                if scope[name] not in self.func.bound:
+                    self.func.free.add(scope[name])
+                return scope[name]
+        raise ValueError(f"Unresolved {name}")
+
+    def program(self, ast: list[Stmt], globals: list[str]) -> str:
+        self.scopes.append({})
+        self.func = PyFunc(set(), False)
+        params = [self.declare(g) for g in globals]
+        self.block(ast, want=False)
+        body = self.func.lines
+
+        lines = [f"{name} = {self.literal(key)}" for key, name in self.constants.items()]
+        for steps in self.steps_defs.values():
+            lines.extend(steps)
+        lines.append(f"def __main__({', '.join(params)}):")
+        lines.extend(body or ["    pass"])
+        return "\n".join(lines) + "\n"
+
+    def literal(self, key: tuple) -> str:
+        kind, _, value = key
+        return f"{kind.__name__}({value!r})"
+
+    # compiles a def into the current function and returns its name
+    def function(self, params: list[str], body: list[Stmt], loop_body: bool = False) -> str:
+        outer, steps = self.func, self.steps
+        name = self.fresh("_fn")
+        start = self.counter
+        self.steps = False
+        pyparams, inner = self.def_body(params, body, loop_body)
+        if makes_calls(body) and name not in self.steps_defs:
+            # the same fresh names again, so both versions use the same free
+            # variables. the defs inside are compiled the same way again too,
+            # but their own generator versions are already done
+            end, self.counter = self.counter, start
+            self.steps = True
+            _, gen = self.def_body(params, body, loop_body)
+            self.counter = end
+            self.steps_defs[name] = self.steps_def(name, pyparams, gen)
+        self.func, self.steps = outer, steps
+        outer.free |= inner.free - outer.bound
+
+        self.emit(f"def {name}({', '.join(pyparams)}):")
+        if inner.nonlocals:
+            self.emit(f"    nonlocal {', '.join(sorted(inner.nonlocals))}")
+        prefix = "    " * self.func.indent
+        self.func.lines.extend(prefix + line for line in inner.lines)
+        return name
+
+    def def_body(self, params: list[str], body: list[Stmt], loop_body: bool) -> tuple[list[str], PyFunc]:
+        self.func = PyFunc(set(), loop_body)
+        if not loop_body:
+            self.scopes.append({})
+        pyparams = [self.declare(p) for p in params]
+        value = self.block(body, want=not loop_body)
+        if loop_body:
+            self.emit("return None")
+        else:
+            self.emit(f"return {value}")
+            self.scopes.pop()
+        return pyparams, self.func
+
+    # a def binding gen's free variables, so that the generator version
+    # compiled in it has them too
+    def steps_def(self, name: str, pyparams: list[str], gen: PyFunc) -> list[str]:
+        lines = [f"def _make{name}():"]
+        if gen.free:
+            lines.append(f"    {' = '.join(sorted(gen.free))} = None")
+        lines.append(f"    def {name}({', '.join(pyparams)}):")
+        if gen.nonlocals:
+            lines.append(f"        nonlocal {', '.join(sorted(gen.nonlocals))}")
+        lines.extend("    " + line for line in gen.lines)
+        lines.append(f"    return {name}.__code__")
+        lines.append(f"_steps[{name!r}] = _make{name}()")
+        return lines
+
+    def block(self, b: list[Stmt], want: bool = True) -> str:
+        match b:
+            case []:
+                return "_unit" if want else None
+            case [*stuff, last]:
+                self.scopes.append({})
+                for s in stuff:
+                    self.stmt(s)
+                match last:
+                    case syntax.NakedExp(exp=exp) if want:
+                        value = self.exp(exp)
+                    case _:
+                        self.stmt(last)
+                        value = "_unit" if want else None
+                self.scopes.pop()
+                return value
+
+    def stmt(self, s: Stmt) -> None:
+        match s:
+            case syntax.NakedExp(exp=exp):
+                x = self.exp(exp, want=False)
+                if x is not None and not x.startswith("_k") and x != "_unit":
+                    self.emit(x)
+            case syntax.Let(name=name, init=syntax.Func()):
+                target = self.declare(name)
+                self.emit(f"{target} = {self.exp(s.init)}")
+            case syntax.Let(name=name, init=init):
+                x = self.exp(init)
+                self.emit(f"{self.declare(name)} = {x}")
+            case syntax.Assign(target=target, value=value):
+                match target:
+                    case syntax.Variable(name=name):
+                        x = self.exp(value)
+                        target = self.lookup(name)
+                        if target not in self.func.bound:
+                            self.func.nonlocals.add(target)
+                        self.emit(f"{target} = {x}")
+                    case _:
+                        raise ValueError("Invalid lvalue")
+            case syntax.Return(tb_returned=tb_returned):
+                x = self.exp(tb_returned)
+                if self.func.loop_body:
+                    self.emit(f"return ({x},)")
+                else:
+                    self.emit(f"return {x}")
+            case _:
+                raise ValueError("Unknown Statement")
+
+    # python expressions for each of es, in monkey's evaluation order
+    def exps(self, es: list[Exp]) -> list[str]:
+        out = []
+        for i, e in enumerate(es):
+            x = self.exp(e)
+            later = any(needs_stmts(other) for other in es[i + 1 :])
+            if later and not x.startswith("_k"):
+                x = self.spill(x)
+            out.append(x)
+        return out
+
+    def exp(self, e: Exp, want: bool = True) -> Optional[str]:
+        match e:
+            # literals
+            case syntax.Unit():
+                return "_unit"
+            case syntax.Bool(value=value):
+                return self.constant(Bool(value))
+            case syntax.Num(value=value):
+                return self.constant(Num(value))
+            case syntax.String(value=value):
+                return self.constant(String(value))
+
+            # thicc literals
+            case syntax.Array(elements=elements):
+                return f"Array([{', '.join(self.exps(elements))}])"
+            case syntax.Hashmap(elements=elements):
+                flat = self.exps([x for pair in elements.items() for x in pair])
+                pairs = [f"{k}: {v}" for k, v in zip(flat[::2], flat[1::2])]
+                return f"Hashmap({{{', '.join(pairs)}}})"
+
+            case syntax.Variable(name=name):
+                return self.lookup(name)
+            case syntax.BinOp(lhs=lhs, rhs=rhs, op=op):
+                lhs, rhs = self.exps([lhs, rhs])
+                return f"{BINOPS[type(op)]}({lhs}, {rhs})"
+
+            case syntax.Cond(
+                condition=condition, perchance=perchance, perchance_not=perchance_not
+            ):
+                result = self.fresh("_t") if want else None
+                if result:
+                    self.func.bound.add(result)
+                self.emit(f"if _truth({self.exp(condition)}):")
+                self.branch(perchance, result)
+                match perchance_not:
+                    case None:
+                        if result:
+                            self.emit("else:")
+                            self.emit(f"    {result} = _unit")
+                    case syntax.Cond():
+                        self.emit("else:")
+                        self.func.indent += 1
+                        x = self.exp(perchance_not, want)
+                        if result:
+                            self.emit(f"{result} = {x}")
+                        self.func.indent -= 1
+                    case [*stmts]:
+                        self.emit("else:")
+                        self.branch(stmts, result)
+                return result
+            case syntax.Block(stmts=stmts):
+                return self.block(stmts, want)
+
+            case syntax.Field(tb_fielded=tb_fielded, field=field):
+                return f"_field({self.exp(tb_fielded)}, {self.constant(String(field))})"
+            case syntax.Subscript(tb_indexed=tb_indexed, index=index):
+                tb, index = self.exps([tb_indexed, index])
+                return f"_index({tb}, {index})"
+            case syntax.Func(params=params, body=body):
+                name = self.function(params, body)
+                if e.memo:
+                    return f"Closure({params!r}, {name}, 0, None, memo=_memo({e.line}))"
+                return f"Closure({params!r}, {name}, 0, None)"
+            case syntax.Call(func=func, arguments=args):
+                if self.steps:
+                    return f"(yield _call_steps({', '.join(self.exps([func] + args))}))"
+                return f"_call({', '.join(self.exps([func] + args))})"
+
+            case syntax.While(condition=condition, body=body):
+                if needs_stmts(condition):
+                    self.emit("while True:")
+                    self.func.indent += 1
+                    self.emit(f"if not _truth({self.exp(condition)}):")
+                    self.emit("    break")
+                else:
+                    self.emit(f"while _truth({self.exp(condition)}):")
+                    self.func.indent += 1
+                if loop_captures(body):
+                    self.scopes.append({})
+                    name = self.function([], body, loop_body=True)
+                    self.scopes.pop()
+                    ret = self.fresh("_r")
+                    self.func.bound.add(ret)
+                    if self.steps and makes_calls(body):
+                        self.emit(f"{ret} = yield _steps_of({name})()")
+                    else:
+                        self.emit(f"{ret} = {name}()")
+                    self.emit(f"if {ret} is not None:")
+                    self.emit(f"    return {ret if self.func.loop_body else ret + '[0]'}")
+                else:
+                    self.block(body, want=False)
+                    self.emit("pass")
+                self.func.indent -= 1
+                return "_unit"
+            case _:
+                raise ValueError("Skill Issue")
+
+    def branch(self, b: list[Stmt], result: Optional[str]) -> None:
+        self.func.indent += 1
+        x = self.block(b, want=result is not None)
+        if result:
+            self.emit(f"{result} = {x}")
+        else:
+            self.emit("pass")
+        self.func.indent -= 1
+
+
+def source(ast: list[Stmt], globals: list[str]) -> str:
+    return PyGen().program(ast, globals)
+
+
+def compile_program(ast: list[Stmt], globals: list[str], filename: str = "<monkey>") -> CodeType:
+    return compile(source(ast, globals), filename, "exec")
+
+
+def run(code: CodeType, globals: list[Value]) -> Value:
+    namespace = runtime()
+    exec(code, namespace)
+    return namespace["__main__"](*globals)
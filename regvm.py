@@ -0,0 +1,546 @@
+from typing import Optional
+from syntax import Exp, Stmt
+from syntax import Plus, Minus, Mult, Div, Eq, Leq, Mod
+import syntax
+
+from eval import Value, Unit, Num, String, Bool, Hashmap, Array, Closure, PrimOp, Cell
+from eval import MISS, auto_memo, memo_key
+from eval import TypeError, DivZeroError, IncorrectArity, UnboundVariable
+from lower import allocate_temps
+
+# runs the ANF statements that lower.IR_Transformer produces. every local of
+# a function gets a register in one flat list per call, $n temporaries share
+# them wherever lower.allocate_temps says they're never live at once. nested
+# blocks don't push anything, and control flow is flattened into jumps
+
+# opcodes, operands are register numbers unless said otherwise
+MOVE = 0  # dst, src
+ADD = 1  # dst, lhs, rhs
+SUB = 2
+MUL = 3
+DIV = 4
+MOD = 5
+EQ = 6
+LEQ = 7
+JUMP = 8  # target pc
+JUMP_IF_FALSE = 9  # cond, target pc
+CALL = 10  # dst, func, tuple of args
+RETURN = 11  # src
+CLOSURE = 12  # dst, RegCode, tuple of registers holding the captured cells
+NEW_CELL = 13  # reg
+BOX = 14  # reg, wraps whatever is in it
+GET_CELL = 15  # dst, cell
+SET_CELL = 16  # cell, src
+INDEX = 17  # dst, indexed, index
+ARRAY = 18  # dst, tuple of elements
+HASH = 19  # dst, tuple of (key, value) pairs
+
+OPNAMES = [
+    "MOVE", "ADD", "SUB", "MUL", "DIV", "MOD", "EQ", "LEQ", "JUMP", "JUMP_IF_FALSE",
+    "CALL", "RETURN", "CLOSURE", "NEW_CELL", "BOX", "GET_CELL", "SET_CELL",
+    "INDEX", "ARRAY", "HASH",
+]
+
+BINOPS = {Plus: ADD, Minus: SUB, Mult: MUL, Div: DIV, Eq: EQ, Leq: LEQ, Mod: MOD}
+
+
+class Var:
+    reg: int
+    boxed: bool
+
+    def __init__(self, reg: int):
+        self.reg = reg
+        self.boxed = False
+
+
+# registers and scopes of one function while the IR is being resolved
+class FuncAlloc:
+    parent: Optional["FuncAlloc"]
+    scopes: list[dict[str, Var]]
+    # outer variable -> register in this function holding its cell
+    free: dict[Var, Var]
+    params: list[Var]
+    size: int
+    # temporary -> its slot, and the register each slot got
+    slots: dict[str, int]
+    shared: dict[int, int]
+
+    def __init__(self, parent: Optional["FuncAlloc"], slots: dict[str, int]):
+        self.parent = parent
+        self.scopes = []
+        self.free = {}
+        self.params = []
+        self.size = 0
+        self.slots = slots
+        self.shared = {}
+
+    def new_reg(self) -> int:
+        self.size += 1
+        return self.size - 1
+
+    def declare(self, name: str) -> Var:
+        scope = self.scopes[-1]
+        if name not in scope:
+            slot = self.slots.get(name)
+            if slot is None:
+                scope[name] = Var(self.new_reg())
+            else:
+                if slot not in self.shared:
+                    self.shared[slot] = self.new_reg()
+                scope[name] = Var(self.shared[slot])
+        return scope[name]
+
+    def lookup(self, name: str) -> Var:
+        for scope in reversed(self.scopes):
+            if name in scope:
+                return scope[name]
+        if self.parent is None:
+            raise UnboundVariable(name)
+        outer = self.parent.lookup(name)
+        outer.boxed = True
+        if outer not in self.free:
+            var = Var(self.new_reg())
+            var.boxed = True
+            self.free[outer] = var
+        return self.free[outer]
+
+
+# first pass: gives every Let, Variable and parameter a register and finds
+# out which of them are captured, before any code is emitted
+class Allocator:
+    func: Optional[FuncAlloc]
+    vars: dict[int, Var]
+    funcs: dict[int, FuncAlloc]
+    # the variables each statement list declares, they get fresh cells on entry
+    declared: dict[int, list[Var]]
+
+    def __init__(self):
+        self.func = None
+        self.vars = {}
+        self.funcs = {}
+        self.declared = {}
+
+    def function(self, key: int, params: list[str], body: list[Stmt]) -> FuncAlloc:
+        func = FuncAlloc(self.func, allocate_temps(body))
+        self.funcs[key] = func
+        self.func = func
+        func.scopes.append({})
+        func.params = [func.declare(p) for p in params]
+        self.stmts(body)
+        self.func = func.parent
+        return func
+
+    def stmts(self, b: list[Stmt]) -> None:
+        self.func.scopes.append({})
+        for s in b:
+            self.stmt(s)
+        self.declared[id(b)] = list(self.func.scopes.pop().values())
+
+    def stmt(self, s: Stmt) -> None:
+        match s:
+            case syntax.NakedExp(exp=exp):
+                self.exp(exp)
+            case syntax.Let(name=name, init=syntax.Func()):
+                self.vars[id(s)] = self.func.declare(name)
+                self.exp(s.init)
+            case syntax.Let(name=name, init=init):
+                self.exp(init)
+                self.vars[id(s)] = self.func.declare(name)
+            case syntax.Assign(target=target, value=value):
+                self.exp(target)
+                self.exp(value)
+            case syntax.Return(tb_returned=tb_returned):
+                self.exp(tb_returned)
+            case _:
+                raise ValueError("Unknown Statement")
+
+    def exp(self, e: Exp) -> None:
+        match e:
+            case syntax.Variable(name=name):
+                self.vars[id(e)] = self.func.lookup(name)
+            case syntax.BinOp(lhs=lhs, rhs=rhs):
+                self.exp(lhs)
+                self.exp(rhs)
+            case syntax.Call(func=func, arguments=args):
+                self.exp(func)
+                for arg in args:
+                    self.exp(arg)
+            case syntax.Subscript(tb_indexed=tb_indexed, index=index):
+                self.exp(tb_indexed)
+                self.exp(index)
+            case syntax.Array(elements=elements):
+                for el in elements:
+                    self.exp(el)
+            case syntax.Hashmap(elements=elements):
+                for k, v in elements.items():
+                    self.exp(k)
+                    self.exp(v)
+            case syntax.Func(params=params, body=body):
+                self.function(id(e), params, body)
+            case syntax.Block(stmts=stmts):
+                self.stmts(stmts)
+            case syntax.Cond(
+                condition=condition, perchance=perchance, perchance_not=perchance_not
+            ):
+                self.exp(condition)
+                self.stmts(perchance)
+                if perchance_not is not None:
+                    self.stmts(perchance_not)
+            case syntax.While(condition=condition, body=body):
+                self.exp(condition)
+                self.stmts(body)
+            case syntax.Num() | syntax.String() | syntax.Bool() | syntax.Unit():
+                pass
+            case _:
+                raise ValueError("Not ANF")
+
+
+class RegCode:
+    name: str
+    params: list[str]
+    free_regs: list[int]
+    # a fresh frame is a copy of this: constants already in their registers
+    template: list[Value]
+    instructions: list[tuple]
+    # its closures get a memo, see pure.py. line is the function's
+    memo: bool
+    line: int
+
+    def __init__(self, name: str, params: list[str], memo: bool = False, line: int = 0):
+        self.name = name
+        self.params = params
+        self.free_regs = []
+        self.template = []
+        self.instructions = []
+        self.memo = memo
+        self.line = line
+
+    def __str__(self):
+        return f"<<RegCode {self.name}>>"
+
+
+# second pass: emits the register code for one function
+class RegCompiler:
+    alloc: Allocator
+    func: FuncAlloc
+    code: RegCode
+    # (type, value type, value) -> register, value
+    constants: dict[tuple, tuple[int, Value]]
+    # where values nobody reads go, one register for all of them
+    discard: Optional[int]
+    # registers the cells an instruction reads are copied into. nothing
+    # needs them after that instruction, so the next one reuses them.
+    # reads is how many the instruction being put together has taken
+    scratch: list[int]
+    reads: int
+
+    def __init__(self, alloc: Allocator, func: FuncAlloc, code: RegCode):
+        self.alloc = alloc
+        self.func = func
+        self.code = code
+        self.constants = {}
+        self.discard = None
+        self.scratch = []
+        self.reads = 0
+
+    def emit(self, *instr) -> int:
+        self.code.instructions.append(instr)
+        self.reads = 0
+        return len(self.code.instructions) - 1
+
+    def label(self) -> int:
+        return len(self.code.instructions)
+
+    def patch(self, at: int, target: int) -> None:
+        instr = self.code.instructions[at]
+        self.code.instructions[at] = instr[:-1] + (target,)
+
+    def constant(self, v: Value) -> int:
+        # 1 and 1.0 are equal but must not share a register
+        key = (type(v), type(getattr(v, "value", None)), getattr(v, "value", None))
+        if key not in self.constants:
+            self.constants[key] = (self.func.new_reg(), v)
+        return self.constants[key][0]
+
+    def temp(self) -> int:
+        return self.func.new_reg()
+
+    def function(self, params: list[str], body: list[Stmt]) -> RegCode:
+        for var in self.func.params:
+            if var.boxed:
+                self.emit(BOX, var.reg)
+        self.stmts(body, None)
+        self.emit(RETURN, self.constant(Unit()))
+
+        self.code.template = [None] * self.func.size
+        for reg, v in self.constants.values():
+            self.code.template[reg] = v
+        self.code.free_regs = [var.reg for var in self.func.free.values()]
+        return self.code
+
+    # register holding the atom's value
+    def operand(self, e: Exp) -> int:
+        match e:
+            case syntax.Variable():
+                var = self.alloc.vars[id(e)]
+                if not var.boxed:
+                    return var.reg
+                if self.reads == len(self.scratch):
+                    self.scratch.append(self.temp())
+                tmp = self.scratch[self.reads]
+                self.reads += 1
+                # not emit, the instruction it's read for still needs the
+                # scratch registers taken so far
+                self.code.instructions.append((GET_CELL, tmp, var.reg))
+                return tmp
+            case syntax.Num(value=value):
+                return self.constant(Num(value))
+            case syntax.String(value=value):
+                return self.constant(String(value))
+            case syntax.Bool(value=value):
+                return self.constant(Bool(value))
+            case syntax.Unit():
+                return self.constant(Unit())
+            case _:
+                raise ValueError("Not an atom")
+
+    # the value of a statement list is its trailing atom, if any
+    def stmts(self, b: list[Stmt], dst: Optional[int]) -> None:
+        for var in self.alloc.declared[id(b)]:
+            if var.boxed:
+                self.emit(NEW_CELL, var.reg)
+        for s in b[:-1]:
+            self.stmt(s)
+        match b:
+            case [*_, syntax.NakedExp(exp=exp)] if dst is not None:
+                self.exp(exp, dst)
+            case [*_, s]:
+                self.stmt(s)
+                if dst is not None:
+                    self.emit(MOVE, dst, self.constant(Unit()))
+            case []:
+                if dst is not None:
+                    self.emit(MOVE, dst, self.constant(Unit()))
+
+    def store(self, var: Var, init: Exp) -> None:
+        if var.boxed:
+            tmp = self.temp()
+            self.exp(init, tmp)
+            self.emit(SET_CELL, var.reg, tmp)
+        else:
+            self.exp(init, var.reg)
+
+    def stmt(self, s: Stmt) -> None:
+        match s:
+            case syntax.NakedExp(exp=exp):
+                # an atom on its own does nothing
+                if not isinstance(exp, (syntax.Variable, syntax.Num, syntax.String, syntax.Bool, syntax.Unit)):
+                    if self.discard is None:
+                        self.discard = self.temp()
+                    self.exp(exp, self.discard)
+            case syntax.Let(init=init):
+                self.store(self.alloc.vars[id(s)], init)
+            case syntax.Assign(target=syntax.Variable() as target, value=value):
+                self.store(self.alloc.vars[id(target)], value)
+            case syntax.Assign():
+                raise ValueError("Invalid lvalue")
+            case syntax.Return(tb_returned=tb_returned):
+                self.emit(RETURN, self.operand(tb_returned))
+
+    # computes e into dst
+    def exp(self, e: Exp, dst: int) -> None:
+        match e:
+            case syntax.BinOp(lhs=lhs, rhs=rhs, op=op):
+                self.emit(BINOPS[type(op)], dst, self.operand(lhs), self.operand(rhs))
+            case syntax.Call(func=func, arguments=args):
+                func = self.operand(func)
+                args = tuple(self.operand(arg) for arg in args)
+                self.emit(CALL, dst, func, args)
+            case syntax.Subscript(tb_indexed=tb_indexed, index=index):
+                self.emit(INDEX, dst, self.operand(tb_indexed), self.operand(index))
+            case syntax.Array(elements=elements):
+                self.emit(ARRAY, dst, tuple(self.operand(el) for el in elements))
+            case syntax.Hashmap(elements=elements):
+                pairs = tuple((self.operand(k), self.operand(v)) for k, v in elements.items())
+                self.emit(HASH, dst, pairs)
+            case syntax.Func(params=params, body=body):
+                inner = self.alloc.funcs[id(e)]
+                code = RegCode(f"fn({','.join(params)})", params, e.memo, e.line)
+                RegCompiler(self.alloc, inner, code).function(params, body)
+                cells = tuple(outer.reg for outer in inner.free)
+                self.emit(CLOSURE, dst, code, cells)
+            case syntax.Block(stmts=stmts):
+                self.stmts(stmts, dst)
+            case syntax.Cond(
+                condition=condition, perchance=perchance, perchance_not=perchance_not
+            ):
+                cond = self.temp()
+                self.exp(condition, cond)
+                otherwise = self.emit(JUMP_IF_FALSE, cond, 0)
+                self.stmts(perchance, dst)
+                end = self.emit(JUMP, 0)
+                self.patch(otherwise, self.label())
+                if perchance_not is None:
+                    self.emit(MOVE, dst, self.constant(Unit()))
+                else:
+                    self.stmts(perchance_not, dst)
+                self.patch(end, self.label())
+            case syntax.While(condition=condition, body=body):
+                cond = self.temp()
+                start = self.label()
+                self.exp(condition, cond)
+                end = self.emit(JUMP_IF_FALSE, cond, 0)
+                self.stmts(body, None)
+                self.emit(JUMP, start)
+                self.patch(end, self.label())
+                self.emit(MOVE, dst, self.constant(Unit()))
+            case _:
+                self.emit(MOVE, dst, self.operand(e))
+
+
+# the program is compiled like a function whose parameters are the globals
+def compile_program(stmts: list[Stmt], globals: list[str]) -> RegCode:
+    alloc = Allocator()
+    func = alloc.function(id(stmts), globals, stmts)
+    code = RegCode("<main>", globals)
+    return RegCompiler(alloc, func, code).function(globals, stmts)
+
+
+def num(v: Value):
+    if isinstance(v, Num):
+        return v.value
+    raise TypeError("Num")
+
+
+class RegVM:
+    def run(self, code: RegCode, globals: list[Value]) -> Value:
+        regs = code.template.copy()
+        regs[: len(globals)] = globals
+        return self.execute(code.instructions, regs)
+
+    # a call pushes its caller onto frames and RETURN pops it again, so the
+    # monkey call stack is that list and never python's, like the vm's
+    def execute(self, instructions: list[tuple], regs: list[Value]) -> Value:
+        # (instructions, registers, pc, register the result goes in, the memo
+        # and key waiting for it)
+        frames = []
+        pc = 0
+        while True:
+            instr = instructions[pc]
+            op = instr[0]
+            pc += 1
+            if op == MOVE:
+                regs[instr[1]] = regs[instr[2]]
+            elif op <= LEQ:
+                x = num(regs[instr[2]])
+                y = num(regs[instr[3]])
+                if op == ADD:
+                    regs[instr[1]] = Num(x + y)
+                elif op == SUB:
+                    regs[instr[1]] = Num(x - y)
+                elif op == LEQ:
+                    regs[instr[1]] = Bool(x <= y)
+                elif op == EQ:
+                    regs[instr[1]] = Bool(x == y)
+                elif op == MOD:
+                    regs[instr[1]] = Num(x % y)
+                elif op == MUL:
+                    regs[instr[1]] = Num(x * y)
+                else:
+                    if y == 0:
+                        raise DivZeroError()
+                    regs[instr[1]] = Num(x / y)
+            elif op == JUMP_IF_FALSE:
+                cond = regs[instr[1]]
+                if not isinstance(cond, Bool):
+                    raise TypeError("Bool")
+                if not cond.value:
+                    pc = instr[2]
+            elif op == JUMP:
+                pc = instr[1]
+            elif op == GET_CELL:
+                regs[instr[1]] = regs[instr[2]].value
+            elif op == SET_CELL:
+                regs[instr[1]].value = regs[instr[2]]
+            elif op == CALL:
+                f = regs[instr[2]]
+                args = [regs[a] for a in instr[3]]
+                if isinstance(f, Closure):
+                    if len(args) != len(f.parameters):
+                        raise IncorrectArity(len(f.parameters), len(args))
+                    waiting = None
+                    if f.memo is not None:
+                        key = memo_key(args)
+                        if key is not None:
+                            ret = f.memo.get(key)
+                            if ret is not MISS:
+                                regs[instr[1]] = ret
+                                continue
+                            waiting = (f.memo, key)
+                    frames.append((instructions, regs, pc, instr[1], waiting))
+                    code = f.body
+                    regs = code.template.copy()
+                    regs[: len(args)] = args
+                    for reg, cell in zip(code.free_regs, f.env):
+                        regs[reg] = cell
+                    instructions = code.instructions
+                    pc = 0
+                elif isinstance(f, PrimOp):
+                    regs[instr[1]] = f.func(args)
+                else:
+                    raise TypeError("Closure")
+            elif op == RETURN:
+                ret = regs[instr[1]]
+                if not frames:
+                    return ret
+                instructions, regs, pc, dst, waiting = frames.pop()
+                if waiting is not None:
+                    memo, key = waiting
+                    memo.put(key, ret)
+                regs[dst] = ret
+            elif op == NEW_CELL:
+                regs[instr[1]] = Cell(None)
+            elif op == BOX:
+                regs[instr[1]] = Cell(regs[instr[1]])
+            elif op == CLOSURE:
+                code = instr[2]
+                cells = tuple(regs[r] for r in instr[3])
+                memo = auto_memo(code.line) if code.memo else None
+                regs[instr[1]] = Closure(code.params, code, 0, cells, memo=memo)
+            elif op == INDEX:
+                regs[instr[1]] = self.index(regs[instr[2]], regs[instr[3]])
+            elif op == ARRAY:
+                regs[instr[1]] = Array([regs[r] for r in instr[2]])
+            elif op == HASH:
+                regs[instr[1]] = Hashmap({regs[k]: regs[v] for k, v in instr[2]})
+            else:
+                raise ValueError(f"Unknown opcode {op}")
+
+    def index(self, tb: Value, index: Value) -> Value:
+        match tb:
+            case Hashmap(elements=elements):
+                return elements[index]
+            case Array(elements=elements):
+                match index:
+                    case Num(value=int(ix)):
+                        return elements[ix]
+                    case _:
+                        raise TypeError("Int")
+            case _:
+                raise TypeError("Subscriptable (Array / HashMap)")
+
+
+def dump(code: RegCode) -> str:
+    lines = [f"== {code.name} ({len(code.template)} registers) =="]
+    nested = []
+    for pc, instr in enumerate(code.instructions):
+        operands = []
+        for arg in instr[1:]:
+            if isinstance(arg, RegCode):
+                nested.append(arg)
+            operands.append(str(arg))
+        lines.append(f"{pc:>5}  {OPNAMES[instr[0]]:<14}{' '.join(operands)}")
+    for c in nested:
+        lines.append("")
+        lines.append(dump(c))
+    return "\n".join(lines)
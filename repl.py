@@ -0,0 +1,119 @@
+import sys
+import time
+from typing import Callable, Optional
+from syntax import Stmt
+
+import eval
+from stream import Stream, nesting
+
+# python main.py with no file. one Stream lives for the whole session, so
+# every input is parsed, analysed and run against the bindings made so far,
+# and nothing earlier is ever redone
+
+try:
+    # history and line editing, where python has it
+    import readline  # noqa: F401
+except ImportError:
+    pass
+
+PROMPT = ">> "
+MORE = ".. "
+
+
+class Repl:
+    stream: Stream
+    parse: Callable[[str, int], list[Stmt]]
+    # seconds spent on the last input
+    parse_time: float
+    analyse_time: float
+    eval_time: float
+
+    def __init__(self, parse: Callable[[str, int], list[Stmt]]):
+        self.stream = Stream()
+        self.parse = parse
+        self.parse_time = self.analyse_time = self.eval_time = 0.0
+
+    # runs one complete input, giving back the value of each bare expression
+    def run(self, src: str) -> list[eval.Value]:
+        self.parse_time = self.analyse_time = self.eval_time = 0.0
+        start = time.perf_counter()
+        try:
+            stmts = self.parse(src, 1)
+        finally:
+            self.parse_time = time.perf_counter() - start
+
+        values = []
+        for s in stmts:
+            scope = self.stream.checkpoint()
+            try:
+                # counted when it fails too, the time up to the error
+                start = time.perf_counter()
+                analysed = None
+                try:
+                    self.stream.analyse(s)
+                    analysed = time.perf_counter()
+                    values.append(self.stream.execute(s))
+                finally:
+                    done = time.perf_counter()
+                    if analysed is None:
+                        self.analyse_time += done - start
+                    else:
+                        self.analyse_time += analysed - start
+                        self.eval_time += done - analysed
+            except BaseException:
+                self.stream.rollback(scope)
+                raise
+        return values
+
+    def timings(self) -> str:
+        ms = lambda t: f"{t * 1000:.3f}ms"
+        return f"parse {ms(self.parse_time)}  analyse {ms(self.analyse_time)}  eval {ms(self.eval_time)}"
+
+
+# reads until the brackets close, a missing ";" at the end is filled in
+def read_input() -> str:
+    lines = [input(PROMPT)]
+    while nesting("\n".join(lines)) > 0:
+        lines.append(input(MORE))
+    src = "\n".join(lines)
+    if src.strip() and not src.rstrip().endswith(";"):
+        src += ";"
+    return src
+
+
+def show(v) -> Optional[str]:
+    # puts gives back python's None
+    if v is None or v is eval.UNIT:
+        return None
+    if isinstance(v, eval.String):
+        return f'"{v.value}"'
+    return str(v)
+
+
+def run(parse: Callable[[str, int], list[Stmt]]) -> None:
+    repl = Repl(parse)
+    while True:
+        try:
+            src = read_input()
+        except EOFError:
+            print()
+            return
+        except KeyboardInterrupt:
+            print()
+            continue
+        if not src.strip():
+            continue
+        try:
+            values = repl.run(src)
+        except KeyboardInterrupt:
+            print("interrupted")
+            continue
+        except Exception as err:
+            message = str(err)
+            print(f"{type(err).__name__}: {message}" if message else type(err).__name__)
+        else:
+            for v in values:
+                text = show(v)
+                if text is not None:
+                    print(text)
+        print(f"  ({repl.timings()})", file=sys.stderr)
@@ -1,3 +1,4 @@
+from typing import Optional
 from syntax import Exp, Stmt
 import syntax
 
@@ -19,55 +20,155 @@ class RValueAssignment(PreRuntimeError):
 class InvalidReturn(PreRuntimeError):
     pass 
 
+
+# closures are flat: one captures the variables of enclosing functions (and
+# blocks) it uses, not the frames they live in. a captured variable that can
+# change after it's captured (assigned, let again, or captured by its own
+# initializer) lives in a cell instead, so everybody sees the same one.
+# variables in the program's own scope last as long as the program anyway, a
+# closure reaches those through the frame it hangs off.
+#
+# a function that refers to the let it's bound in gets itself as one more
+# argument instead of capturing itself, so it never ends up in its own
+# captures and plain reference counting can free it
+
+
+# a variable declared inside a function or a block
+class Binding:
+    # Lets and Variables that use it, they get .boxed if it needs a cell
+    nodes: list
+    lets: int
+    assigned: bool
+    captured: bool
+    # captured before its let was done
+    early: bool
+    ready: bool
+    # the function it's a parameter of, and which one
+    param_of: Optional[syntax.Func]
+    slot: int
+    # the function its first let binds, the reads of it inside that function
+    # and how that function would capture it, if it has to after all
+    func: Optional[syntax.Func]
+    recursion: list[syntax.Variable]
+    capture: Optional[syntax.Variable]
+    # keeps id(scope) in its key from being reused
+    scope: dict[str, int]
+
+    def __init__(self, scope: dict[str, int]):
+        self.nodes = []
+        self.lets = 0
+        self.assigned = self.captured = self.early = self.ready = False
+        self.param_of = None
+        self.slot = 0
+        self.func = None
+        self.recursion = []
+        self.capture = None
+        self.scope = scope
+
+    def boxed(self) -> bool:
+        return self.captured and (self.assigned or self.lets > 1 or self.early)
+
+
+class Function:
+    # None for the program itself
+    node: Optional[syntax.Func]
+    # where its parameters' scope is in env_stack (the program's: where the
+    # scopes of its blocks start)
+    base: int
+    # name -> its binding, its index in node.free (None if it's the function
+    # itself) and whether what's captured is where the variable lives, not
+    # the argument an enclosing recursive function got. (None, None, False)
+    # if it isn't anywhere around
+    captures: dict[str, tuple[Optional[Binding], Optional[int], bool]]
+
+    def __init__(self, node: Optional[syntax.Func], base: int):
+        self.node = node
+        self.base = base
+        self.captures = {}
+
+
 class Anal:
-    env_stack: list[set[str]]
+    # every scope maps a name to its slot in the runtime frame
+    env_stack: list[dict[str, int]]
     func_nesting_level : int
+    # how many expressions whose value is used we're inside of, in this function
+    value_depth: int
+    # the functions we're in, innermost last, after the program
+    functions: list[Function]
+    # by (id(scope), name), for the variables of the statement we're in
+    bindings: dict[tuple[int, str], Binding]
 
-    def __init__(self, env_stack: list[set[str]]):
-        self.env_stack = env_stack
+    def __init__(self, env_stack: list[list[str]]):
+        self.env_stack = [make_scope(env) for env in env_stack]
         self.func_nesting_level = 0 
+        self.value_depth = 0
+        # the program's own scope comes right after the ones we're given
+        self.functions = [Function(None, len(self.env_stack) + 1)]
+        self.bindings = {}
 
     def stmt(self, s: Stmt) -> None:
         match s:
-            case syntax.NakedExp(exp=exp):
+            case syntax.NakedExp(exp=syntax.Cond() | syntax.While() | syntax.Block() as exp):
                 self.analyse(exp)
+            case syntax.NakedExp(exp=exp):
+                self.value(exp)
             case syntax.Let(name=name, init=init):
                 match init:
                     case syntax.Func():
-                        self.env_stack[-1].add(name)
-                        self.analyse(init)
+                        s.slot = self.declare(name)
+                        binding = self.let(s)
+                        self.value(init)
                     case _:
-                        self.analyse(init)
-                        self.env_stack[-1].add(name)
+                        self.value(init)
+                        s.slot = self.declare(name)
+                        binding = self.let(s)
+                if binding is not None:
+                    binding.ready = True
                     
             case syntax.Assign(target=target, value=value):
                 match target:
                     case syntax.Field(tb_fielded=tb):
-                        self.analyse(tb)
+                        self.value(tb)
                     case syntax.Subscript(tb_indexed=tb, index=index):
-                        self.analyse(tb)
-                        self.analyse(index)
+                        self.value(tb)
+                        self.value(index)
                     case syntax.Variable():
-                        self.analyse(target)
+                        binding = self.lookup(target)
+                        if binding is not None:
+                            binding.nodes.append(target)
+                            binding.assigned = True
                     case _:
                         raise RValueAssignment()
-                self.analyse(value)
+                self.value(value)
             case syntax.Return(tb_returned=tb_returned):
                 if(self.func_nesting_level == 0):
                     raise InvalidReturn()
-                self.analyse(tb_returned)
+                # a return in the middle of an expression can't just stop the
+                # enclosing statements, it has to unwind the whole call
+                s.unwinds = self.value_depth > 0
+                self.value(tb_returned)
+                self.mark_tail(tb_returned)
             case _:
                 raise ValueError("Uknown Statement")
+        # a statement of the program itself is done, so is everything in it
+        if len(self.env_stack) == self.functions[0].base:
+            self.box()
 
-    def block(self, b: list[Stmt]) -> None:
+    # returns the size of the frame the block needs at runtime
+    def block(self, b: list[Stmt]) -> int:
         match b:
             case []:
-                return
+                return 0
             case [*stuff]:
-                self.env_stack.append(set())
+                self.env_stack.append({})
                 for s in stuff:
                     self.stmt(s)
-                self.env_stack.pop()
+                return len(self.env_stack.pop())
+
+    def value(self, e: Exp) -> None:
+        self.value_depth += 1
+        self.analyse(e)
+        self.value_depth -= 1
 
     def analyse(self, e: Exp) -> None:
         match e:
@@ -89,8 +190,10 @@ class Anal:
                     self.analyse(k)
                     self.analyse(v)
 
-            case syntax.Variable(name=name):
-                self.lookup(name)
+            case syntax.Variable():
+                binding = self.lookup(e)
+                if binding is not None:
+                    binding.nodes.append(e)
             case syntax.BinOp(lhs=lhs, rhs=rhs, op=op):
 
                 lhs = self.analyse(lhs)
@@ -99,18 +202,18 @@ class Anal:
             case syntax.Cond(
                 condition=condition, perchance=perchance, perchance_not=perchance_not
             ):
-                self.analyse(condition)
-                self.block(perchance)
+                self.value(condition)
+                e.perchance_size = self.block(perchance)
                 match perchance_not:
                     case None:
                         return
                     case syntax.Cond():
                         self.analyse(perchance_not)
                     case [*stmts]:
-                        self.block(stmts)
+                        e.perchance_not_size = self.block(stmts)
 
             case syntax.Block(stmts=stmts):
-                self.block(stmts)
+                e.size = self.block(stmts)
 
             case syntax.Field(tb_fielded=tb_fielded, field=field):
                 self.analyse(tb_fielded)
@@ -119,29 +222,169 @@ class Anal:
                 self.analyse(index)
 
             case syntax.Func(params=params, body=body):
-                self.env_stack.append(params)
+                e.free, e.cells, e.recursive = [], [], False
+                # the frame the closure hangs off is the program's own scope,
+                # inside a function that's just past what the function captured
+                func = self.functions[-1]
+                e.outer = len(self.env_stack) - func.base + (1 if func.node else 0)
+                self.functions.append(Function(e, len(self.env_stack)))
+                scope = make_scope(params)
+                self.env_stack.append(scope)
+                for name, slot in scope.items():
+                    binding = self.bindings[(id(scope), name)] = Binding(scope)
+                    binding.ready = True
+                    binding.param_of, binding.slot = e, slot
                 self.func_nesting_level += 1
-                self.block(body)
+                value_depth, self.value_depth = self.value_depth, 0
+                e.body_size = self.block(body)
+                self.mark_tail_block(body)
+                self.value_depth = value_depth
                 self.func_nesting_level -= 1
                 self.env_stack.pop()
+                self.functions.pop()
 
             case syntax.Call(func=func, arguments=args):
                 self.analyse(func)
                 for arg in args:
                     self.analyse(arg)
             case syntax.While(condition=condition, body=body):
-                self.analyse(condition)
-                self.block(body)
+                self.value(condition)
+                e.body_size = self.block(body)
             case _:
                 raise ValueError("Skull Emoji")
 
-    def lookup(self, name: str):
-        for env in self.env_stack[::-1]:
-            if name in env:
-                return
+    # marks the calls whose value is the enclosing function's result
+    def mark_tail(self, e: Exp) -> None:
+        match e:
+            case syntax.Call():
+                e.tail = True
+            case syntax.Cond(perchance=perchance, perchance_not=perchance_not):
+                self.mark_tail_block(perchance)
+                match perchance_not:
+                    case syntax.Cond():
+                        self.mark_tail(perchance_not)
+                    case [*stmts]:
+                        self.mark_tail_block(stmts)
+            case syntax.Block(stmts=stmts):
+                self.mark_tail_block(stmts)
+
+    def mark_tail_block(self, b: list[Stmt]) -> None:
+        match b:
+            case [*_, syntax.NakedExp(exp=exp)]:
+                self.mark_tail(exp)
+
+    def declare(self, name: str) -> int:
+        scope = self.env_stack[-1]
+        if name not in scope:
+            scope[name] = len(scope)
+        return scope[name]
+
+    # the binding a let declares, if it's inside a function or a block
+    def let(self, s: syntax.Let) -> Optional[Binding]:
+        if len(self.env_stack) <= self.functions[0].base:
+            return None
+        scope = self.env_stack[-1]
+        binding = self.bindings.get((id(scope), s.name))
+        if binding is None:
+            binding = self.bindings[(id(scope), s.name)] = Binding(scope)
+        binding.lets += 1
+        binding.nodes.append(s)
+        if binding.lets == 1 and isinstance(s.init, syntax.Func):
+            binding.func = s.init
+        return binding
+
+    # fills in e's (how many frames up, index in that frame), gives back its
+    # binding if it's inside a function or a block
+    def lookup(self, e: syntax.Variable) -> Optional[Binding]:
+        top = len(self.env_stack)
+        found = self.resolve(e, top, len(self.functions))
+        if found is not None:
+            return found[0]
+        # past the innermost function's scopes and captures
+        func = self.functions[-1]
+        outside = self.functions[0].base
+        for i in reversed(range(outside)):
+            if e.name in self.env_stack[i]:
+                e.depth = top - func.base + outside - i if func.node else top - 1 - i
+                e.slot = self.env_stack[i][e.name]
+                return None
+        raise UnboundVariable(e.name)
+
+    # looks e up in the scopes of the innermost `level` functions as seen
+    # from env_stack[top - 1], and captures it into each function on the way
+    # in. gives back its binding and whether e reads where it lives
+    def resolve(self, e: syntax.Variable, top: int, level: int) -> Optional[tuple[Binding, bool]]:
+        func = self.functions[level - 1]
+        for i in reversed(range(func.base, top)):
+            scope = self.env_stack[i]
+            if e.name in scope:
+                e.depth, e.slot = top - 1 - i, scope[e.name]
+                return self.bindings[(id(scope), e.name)], True
+        if level == 1:
+            return None
+        if e.name not in func.captures:
+            func.captures[e.name] = self.capture(e.name, func, level)
+        binding, index, real = func.captures[e.name]
+        if binding is None:
+            return None
+        if index is None:
+            # itself, the argument after the real ones
+            e.depth, e.slot = top - 1 - func.base, len(func.node.params)
+            binding.recursion.append(e)
+        else:
+            # the captures are the frame right outside the parameters
+            e.depth, e.slot = top - func.base, index
+        return binding, real
+
+    def capture(self, name: str, func: Function, level: int) -> tuple[Optional[Binding], Optional[int], bool]:
+        # read where the closure is made, cell and all
+        capture = syntax.Variable(name)
+        found = self.resolve(capture, func.base, level - 1)
+        if found is None:
+            return None, None, False
+        binding, real = found
+        if binding.func is func.node and not binding.ready:
+            binding.capture = capture
+            return binding, None, False
+        # a copy of a recursive function's argument doesn't need a cell
+        # (unless it has to be captured after all, then this is one)
+        if real:
+            binding.captured = True
+            binding.early |= not binding.ready
+        func.node.free.append(capture)
+        return binding, len(func.node.free) - 1, real
+
+    # once a statement of the program is done, everything declared in it is known
+    def box(self) -> None:
+        for binding in self.bindings.values():
+            if binding.recursion:
+                self.recurse(binding)
+        for binding in self.bindings.values():
+            if binding.boxed():
+                for node in binding.nodes:
+                    node.boxed = True
+                if binding.param_of is not None:
+                    binding.param_of.cells.append(binding.slot)
+        self.bindings = {}
+
+    # a function that's only ever bound once gets itself as an argument.
+    # otherwise it has to see whatever its variable holds, so it captures
+    # that after all
+    def recurse(self, binding: Binding) -> None:
+        if not (binding.assigned or binding.lets > 1):
+            binding.func.recursive = True
+            return
+        binding.captured = binding.early = True
+        index = len(binding.func.free)
+        binding.func.free.append(binding.capture)
+        for node in binding.recursion:
+            node.depth, node.slot = node.depth + 1, index
+
 
-        raise UnboundVariable(name)
+def make_scope(names: list[str]) -> dict[str, int]:
+    # duplicate names keep the last slot, same as binding them in order
+    return {name: slot for slot, name in enumerate(names)}
 
 
-def make_global_env() -> set[str]:
-    return ["puts", "len"]
+def make_global_env() -> list[str]:
+    return ["puts", "len", "memo"]
@@ -0,0 +1,122 @@
+import re
+from typing import Callable, Iterable, Iterator
+from syntax import Stmt
+import syntax
+
+import eval, static
+from eval import Interp, Frame
+from static import Anal
+
+# runs a script one top-level statement at a time as it's read, so a huge
+# generated script never has more than one statement's AST in memory. the
+# program's scope stays open in Anal and its frame grows as lets show up.
+# fold.Fold is skipped: it needs to see every assignment in the program first
+
+# what can hide a ";" or nest statements. strings and comments end with their
+# line, so splitting line by line never cuts through one
+STRUCTURE = re.compile(r'"(?:[^"\\\n]|\\[^\n])*"|//|[()\[\]{};]')
+
+
+# how many brackets text leaves open
+def nesting(text: str) -> int:
+    depth = 0
+    for line in text.splitlines():
+        for m in STRUCTURE.finditer(line):
+            match m.group():
+                case "//":
+                    break
+                case "(" | "[" | "{":
+                    depth += 1
+                case ")" | "]" | "}":
+                    depth -= 1
+    return depth
+
+
+# yields (source, line it starts on) for every top-level statement
+def statements(lines: Iterable[str]) -> Iterator[tuple[str, int]]:
+    pending: list[str] = []
+    first = 1
+    depth = 0
+    for number, line in enumerate(lines, 1):
+        start = 0
+        for m in STRUCTURE.finditer(line):
+            match m.group():
+                case "//":
+                    break
+                case "(" | "[" | "{":
+                    depth += 1
+                case ")" | "]" | "}":
+                    depth -= 1
+                case ";" if depth == 0:
+                    pending.append(line[start:m.end()])
+                    yield "".join(pending), first
+                    pending = []
+                    start = m.end()
+                    first = number
+        if not pending and not line[start:].strip():
+            first = number + 1
+            continue
+        if not pending:
+            first = number
+        pending.append(line[start:])
+    # whatever trails the last ";", the parser decides if that's ok
+    rest = "".join(pending)
+    if rest.strip():
+        yield rest, first
+
+
+class Stream:
+    analyser: Anal
+    interp: Interp
+    # the frame the program's statements run in
+    top: Frame
+
+    def __init__(self):
+        self.analyser = Anal([static.make_global_env()])
+        # the program's own scope, left open for the next statement
+        self.analyser.env_stack.append({})
+        globals = eval.make_global_slots(static.make_global_env())
+        self.top = Frame([], Frame(globals, None))
+        self.interp = Interp(self.top)
+
+    def analyse(self, s: Stmt) -> None:
+        self.analyser.stmt(s)
+        slots = self.top.slots
+        slots.extend([None] * (len(self.analyser.env_stack[-1]) - len(slots)))
+
+    # a bare expression gives back its value, anything else UNIT
+    def execute(self, s: Stmt) -> eval.Value:
+        match s:
+            case syntax.NakedExp(exp=exp):
+                return self.interp.eval(exp)
+            case _:
+                self.interp.exec(s)
+                return eval.UNIT
+
+    def run(self, s: Stmt) -> None:
+        self.analyse(s)
+        self.execute(s)
+
+    # what the program's scope looked like, for rollback
+    def checkpoint(self) -> dict[str, int]:
+        return dict(self.analyser.env_stack[-1])
+
+    # forgets whatever a failed statement declared and whatever it was in
+    # the middle of, so the next one starts from a clean slate
+    def rollback(self, scope: dict[str, int]) -> None:
+        del self.analyser.env_stack[2:]
+        self.analyser.env_stack[1] = scope
+        self.analyser.func_nesting_level = 0
+        self.analyser.value_depth = 0
+        del self.analyser.functions[1:]
+        self.analyser.bindings = {}
+        self.interp.env = self.top
+        self.interp.returned = eval.NO_RETURN
+        self.interp.segment_depth = 0
+
+
+def run(lines: Iterable[str], parse: Callable[[str, int], list[Stmt]]) -> None:
+    stream = Stream()
+    for src, line in statements(lines):
+        for s in parse(src, line):
+            stream.run(s)
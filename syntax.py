@@ -3,28 +3,42 @@ from typing import Optional, Union
 
 
 class Exp:
-    pass
+    __slots__ = ()
 
 
+# operators carry no state, so each kind only ever has one instance
 class Operator:
-    pass
+    __slots__ = ()
+
+    def __new__(cls):
+        op = OPERATORS.get(cls)
+        if op is None:
+            op = OPERATORS[cls] = object.__new__(cls)
+        return op
+
+
+OPERATORS: dict[type, Operator] = {}
 
 
 class Stmt:
-    pass
+    __slots__ = ()
 
 
 class Block(Exp):
+    __slots__ = ("stmts", "size")
     stmts: list[Stmt]
+    size: int
 
     def __init__(self, s: list[Stmt]):
         self.stmts = s
+        self.size = 0
     
     def __str__(self):
         return f"{{{' '.join([str(e) for e in self.stmts])}}}"
 
 
 class Num(Exp):
+    __slots__ = ("value",)
     value: Union[int, float]
 
     def __init__(self, v: Union[int, float]):
@@ -35,6 +49,7 @@ class Num(Exp):
 
 
 class String(Exp):
+    __slots__ = ("value",)
     value: str
 
     def __init__(self, s: str):
@@ -45,6 +60,7 @@ class String(Exp):
 
 
 class Bool(Exp):
+    __slots__ = ("value",)
     value: bool
 
     def __init__(self, b: bool):
@@ -55,42 +71,80 @@ class Bool(Exp):
 
 
 class BinOp(Exp):
+    __slots__ = ("lhs", "rhs", "op", "typed")
     lhs: Exp
     rhs: Exp
     op: Operator
+    # both sides are always numbers, set by infer.Infer
+    typed: bool
 
     def __init__(self, l: Exp, r: Exp, o: Operator):
         self.rhs = r
         self.lhs = l
         self.op = o
+        self.typed = False
 
     def __str__(self):
         return f"({self.lhs} {self.op} {self.rhs})"
 
 
+# a BinOp that can't change while the loop around it runs, set by
+# hoist.Hoist. the first time round it's worked out and kept in the frame
+# depth up (the one the loop is in), after that it's read from there. the
+# loop empties the slot as it starts. anything that doesn't know about it
+# sees a plain BinOp
+class Invariant(BinOp):
+    __slots__ = ("depth", "slot")
+    depth: int
+    slot: int
+
+    def __init__(self, e: BinOp, depth: int, slot: int):
+        super().__init__(e.lhs, e.rhs, e.op)
+        self.typed = e.typed
+        self.depth = depth
+        self.slot = slot
+
+
 class Call(Exp):
+    __slots__ = ("func", "arguments", "tail", "cached")
     func: Exp
     arguments: list[Exp]
+    # its value is the enclosing function's result, set by static.Anal
+    tail: bool
+    # eval.Interp's inline cache, the function this call made last
+    cached: object
 
     def __init__(self, f: Exp, a: list[Exp]):
         self.func = f
         self.arguments = a
+        self.tail = False
+        self.cached = None
 
     def __str__(self):
         return f"{self.func}({','.join([str(x) for x in self.arguments])})"
 
 
 class Variable(Exp):
+    __slots__ = ("name", "depth", "slot", "boxed")
     name: str
+    # lexical address, filled in by static.Anal
+    depth: int
+    slot: int
+    # the slot holds a cell with the value in it, see static.Anal
+    boxed: bool
 
     def __init__(self, n: str):
         self.name = n
+        self.depth = None
+        self.slot = None
+        self.boxed = False
 
     def __str__(self):
         return self.name
 
 
 class Hashmap(Exp):
+    __slots__ = ("elements",)
     elements: dict[Exp, Exp]
 
     def __init__(self, e: dict[Exp, Exp]):
@@ -101,6 +155,7 @@ class Hashmap(Exp):
 
 
 class Field(Exp):
+    __slots__ = ("tb_fielded", "field")
     tb_fielded: Exp
     field: str
 
@@ -113,6 +168,7 @@ class Field(Exp):
 
 
 class Array(Exp):
+    __slots__ = ("elements",)
     elements: list[Exp]
 
     def __init__(self, e: list[Exp]):
@@ -123,6 +179,7 @@ class Array(Exp):
 
 
 class Subscript(Exp):
+    __slots__ = ("tb_indexed", "index")
     tb_indexed: Exp
     index: Exp
 
@@ -135,17 +192,46 @@ class Subscript(Exp):
 
 
 class Unit(Exp):
+    __slots__ = ()
+
+    # same for ()
+    def __new__(cls):
+        return UNIT
     def __str__(self):
         return "()"
 
 
+UNIT = object.__new__(Unit)
+
+
 class Func(Exp):
+    __slots__ = ("params", "body", "body_size", "line", "free", "outer", "cells", "recursive", "memo")
     params: list[str]
     body: list[Stmt]
-
-    def __init__(self, p: list[str], b: list[Stmt]):
+    body_size: int
+    # of the "fn", 0 if nobody knows
+    line: int
+    # set by static.Anal: what the closure captures, as seen where it's made,
+    # how many frames up from there the frame it hangs off is, and which
+    # parameters go into cells. a recursive one gets passed itself after its
+    # arguments
+    free: list[Variable]
+    outer: int
+    cells: list[int]
+    recursive: bool
+    # it's pure and worth remembering results for, set by pure.Purity
+    memo: bool
+
+    def __init__(self, p: list[str], b: list[Stmt], line: int = 0):
         self.params = p
         self.body = b
+        self.body_size = 0
+        self.line = line
+        self.free = []
+        self.outer = 0
+        self.cells = []
+        self.recursive = False
+        self.memo = False
 
     def __str__(self):
         return (
@@ -154,14 +240,22 @@ class Func(Exp):
 
 
 class Cond(Exp):
+    __slots__ = ("condition", "perchance", "perchance_not", "perchance_size", "perchance_not_size", "typed")
     condition: Exp
     perchance: list[Stmt]
     perchance_not: Union[None, Cond, list[Stmt]]
+    perchance_size: int
+    perchance_not_size: int
+    # the condition is always a bool, set by infer.Infer
+    typed: bool
 
     def __init__(self, c: Exp, p: list[Stmt], pn: Union[None, Cond, list[Stmt]]):
         self.condition = c
         self.perchance = p
         self.perchance_not = pn
+        self.perchance_size = 0
+        self.perchance_not_size = 0
+        self.typed = False
 
     def __str__(self):
         tmp = None
@@ -177,12 +271,24 @@ class Cond(Exp):
 
 
 class While(Exp):
+    __slots__ = ("condition", "body", "body_size", "line", "typed", "invariants")
     condition: Exp
     body: list[Stmt]
-
-    def __init__(self, condition: Exp, body: list[Stmt]):
+    body_size: int
+    # of the "while", 0 if nobody knows
+    line: int
+    # same as Cond's
+    typed: bool
+    # slots its Invariants keep their values in, in the frame it's in
+    invariants: list[int]
+
+    def __init__(self, condition: Exp, body: list[Stmt], line: int = 0):
         self.condition = condition
         self.body = body
+        self.body_size = 0
+        self.line = line
+        self.typed = False
+        self.invariants = []
 
     def __str__(self):
         return f"while ({self.condition}) {block_string(self.body)}"
@@ -195,6 +301,7 @@ def block_string(s: list[Stmt]) -> str:
 
 
 class NakedExp(Stmt):
+    __slots__ = ("exp",)
     exp: Exp
 
     def __init__(self, e: Exp):
@@ -205,28 +312,39 @@ class NakedExp(Stmt):
 
 
 class Let(Stmt):
+    __slots__ = ("name", "init", "slot", "boxed")
     name: str
     init: Exp
+    slot: int
+    # same as Variable's
+    boxed: bool
 
     def __init__(self, n: str, i: Exp):
         self.name = n
         self.init = i
+        self.slot = None
+        self.boxed = False
 
     def __str__(self):
         return f"let {self.name} = {self.init};"
 
 
 class Return(Stmt):
+    __slots__ = ("tb_returned", "unwinds")
     tb_returned: Exp
+    # set by static.Anal when the return sits inside an expression
+    unwinds: bool
 
     def __init__(self, tb: Exp):
         self.tb_returned = tb
+        self.unwinds = True
 
     def __str__(self):
         return f"return {self.tb_returned};"
 
 
 class Assign(Stmt):
+    __slots__ = ("target", "value")
     target: Exp
     value: Exp
 
@@ -239,31 +357,61 @@ class Assign(Stmt):
 
 
 class Plus(Operator):
+    __slots__ = ()
     def __str__(self):
         return "+"
 
 
 class Minus(Operator):
-    pass
+    __slots__ = ()
+    def __str__(self):
+        return "-"
 
 
 class Mult(Operator):
-    pass
+    __slots__ = ()
+    def __str__(self):
+        return "*"
 
 
 class Div(Operator):
-    pass
+    __slots__ = ()
+    def __str__(self):
+        return "/"
 
 
 class Eq(Operator):
+    __slots__ = ()
     def __str__(self):
         return "=="
 
 
 class Leq(Operator):
+    __slots__ = ()
     def __str__(self):
         return "<="
 
 
 class Mod(Operator):
-    pass
+    __slots__ = ()
+    def __str__(self):
+        return "%"
+
+
+# node for node, with the operators and the types of the literals. nodes
+# only compare by identity otherwise, so a hashmap's keys go pair by pair
+def same(a, b) -> bool:
+    if type(a) is not type(b):
+        return False
+    match a:
+        case list() | tuple():
+            return len(a) == len(b) and all(same(x, y) for x, y in zip(a, b))
+        case dict():
+            return same(list(a.items()), list(b.items()))
+        case Exp() | Stmt() | Operator():
+            return all(
+                same(getattr(a, f, None), getattr(b, f, None))
+                for cls in type(a).__mro__
+                for f in getattr(cls, "__slots__", ())
+            )
+    return a == b
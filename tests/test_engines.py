@@ -0,0 +1,67 @@
+import os
+import sys
+import subprocess
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+EXAMPLES = os.path.join(ROOT, "examples")
+
+ENGINES = ["interp", "closure", "vm", "regvm", "py"]
+
+
+def run(path: str, *flags: str, cache: bool = False) -> str:
+    cached = [] if cache else ["--no-cache"]
+    done = subprocess.run(
+        [sys.executable, os.path.join(ROOT, "main.py"), path, *cached, *flags],
+        capture_output=True, text=True, timeout=120,
+    )
+    return done.stdout
+
+
+# operands are read left to right, even when a later one reassigns an
+# earlier variable. regvm runs the lowered IR, where that's easy to lose
+@pytest.mark.parametrize("flags", [(), ("--no-opt",)])
+@pytest.mark.parametrize("engine", ENGINES)
+def test_operand_order(engine, flags):
+    path = os.path.join(EXAMPLES, "lowering_tests", "operand_order.monkey")
+    assert run(path, "--engine", engine, *flags) == "1\n11\n1\n"
+
+
+# the second run loads everything from __monkeycache__, hashmap keys that
+# are whole expressions included
+@pytest.mark.parametrize("engine", ENGINES)
+def test_cached_composite_keys(engine, tmp_path):
+    path = tmp_path / "keys.monkey"
+    path.write_text('let h = {[1, 2]: 3, "a": 4};\nputs(h["a"]);\nputs(len({fn(x) { x; }: 1}));\n')
+    for _ in range(2):
+        assert run(str(path), "--engine", engine, cache=True) == "4\n1\n"
+    for parser in ["lark", "pratt"]:
+        assert run(str(path), "--engine", engine, "--parser", parser, cache=True) == "4\n1\n"
+
+
+# well past python's recursion limit. the tree walkers spill over onto new
+# threads every few hundred calls, the vm keeps its frames on the heap
+@pytest.mark.parametrize("engine", ENGINES)
+def test_deep_recursion(engine, tmp_path):
+    path = tmp_path / "deep.monkey"
+    path.write_text("let sum = fn(n) { if (n == 0) { 0; } else { n + sum(n - 1); }; };\nputs(sum(20000));\n")
+    assert run(str(path), "--engine", engine, "--no-memo") == "200010000\n"
+
+
+# several captured variables read by one instruction, each needs its own
+# register in regvm
+@pytest.mark.parametrize("engine", ENGINES)
+def test_captured_operands(engine, tmp_path):
+    path = tmp_path / "captured.monkey"
+    path.write_text(
+        'let a = 1;\n'
+        'let b = 2;\n'
+        'let c = 3;\n'
+        'let f = fn() { a + b; };\n'
+        'let g = fn() { [a, b, c, a + c, {a: b, c: a}[c]]; };\n'
+        'let k = fn(x) { x(a, b, c); };\n'
+        'puts(f(), g(), k(fn(p, q, r) { p + q * r; }));\n'
+        'a = 10;\n'
+        'puts(f(), g());\n'
+    )
+    assert run(str(path), "--engine", engine) == "3\n[1, 2, 3, 4, 1]\n7\n12\n[10, 2, 3, 13, 10]\n"
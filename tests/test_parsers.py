@@ -0,0 +1,126 @@
+import os
+import sys
+import glob
+import random
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from parser import parser, Parser
+import pratt
+import syntax
+
+EXAMPLES = sorted(glob.glob(os.path.join(ROOT, "examples", "**", "*.monkey"), recursive=True))
+
+
+def with_lark(src: str, line: int = 1) -> list[syntax.Stmt]:
+    return Parser(line).transform(parser.parse(src))
+
+
+# random programs that lean on precedence and postfix chains, where the two
+# parsers are most likely to disagree
+class Programs:
+    rng: random.Random
+
+    def __init__(self, seed: int):
+        self.rng = random.Random(seed)
+
+    def name(self) -> str:
+        return self.rng.choice(["a", "b", "f", "xs", "h"])
+
+    def atom(self, depth: int) -> str:
+        match self.rng.randrange(8 if depth else 5):
+            case 0:
+                return str(self.rng.choice([0, 7, -3, 42]))
+            case 1:
+                return self.rng.choice(["1.5", "-0.25", "true", "false", "()"])
+            case 2:
+                return f'"{self.name()}"'
+            case 3 | 4:
+                return self.name()
+            case 5:
+                return f"({self.exp(depth - 1)})"
+            case 6:
+                items = ", ".join(self.exp(depth - 1) for _ in range(self.rng.randrange(3)))
+                return f"[{items}]"
+            case _:
+                pairs = ", ".join(f"{self.exp(depth - 1)}: {self.exp(depth - 1)}" for _ in range(self.rng.randrange(3)))
+                return f"{{{pairs}}}"
+
+    def postfix(self, depth: int) -> str:
+        e = self.atom(depth)
+        chain = self.rng.randrange(3)
+        # "3.f" would lex as the number "3."
+        if chain and e[0] in "-0123456789":
+            e = f"({e})"
+        for _ in range(chain):
+            match self.rng.randrange(3):
+                case 0:
+                    e += f"({', '.join(self.exp(depth - 1) for _ in range(self.rng.randrange(3)))})"
+                case 1:
+                    e += f".{self.name()}"
+                case _:
+                    e += f"[{self.exp(depth - 1)}]"
+        return e
+
+    def exp(self, depth: int) -> str:
+        if depth <= 0:
+            return self.atom(0)
+        match self.rng.randrange(10):
+            case 0:
+                return f"fn({', '.join(['x', 'y'][:self.rng.randrange(3)])}) {{ {self.block(depth - 1)} }}"
+            case 1:
+                e = f"if ({self.exp(depth - 1)}) {{ {self.block(depth - 1)} }}"
+                if self.rng.randrange(2):
+                    e += f" else {{ {self.block(depth - 1)} }}"
+                return e
+            case 2:
+                return f"while ({self.exp(depth - 1)}) {{ {self.block(depth - 1)} }}"
+        e = self.postfix(depth)
+        for _ in range(self.rng.randrange(4)):
+            op = self.rng.choice(["+", "-", "*", "/", "%", "<=", "=="])
+            e += f" {op} {self.postfix(depth)}"
+        return e
+
+    def stmt(self, depth: int) -> str:
+        match self.rng.randrange(5):
+            case 0:
+                return f"let {self.name()} = {self.exp(depth)};"
+            case 1:
+                return f"{self.postfix(depth)} = {self.exp(depth)};"
+            case 2:
+                return f"return {self.exp(depth)};"
+        return f"{self.exp(depth)};"
+
+    def block(self, depth: int) -> str:
+        return " ".join(self.stmt(depth) for _ in range(self.rng.randrange(1, 4)))
+
+    def program(self) -> str:
+        return "\n".join(self.stmt(3) for _ in range(20))
+
+
+@pytest.mark.parametrize("path", EXAMPLES, ids=lambda path: os.path.relpath(path, ROOT))
+def test_examples(path):
+    src = open(path).read()
+    assert syntax.same(with_lark(src), pratt.parse(src))
+
+
+@pytest.mark.parametrize("seed", range(50))
+def test_generated(seed):
+    src = Programs(seed).program()
+    assert syntax.same(with_lark(src), pratt.parse(src)), src
+
+
+# --stream parses a statement at a time, from the line it starts on
+def test_line_offset():
+    src = "let f = fn(x) {\n  x;\n};\nwhile (false) { f(1); };\n"
+    assert syntax.same(with_lark(src, 7), pratt.parse(src, 7))
+    assert not syntax.same(with_lark(src, 7), pratt.parse(src))
+
+
+# and that it would notice if they didn't agree
+def test_same_sees_differences():
+    assert not syntax.same(with_lark("1 + 2 * 3;"), with_lark("(1 + 2) * 3;"))
+    assert not syntax.same(with_lark("a[1];"), with_lark("a[1.0];"))
+    assert not syntax.same(with_lark('{1: 2, 3: 4};'), with_lark('{3: 4, 1: 2};'))
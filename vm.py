@@ -0,0 +1,582 @@
+from enum import IntEnum
+from typing import Optional, Union
+from syntax import Exp, Stmt
+from syntax import Plus, Minus, Mult, Div, Eq, Leq, Mod
+import syntax
+
+from eval import Value, Unit, Num, String, Bool, Hashmap, Array, Closure, PrimOp, Cell
+from eval import TypeError, DivZeroError, IncorrectArity
+from eval import Memo, MISS, auto_memo, memo_key
+
+
+class Op(IntEnum):
+    CONST = 0  # const index
+    UNIT = 1
+    LOAD = 2  # depth, slot
+    LOAD_LOCAL = 3  # slot
+    STORE = 4  # depth, slot
+    STORE_LOCAL = 5  # slot
+    POP = 6
+    ADD = 7
+    SUB = 8
+    MUL = 9
+    DIV = 10
+    MOD = 11
+    EQ = 12
+    LEQ = 13
+    JUMP = 14  # target
+    JUMP_IF_FALSE = 15  # target
+    ENTER = 16  # frame size
+    LEAVE = 17
+    CLOSURE = 18  # const index of a Code, capture count, frames up it hangs off
+    CALL = 19  # argc
+    RETURN = 20
+    ARRAY = 21  # element count
+    HASH = 22  # pair count
+    FIELD = 23  # const index of the key
+    INDEX = 24
+    TAIL_CALL = 25  # argc, reuses the calling frame
+    LOAD_CELL = 26  # depth, slot
+    STORE_CELL = 27  # depth, slot
+    CELL = 28  # slot, puts a cell there if there isn't one yet
+
+
+# how many operands follow each opcode
+ARGS = {op: 0 for op in Op} | {
+    Op.CONST: 1,
+    Op.LOAD: 2,
+    Op.LOAD_LOCAL: 1,
+    Op.STORE: 2,
+    Op.STORE_LOCAL: 1,
+    Op.JUMP: 1,
+    Op.JUMP_IF_FALSE: 1,
+    Op.ENTER: 1,
+    Op.CLOSURE: 3,
+    Op.CALL: 1,
+    Op.TAIL_CALL: 1,
+    Op.ARRAY: 1,
+    Op.HASH: 1,
+    Op.FIELD: 1,
+    Op.LOAD_CELL: 2,
+    Op.STORE_CELL: 2,
+    Op.CELL: 1,
+}
+
+BINOPS = {Plus: Op.ADD, Minus: Op.SUB, Mult: Op.MUL, Div: Op.DIV, Eq: Op.EQ, Leq: Op.LEQ, Mod: Op.MOD}
+
+
+# a compiled function (or the whole program): flat list of opcodes and their
+# operands, plus the constant pool they index into
+class Code:
+    name: str
+    params: list[str]
+    instructions: list[int]
+    constants: list[Union[Value, "Code"]]
+    # parameters that go into cells when it's called, and whether it gets
+    # itself as one more argument
+    cells: list[int]
+    recursive: bool
+    # its closures get a memo, see pure.py. line is the function's
+    memo: bool
+    line: int
+
+    def __init__(
+        self,
+        name: str,
+        params: list[str],
+        cells: list[int] = (),
+        recursive: bool = False,
+        memo: bool = False,
+        line: int = 0,
+    ):
+        self.name = name
+        self.params = params
+        self.instructions = []
+        self.constants = []
+        self.cells = cells
+        self.recursive = recursive
+        self.memo = memo
+        self.line = line
+
+    def __str__(self):
+        return f"<<Code {self.name}>>"
+
+
+class Compiler:
+    code: Code
+    # where each literal already is in code.constants
+    pool: dict[tuple, int]
+
+    def __init__(self, code: Code):
+        self.code = code
+        self.pool = {}
+
+    def emit(self, op: Op, *args: int) -> int:
+        at = len(self.code.instructions)
+        self.code.instructions.append(int(op))
+        self.code.instructions.extend(args)
+        return at
+
+    def constant(self, v: Union[Value, Code]) -> int:
+        consts = self.code.constants
+        if isinstance(v, Code):
+            consts.append(v)
+            return len(consts) - 1
+        # values are immutable, so equal literals can share a slot
+        # (but 1 and 1.0 compare equal and must not)
+        key = (type(v), type(v.value), v.value)
+        idx = self.pool.get(key)
+        if idx is None:
+            idx = self.pool[key] = len(consts)
+            consts.append(v)
+        return idx
+
+    def label(self) -> int:
+        return len(self.code.instructions)
+
+    # jump operands are patched once the target is known
+    def patch(self, at: int, target: int) -> None:
+        self.code.instructions[at + 1] = target
+
+    def stmt(self, s: Stmt) -> None:
+        match s:
+            case syntax.NakedExp(exp=exp):
+                self.compile(exp)
+                self.emit(Op.POP)
+            case syntax.Let(slot=slot, init=init, boxed=True):
+                # the cell is there before the init runs, a closure in it
+                # might capture it
+                self.emit(Op.CELL, slot)
+                self.compile(init)
+                self.emit(Op.STORE_CELL, 0, slot)
+            case syntax.Let(slot=slot, init=init):
+                self.compile(init)
+                self.emit(Op.STORE_LOCAL, slot)
+            case syntax.Assign(target=target, value=value):
+                match target:
+                    case syntax.Variable(depth=depth, slot=slot, boxed=True):
+                        self.compile(value)
+                        self.emit(Op.STORE_CELL, depth, slot)
+                    case syntax.Variable(depth=depth, slot=slot):
+                        self.compile(value)
+                        self.store(depth, slot)
+                    case _:
+                        raise ValueError("Invalid lvalue")
+            case syntax.Return(tb_returned=tb_returned):
+                self.compile(tb_returned)
+                self.emit(Op.RETURN)
+            case _:
+                raise ValueError("Unknown Statement")
+
+    # leaves the value of the block on the stack
+    def block(self, b: list[Stmt], size: int) -> None:
+        match b:
+            case []:
+                self.emit(Op.UNIT)
+            case [*stuff, last]:
+                self.emit(Op.ENTER, size)
+                for s in stuff:
+                    self.stmt(s)
+                match last:
+                    case syntax.NakedExp(exp=exp):
+                        self.compile(exp)
+                    case _:
+                        self.stmt(last)
+                        self.emit(Op.UNIT)
+                self.emit(Op.LEAVE)
+
+    def load(self, depth: int, slot: int) -> None:
+        if depth == 0:
+            self.emit(Op.LOAD_LOCAL, slot)
+        else:
+            self.emit(Op.LOAD, depth, slot)
+
+    def store(self, depth: int, slot: int) -> None:
+        if depth == 0:
+            self.emit(Op.STORE_LOCAL, slot)
+        else:
+            self.emit(Op.STORE, depth, slot)
+
+    def compile(self, e: Exp) -> None:
+        match e:
+            # literals
+            case syntax.Unit():
+                self.emit(Op.UNIT)
+            case syntax.Bool(value=value):
+                self.emit(Op.CONST, self.constant(Bool(value)))
+            case syntax.Num(value=value):
+                self.emit(Op.CONST, self.constant(Num(value)))
+            case syntax.String(value=value):
+                self.emit(Op.CONST, self.constant(String(value)))
+
+            # thicc literals
+            case syntax.Array(elements=elements):
+                for e in elements:
+                    self.compile(e)
+                self.emit(Op.ARRAY, len(elements))
+            case syntax.Hashmap(elements=elements):
+                for k, v in elements.items():
+                    self.compile(k)
+                    self.compile(v)
+                self.emit(Op.HASH, len(elements))
+
+            case syntax.Variable(depth=depth, slot=slot, boxed=True):
+                self.emit(Op.LOAD_CELL, depth, slot)
+            case syntax.Variable(depth=depth, slot=slot):
+                self.load(depth, slot)
+            case syntax.BinOp(lhs=lhs, rhs=rhs, op=op):
+                self.compile(lhs)
+                self.compile(rhs)
+                self.emit(BINOPS[type(op)])
+
+            case syntax.Cond(
+                condition=condition, perchance=perchance, perchance_not=perchance_not
+            ):
+                self.compile(condition)
+                otherwise = self.emit(Op.JUMP_IF_FALSE, 0)
+                self.block(perchance, e.perchance_size)
+                end = self.emit(Op.JUMP, 0)
+                self.patch(otherwise, self.label())
+                match perchance_not:
+                    case None:
+                        self.emit(Op.UNIT)
+                    case syntax.Cond():
+                        self.compile(perchance_not)
+                    case [*stmts]:
+                        self.block(stmts, e.perchance_not_size)
+                self.patch(end, self.label())
+            case syntax.Block(stmts=stmts, size=size):
+                self.block(stmts, size)
+
+            case syntax.Field(tb_fielded=tb_fielded, field=field):
+                self.compile(tb_fielded)
+                self.emit(Op.FIELD, self.constant(String(field)))
+            case syntax.Subscript(tb_indexed=tb_indexed, index=index):
+                self.compile(tb_indexed)
+                self.compile(index)
+                self.emit(Op.INDEX)
+            case syntax.Func(params=params, body=body, body_size=size, free=free, outer=outer):
+                code = Code(f"fn({','.join(params)})", params, e.cells, e.recursive, e.memo, e.line)
+                compiler = Compiler(code)
+                compiler.block(body, size)
+                compiler.emit(Op.RETURN)
+                # captures go on the stack as they are, cells and all
+                for v in free:
+                    self.load(v.depth, v.slot)
+                self.emit(Op.CLOSURE, self.constant(code), len(free), outer)
+            case syntax.Call(func=func, arguments=args):
+                self.compile(func)
+                for arg in args:
+                    self.compile(arg)
+                self.emit(Op.TAIL_CALL if e.tail else Op.CALL, len(args))
+
+            case syntax.While(condition=condition, body=body, body_size=size):
+                start = self.label()
+                self.compile(condition)
+                end = self.emit(Op.JUMP_IF_FALSE, 0)
+                self.block(body, size)
+                self.emit(Op.POP)
+                self.emit(Op.JUMP, start)
+                self.patch(end, self.label())
+                self.emit(Op.UNIT)
+            case _:
+                raise ValueError("Skill Issue")
+
+
+def compile_program(ast: list[Stmt], size: int) -> Code:
+    code = Code("<main>", [])
+    compiler = Compiler(code)
+    compiler.block(ast, size)
+    compiler.emit(Op.RETURN)
+    return code
+
+
+class Frame:
+    code: Code
+    ip: int
+    env: list[list[Value]]
+    # where this call's stuff starts on the value stack
+    base: int
+    # memos waiting for what this call gives back, tail calls hand them on
+    waiting: Optional[list[tuple[Memo, tuple]]]
+
+    def __init__(self, code: Code, env: list[list[Value]], base: int, waiting=None):
+        self.code = code
+        self.ip = 0
+        self.env = env
+        self.base = base
+        self.waiting = waiting
+
+
+def num(v: Value):
+    if isinstance(v, Num):
+        return v.value
+    raise TypeError("Num")
+
+
+class VM:
+    stack: list[Value]
+    frames: list[Frame]
+
+    def __init__(self):
+        self.stack = []
+        self.frames = []
+
+    def run(self, code: Code, globals: list[Value]) -> Value:
+        self.frames.append(Frame(code, [globals], 0))
+        return self.loop()
+
+    def loop(self) -> Value:
+        stack = self.stack
+        push = stack.append
+        pop = stack.pop
+        frame = self.frames[-1]
+        instructions = frame.code.instructions
+        constants = frame.code.constants
+        env = frame.env
+        ip = frame.ip
+
+        # comparing against IntEnum members is slow, so the opcodes are plain ints here
+        CONST, UNIT, LOAD, LOAD_LOCAL, STORE, STORE_LOCAL, POP = range(Op.CONST, Op.POP + 1)
+        ADD, SUB, MUL, DIV, MOD, EQ, LEQ = range(Op.ADD, Op.LEQ + 1)
+        JUMP, JUMP_IF_FALSE, ENTER, LEAVE, CLOSURE, CALL, RETURN = range(Op.JUMP, Op.RETURN + 1)
+        ARRAY, HASH, FIELD, INDEX, TAIL_CALL = range(Op.ARRAY, Op.TAIL_CALL + 1)
+        LOAD_CELL, STORE_CELL, CELL = range(Op.LOAD_CELL, Op.CELL + 1)
+
+        # the hot opcodes are checked first
+        while True:
+            op = instructions[ip]
+            if op == LOAD_LOCAL:
+                push(env[-1][instructions[ip + 1]])
+                ip += 2
+            elif op == CONST:
+                push(constants[instructions[ip + 1]])
+                ip += 2
+            elif op == LOAD:
+                push(env[-1 - instructions[ip + 1]][instructions[ip + 2]])
+                ip += 3
+            elif op == STORE_LOCAL:
+                env[-1][instructions[ip + 1]] = pop()
+                ip += 2
+            elif op == STORE:
+                env[-1 - instructions[ip + 1]][instructions[ip + 2]] = pop()
+                ip += 3
+            elif op == LOAD_CELL:
+                push(env[-1 - instructions[ip + 1]][instructions[ip + 2]].value)
+                ip += 3
+            elif op == STORE_CELL:
+                env[-1 - instructions[ip + 1]][instructions[ip + 2]].value = pop()
+                ip += 3
+            elif op == POP:
+                pop()
+                ip += 1
+            elif op <= LEQ and op >= ADD:
+                # both operands are popped before either is checked, like Interp.arith_op
+                y = pop()
+                x = pop()
+                x = num(x)
+                y = num(y)
+                if op == ADD:
+                    push(Num(x + y))
+                elif op == SUB:
+                    push(Num(x - y))
+                elif op == LEQ:
+                    push(Bool(x <= y))
+                elif op == EQ:
+                    push(Bool(x == y))
+                elif op == MOD:
+                    push(Num(x % y))
+                elif op == MUL:
+                    push(Num(x * y))
+                else:
+                    if y == 0:
+                        raise DivZeroError()
+                    push(Num(x / y))
+                ip += 1
+            elif op == JUMP_IF_FALSE:
+                cond = pop()
+                if not isinstance(cond, Bool):
+                    raise TypeError("Bool")
+                ip = ip + 2 if cond.value else instructions[ip + 1]
+            elif op == JUMP:
+                ip = instructions[ip + 1]
+            elif op == ENTER:
+                env.append([None] * instructions[ip + 1])
+                ip += 2
+            elif op == LEAVE:
+                env.pop()
+                ip += 1
+            elif op == CALL:
+                argc = instructions[ip + 1]
+                ip += 2
+                f = stack[-argc - 1]
+                if isinstance(f, Closure):
+                    if argc != len(f.parameters):
+                        raise IncorrectArity(len(f.parameters), argc)
+                    base = len(stack) - argc - 1
+                    args = stack[base + 1 :]
+                    waiting = None
+                    if f.memo is not None:
+                        key = memo_key(args)
+                        if key is not None:
+                            ret = f.memo.get(key)
+                            if ret is not MISS:
+                                del stack[base:]
+                                push(ret)
+                                continue
+                            waiting = [(f.memo, key)]
+                        if f.memo.itself is not None:
+                            args.append(f.memo.itself)
+                    if f.body.cells:
+                        for i in f.body.cells:
+                            args[i] = Cell(args[i])
+                    if f.recursive:
+                        args.append(f)
+                    frame.ip = ip
+                    frame = Frame(f.body, f.env + [args], base, waiting)
+                    self.frames.append(frame)
+                    instructions = frame.code.instructions
+                    constants = frame.code.constants
+                    env = frame.env
+                    ip = 0
+                elif isinstance(f, PrimOp):
+                    args = stack[len(stack) - argc :]
+                    del stack[len(stack) - argc - 1 :]
+                    push(f.func(args))
+                else:
+                    raise TypeError("Closure")
+            elif op == TAIL_CALL:
+                argc = instructions[ip + 1]
+                f = stack[-argc - 1]
+                if isinstance(f, Closure):
+                    if argc != len(f.parameters):
+                        raise IncorrectArity(len(f.parameters), argc)
+                    # the callee takes over this frame's place, so a chain of
+                    # tail calls never grows self.frames
+                    args = stack[len(stack) - argc :]
+                    waiting = frame.waiting
+                    if f.memo is not None:
+                        key = memo_key(args)
+                        if key is not None:
+                            ret = f.memo.get(key)
+                            if ret is not MISS:
+                                # what follows a tail call returns it
+                                del stack[len(stack) - argc - 1 :]
+                                push(ret)
+                                ip += 2
+                                continue
+                            waiting = (waiting or []) + [(f.memo, key)]
+                        if f.memo.itself is not None:
+                            args.append(f.memo.itself)
+                    if f.body.cells:
+                        for i in f.body.cells:
+                            args[i] = Cell(args[i])
+                    if f.recursive:
+                        args.append(f)
+                    del stack[frame.base :]
+                    frame = Frame(f.body, f.env + [args], frame.base, waiting)
+                    self.frames[-1] = frame
+                    instructions = frame.code.instructions
+                    constants = frame.code.constants
+                    env = frame.env
+                    ip = 0
+                elif isinstance(f, PrimOp):
+                    args = stack[len(stack) - argc :]
+                    del stack[len(stack) - argc - 1 :]
+                    push(f.func(args))
+                    ip += 2
+                else:
+                    raise TypeError("Closure")
+            elif op == RETURN:
+                ret = pop()
+                if frame.waiting:
+                    for memo, key in frame.waiting:
+                        memo.put(key, ret)
+                self.frames.pop()
+                if not self.frames:
+                    return ret
+                del stack[frame.base :]
+                push(ret)
+                frame = self.frames[-1]
+                instructions = frame.code.instructions
+                constants = frame.code.constants
+                env = frame.env
+                ip = frame.ip
+            elif op == CLOSURE:
+                code = constants[instructions[ip + 1]]
+                n = instructions[ip + 2]
+                captured = stack[len(stack) - n :]
+                del stack[len(stack) - n :]
+                # the body's own ENTER sizes its frame, so no body_size here
+                local = env[: len(env) - instructions[ip + 3]] + [captured]
+                memo = auto_memo(code.line) if code.memo else None
+                push(Closure(code.params, code, 0, local, recursive=code.recursive, memo=memo))
+                ip += 4
+            elif op == CELL:
+                slot = instructions[ip + 1]
+                if env[-1][slot] is None:
+                    env[-1][slot] = Cell(None)
+                ip += 2
+            elif op == UNIT:
+                push(Unit())
+                ip += 1
+            elif op == FIELD:
+                tb = pop()
+                if not isinstance(tb, Hashmap):
+                    raise TypeError("HashMap")
+                push(tb.elements[constants[instructions[ip + 1]]])
+                ip += 2
+            elif op == INDEX:
+                index = pop()
+                tb = pop()
+                push(self.index(tb, index))
+                ip += 1
+            elif op == ARRAY:
+                n = instructions[ip + 1]
+                elements = stack[len(stack) - n :]
+                del stack[len(stack) - n :]
+                push(Array(elements))
+                ip += 2
+            elif op == HASH:
+                n = instructions[ip + 1]
+                items = stack[len(stack) - 2 * n :]
+                del stack[len(stack) - 2 * n :]
+                push(Hashmap(dict(zip(items[::2], items[1::2]))))
+                ip += 2
+            else:
+                raise ValueError(f"Unknown opcode {op}")
+
+    def index(self, tb: Value, index: Value) -> Value:
+        match tb:
+            case Hashmap(elements=elements):
+                return elements[index]
+            case Array(elements=elements):
+                match index:
+                    case Num(value=int(ix)):
+                        return elements[ix]
+                    case _:
+                        raise TypeError("Int")
+            case _:
+                raise TypeError("Subscriptable (Array / HashMap)")
+
+
+def disassemble(code: Code) -> str:
+    lines = [f"== {code.name} =="]
+    nested = []
+    ip = 0
+    while ip < len(code.instructions):
+        op = Op(code.instructions[ip])
+        args = code.instructions[ip + 1 : ip + 1 + ARGS[op]]
+        line = f"{ip:>5}  {op.name:<14}{' '.join(str(a) for a in args)}"
+        match op:
+            case Op.CONST | Op.FIELD | Op.CLOSURE:
+                const = code.constants[args[0]]
+                line += f"  ({const})"
+                if isinstance(const, Code):
+                    nested.append(const)
+        lines.append(line)
+        ip += 1 + ARGS[op]
+    for c in nested:
+        lines.append("")
+        lines.append(disassemble(c))
+    return "\n".join(lines)